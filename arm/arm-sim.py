@@ -12,7 +12,7 @@ from pydgin.sim     import Sim, init_sim
 from pydgin.storage import Memory
 from pydgin.misc    import load_program, FatalError
 from bootstrap      import syscall_init, memory_size
-from instruction    import Instruction
+from instruction    import Instruction, writes_pc
 from isa            import decode
 
 #-------------------------------------------------------------------------
@@ -25,6 +25,12 @@ class ArmSim( Sim ):
   def __init__( self ):
     Sim.__init__( self, "ARM", jit_enabled=True )
 
+    # branch and jump instructions, for the per-region stats, which also
+    # count the instructions that write the pc as branches
+
+    self.branch_insts = [ 'b', 'bl', 'bx', 'blx1', 'blx2' ]
+    self.writes_pc    = writes_pc
+
   #-----------------------------------------------------------------------
   # decode
   #-----------------------------------------------------------------------
@@ -44,6 +50,7 @@ class ArmSim( Sim ):
 
   def pre_execute( self ):
     if self.debug.enabled( "rf" ):
+      self.state.materialize_flags()
       print ':: RD.CPSR = %s%s%s%s' % (
         'N' if self.state.N else '-',
         'Z' if self.state.Z else '-',
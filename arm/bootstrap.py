@@ -166,14 +166,13 @@ def syscall_init( mem, entrypoint, breakpoint, argv, envp, debug ):
   # utility functions
 
   def str_to_mem( mem, val, addr ):
-    for i, char in enumerate(val+'\0'):
-      mem.write( addr + i, 1, ord( char ) )
+    mem.write_bytes( addr, val + '\0' )
     return addr + len(val) + 1
 
   def int_to_mem( mem, val, addr ):
     # TODO properly handle endianess
-    for i in range( 4 ):
-      mem.write( addr+i, 1, (val >> 8*i) & 0xFF )
+    mem.write_bytes( addr, ''.join( [ chr( (val >> 8*i) & 0xFF )
+                                      for i in range( 4 ) ] ) )
     return addr + 4
 
   # write end marker to memory
@@ -222,10 +221,8 @@ def syscall_init( mem, entrypoint, breakpoint, argv, envp, debug ):
 
   # write zeros to bottom of stack
   # TODO: why does gem5 do this?
-  offset = stack_off[7] - 1
-  while offset >= stack_ptr:
-    mem.write( offset, 1, ord( '\0' ) )
-    offset -= 1
+  if stack_off[7] > stack_ptr:
+    mem.write_bytes( stack_ptr, '\0' * ( stack_off[7] - stack_ptr ) )
 
   # initialize processor state
   state = State( mem, debug, reset_addr=0x1000 )
@@ -248,7 +245,7 @@ def syscall_init( mem, entrypoint, breakpoint, argv, envp, debug ):
 
   # TODO: where should this go?
   #state.pc         = entrypoint
-  state.breakpoint = r_uint( breakpoint )
+  mem.set_breakpoint( r_uint( breakpoint ) )
 
   # initialize processor registers
   state.rf[  0 ] = 0            # ptr to func to run when program exits, disable
@@ -2,116 +2,89 @@
 # instruction.py
 #=======================================================================
 
+from utils import decode_shifter_operand, decode_shifted_register, \
+                  rotate_right, popcount
+
+#-----------------------------------------------------------------------
+# Instruction
+#-----------------------------------------------------------------------
+# All instruction fields are extracted once when the instruction is
+# decoded, and the instructions are then reused from the decode cache.
+# We also classify the operand form of the instruction here, so that
+# executing a data-processing instruction calls the function for its
+# form (e.g., rotated immediate or register shifted by immediate)
+# directly instead of testing the instruction bits again.
 
 class Instruction( object ):
+  __slots__ = [ 'bits', 'str', 'cond', 'rn', 'rd', 'rm', 'rs', 'shift',
+                'shift_amt', 'rotate', 'imm_8', 'imm_12', 'imm_24',
+                'imm_H', 'imm_L', 'register_list', 'register_count',
+                'cp_num', 'opcode', 'opcode_1', 'opcode_2', 'I', 'P',
+                'U', 'B', 'W', 'S', 'SH', 'R', 'imm_operand', 'imm_cout',
+                'shifter_operand', 'shifted_register' ]
+  _immutable_fields_ = __slots__
 
   def __init__( self, bits, str ):
     self.bits = bits
     self.str  = str
 
-  @property
-  def cond( self ):
-    return (self.bits >> 28) & 0xF
-
-  @property
-  def rn( self ):
-    return (self.bits >> 16) & 0xF
-
-  @property
-  def rd( self ):
-    return (self.bits >> 12) & 0xF
-
-  @property
-  def rm( self ):
-    return self.bits & 0xF
-
-  @property
-  def rs( self ):
-    return (self.bits >> 8) & 0xF
-
-  @property
-  def shift( self ):
-    return (self.bits >> 5) & 0b11
-
-  @property
-  def shift_amt( self ):
-    return (self.bits >> 7) & 0x1F
-
-  @property
-  def rotate( self ):
-    return (self.bits >> 8) & 0xF
-
-  @property
-  def imm_8( self ):
-    return self.bits & 0xFF
-
-  @property
-  def imm_12( self ):
-    return self.bits & 0xFFF
-
-  @property
-  def imm_24( self ):
-    return self.bits & 0xFFFFFF
-
-  @property
-  def imm_H( self ):
-    return (self.bits >> 8) & 0xF
-
-  @property
-  def imm_L( self ):
-    return self.bits & 0xF
-
-  @property
-  def register_list( self ):
-    return self.bits & 0xFFFF
-
-  @property
-  def cp_num( self ):
-    return (self.bits >> 8) & 0xF
-
-  @property
-  def opcode( self ):
-    return (self.bits >> 21) & 0xF
-
-  @property
-  def opcode_1( self ):
-    return (self.bits >> 20) & 0x1F
-
-  @property
-  def opcode_2( self ):
-    return (self.bits >> 5) & 0b111
-
-  @property
-  def I( self ):
-    return (self.bits >> 25) & 0b1
-
-  @property
-  def P( self ):
-    return (self.bits >> 24) & 0b1
-
-  @property
-  def U( self ):
-    return (self.bits >> 23) & 0b1
-
-  @property
-  def B( self ):
-    return (self.bits >> 22) & 0b1
-
-  @property
-  def W( self ):
-    return (self.bits >> 21) & 0b1
-
-  #def L( self ):
-  #  return (self.bits >> 20) & 0b1
-
-  @property
-  def S( self ):
-    return (self.bits >> 20) & 0b1
-
-  @property
-  def SH( self ):
-    return (self.bits >> 5) & 0b11
-
-  @property
-  def R( self ):
-    return (self.bits >> 22) & 0b1
+    self.cond          = (bits >> 28) & 0xF
+    self.rn            = (bits >> 16) & 0xF
+    self.rd            = (bits >> 12) & 0xF
+    self.rm            = bits & 0xF
+    self.rs            = (bits >> 8) & 0xF
+    self.shift         = (bits >> 5) & 0b11
+    self.shift_amt     = (bits >> 7) & 0x1F
+    self.rotate        = (bits >> 8) & 0xF
+    self.imm_8         = bits & 0xFF
+    self.imm_12        = bits & 0xFFF
+    self.imm_24        = bits & 0xFFFFFF
+    self.imm_H         = (bits >> 8) & 0xF
+    self.imm_L         = bits & 0xF
+    self.register_list = bits & 0xFFFF
+    self.cp_num        = (bits >> 8) & 0xF
+    self.opcode        = (bits >> 21) & 0xF
+    self.opcode_1      = (bits >> 20) & 0x1F
+    self.opcode_2      = (bits >> 5) & 0b111
+    self.I             = (bits >> 25) & 0b1
+    self.P             = (bits >> 24) & 0b1
+    self.U             = (bits >> 23) & 0b1
+    self.B             = (bits >> 22) & 0b1
+    self.W             = (bits >> 21) & 0b1
+    #self.L            = (bits >> 20) & 0b1
+    self.S             = (bits >> 20) & 0b1
+    self.SH            = (bits >> 5) & 0b11
+    self.R             = (bits >> 22) & 0b1
+
+    self.register_count = popcount( self.register_list )
+
+    # the rotated immediate of data-processing instructions and its
+    # carry out, the carry out is only used for non-zero rotations
+
+    self.imm_operand = rotate_right( self.imm_8, self.rotate * 2 )
+    self.imm_cout    = (self.imm_operand >> 31) & 1
+
+    # operand functions, see utils.py
+
+    self.shifter_operand  = decode_shifter_operand( self )
+    self.shifted_register = decode_shifted_register( self )
+
+#-----------------------------------------------------------------------
+# writes_pc
+#-----------------------------------------------------------------------
+# Returns True if inst writes the pc through its destination register
+# (e.g., mov pc, lr or ldr pc, [sp], #4) or its register list (e.g.,
+# pop {r4, pc}), so that the stats count it as a branch like b and bx.
+
+dest_insts = {}
+for mnemonic in [ 'adc', 'add', 'and', 'bic', 'eor', 'mov', 'mvn', 'orr',
+                  'rsb', 'rsc', 'sbc', 'sub', 'ldr', 'ldrb', 'ldrbt',
+                  'ldrh', 'ldrsb', 'ldrsh', 'ldrt' ]:
+  dest_insts[ mnemonic ] = True
+
+def writes_pc( inst ):
+  if inst.str in dest_insts:
+    return inst.rd == 15
+  if inst.str == 'ldm1' or inst.str == 'ldm3':
+    return (inst.register_list >> 15) & 1 == 1
+  return False
@@ -14,17 +14,12 @@ from pydgin.utils import (
 )
 # arm-specific utils
 from utils import (
-  shifter_operand,
   condition_passed,
-  carry_from,
-  borrow_from,
-  not_borrow_from,
-  overflow_from_add,
-  overflow_from_sub,
   sext_30,
   addressing_mode_2,
   addressing_mode_3,
   addressing_mode_4,
+  CARRY_UNCHANGED,
 )
 
 from instruction import *
@@ -108,20 +103,6 @@ reg_map = {
 encodings = [
   ['nop',      '00000000000000000000000000000000'],
 
-  # TODO: These instructions have manually been moved to avoid incorrect
-  # decodings caused by encoding ambiguity. Ideally our decoder generator
-  # would be able to handle this automatically!
-  ['mul',      'xxxx0000000xxxxx0000xxxx1001xxxx'], # ambiguous with and
-  ['strh',     'xxxx000xxxx0xxxxxxxxxxxx1011xxxx'], # ambiguous with orr
-  ['ldrh',     'xxxx000xxxx1xxxxxxxxxxxx1011xxxx'], # ambiguous with bic
-  ['ldrsb',    'xxxx000xxxx1xxxxxxxxxxxx1101xxxx'], # ambiguous with bic
-  ['ldrsh',    'xxxx000xxxx1xxxxxxxxxxxx1111xxxx'], # ambiguous with bic
-  ['mla',      'xxxx0000001xxxxxxxxxxxxx1001xxxx'], # ambiguous with eor
-  ['umull',    'xxxx0000100xxxxxxxxxxxxx1001xxxx'], # ambiguous with add
-  ['umlal',    'xxxx0000101xxxxxxxxxxxxx1001xxxx'], # ambiguous with adc
-  ['smlal',    'xxxx0000111xxxxxxxxxxxxx1001xxxx'], # ambiguous with rsc
-  ['smull',    'xxxx0000110xxxxxxxxxxxxx1001xxxx'], # ambiguous with sbc
-
   ['adc',      'xxxx00x0101xxxxxxxxxxxxxxxxxxxxx'], # v4
   ['add',      'xxxx00x0100xxxxxxxxxxxxxxxxxxxxx'], # v4
   ['and',      'xxxx00x0000xxxxxxxxxxxxxxxxxxxxx'], # v4
@@ -151,15 +132,15 @@ encodings = [
   ['ldrbt',    'xxxx01x0x111xxxxxxxxxxxxxxxxxxxx'], # v4
 #?['ldrd',     'xxxx000puiw0xxxxxxxxxxxx1101xxxx'], # v5TE
 # ['ldrex',    'xxxx000110001xxxxxxx111110011111'], # v6
-# ['ldrh',     'xxxx000xxxx1xxxxxxxxxxxx1011xxxx'], # v4, SEE ABOVE
-# ['ldrsb',    'xxxx000xxxx1xxxxxxxxxxxx1101xxxx'], # v4, SEE ABOVE
-# ['ldrsh',    'xxxx000xxxx1xxxxxxxxxxxx1111xxxx'], # v4, SEE ABOVE
+  ['ldrh',     'xxxx000xxxx1xxxxxxxxxxxx1011xxxx'], # v4
+  ['ldrsb',    'xxxx000xxxx1xxxxxxxxxxxx1101xxxx'], # v4
+  ['ldrsh',    'xxxx000xxxx1xxxxxxxxxxxx1111xxxx'], # v4
   ['ldrt',     'xxxx01x0x011xxxxxxxxxxxxxxxxxxxx'], # v4
   ['mcr',      'xxxx1110xxx0xxxxxxxxxxxxxxx1xxxx'], # v4
   ['mcr2',     '11111110xxx0xxxxxxxxxxxxxxx1xxxx'], # v5T
   ['mcrr',     'xxxx11000100xxxxxxxxxxxxxxxxxxxx'], # v5TE
   ['mcrr2',    '111111000100xxxxxxxxxxxxxxxxxxxx'], # v6
-# ['mla',      'xxxx0000001xxxxxxxxxxxxx1001xxxx'], # v4, SEE ABOVE
+  ['mla',      'xxxx0000001xxxxxxxxxxxxx1001xxxx'], # v4
   ['mov',      'xxxx00x1101x0000xxxxxxxxxxxxxxxx'], # v4
   ['mrc',      'xxxx1110xxx1xxxxxxxxxxxxxxx1xxxx'], # v4
   ['mrc2',     '11111110xxx1xxxxxxxxxxxxxxx1xxxx'], # v5T
@@ -167,7 +148,7 @@ encodings = [
 # ['mrrc2',    '111111000101xxxxxxxxxxxxxxxxxxxx'], # v6
   ['mrs',      'xxxx00010x001111xxxx000000000000'], # v4
   ['msr',      'xxxx00x10x10xxxx1111xxxxxxxxxxxx'], # v4, TODO
-# ['mul',      'xxxx0000000xxxxx0000xxxx1001xxxx'], # v4, SEE ABOVE
+  ['mul',      'xxxx0000000xxxxx0000xxxx1001xxxx'], # v4
   ['mvn',      'xxxx00x1111x0000xxxxxxxxxxxxxxxx'], # v4
   ['orr',      'xxxx00x1100xxxxxxxxxxxxxxxxxxxxx'], # v4
 # ['pkhbt',    'xxxx01101000xxxxxxxxxxxxx001xxxx'], # v6
@@ -203,7 +184,7 @@ encodings = [
 # ['shsub8',   'xxxx01100011xxxxxxxx11111111xxxx'], # v6
 # ['shsubaddx','xxxx01100011xxxxxxxx11110101xxxx'], # v6
 # ['smlad',    'xxxx01110000xxxxxxxxxxxx00x1xxxx'], # v6
-# ['smlal',    'xxxx0000111xxxxxxxxxxxxx1001xxxx'], # v4, SEE ABOVE
+  ['smlal',    'xxxx0000111xxxxxxxxxxxxx1001xxxx'], # v4
 # ['smlald',   'xxxx01110100xxxxxxxxxxxx00x1xxxx'], # v6
 
 #?['smla_xy',  'xxxx00010000xxxxxxxxxxxx1xx0xxxx'], # v5TE
@@ -215,7 +196,7 @@ encodings = [
 # ['smmls',    'xxxx01110101xxxxxxxxxxxx11x1xxxx'], # v6
 # ['smmul',    'xxxx01110101xxxx1111xxxx00x1xxxx'], # v6
 # ['smuad',    'xxxx01110000xxxx1111xxxx00x1xxxx'], # v6
-# ['smull',    'xxxx0000110xxxxxxxxxxxxx1001xxxx'], # v4, SEE ABOVE
+  ['smull',    'xxxx0000110xxxxxxxxxxxxx1001xxxx'], # v4
 #?['smul_xy',  'xxxx00010110xxxx0000xxxx1xx0xxxx'], # v5TE
 #?['smulw',    'xxxx00010010xxxx0000xxxx1x10xxxx'], # v5TE
 # ['smusd',    'xxxx01110000xxxx1111xxxx01x1xxxx'], # v6
@@ -235,7 +216,7 @@ encodings = [
 #?['strd',     'xxxx000xxxx0xxxxxxxxxxxx1111xxxx'], # v5TE
 # ['strex',    'xxxx00011000xxxxxxxx11111001xxxx'], # v6
 
-# ['strh',     'xxxx000xxxx0xxxxxxxxxxxx1011xxxx'], # v4, SEE ABOVE
+  ['strh',     'xxxx000xxxx0xxxxxxxxxxxx1011xxxx'], # v4
   ['strt',     'xxxx01x0x010xxxxxxxxxxxxxxxxxxxx'], # v4
   ['sub',      'xxxx00x0010xxxxxxxxxxxxxxxxxxxxx'], # v4
   ['swi',      'xxxx1111xxxxxxxxxxxxxxxxxxxxxxxx'], # v4
@@ -259,8 +240,8 @@ encodings = [
 # ['uhsub8',   'xxxx01100111xxxxxxxx11111111xxxx'], # v6
 # ['uhsubaddx','xxxx01100111xxxxxxxx11110101xxxx'], # v6
 # ['umaal',    'xxxx00000100xxxxxxxxxxxx1001xxxx'], # v6
-# ['umlal',    'xxxx0000101xxxxxxxxxxxxx1001xxxx'], # v4, SEE ABOVE
-# ['umull',    'xxxx0000100xxxxxxxxxxxxx1001xxxx'], # v4, SEE ABOVE
+  ['umlal',    'xxxx0000101xxxxxxxxxxxxx1001xxxx'], # v4
+  ['umull',    'xxxx0000100xxxxxxxxxxxxx1001xxxx'], # v4
 # ['uqadd16',  'xxxx01100110xxxxxxxx11110001xxxx'], # v6
 # ['uqadd8',   'xxxx01100110xxxxxxxx11111001xxxx'], # v6
 # ['uqaddsubx','xxxx01100110xxxxxxxx11110011xxxx'], # v6
@@ -298,16 +279,13 @@ def execute_nop( s, inst ):
 #-----------------------------------------------------------------------
 def execute_adc( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _) = s.rf[ inst.rn ], shifter_operand( s, inst )
-    result  = a + b + s.C
+    a, (b, _) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
+    result  = a + b + s.carry_flag()
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = carry_from( result )
-      s.V = overflow_from_add( a, b, result )
+      s.set_flags_add( a, b, result )
 
     if inst.rd == 15:
       return
@@ -318,16 +296,13 @@ def execute_adc( s, inst ):
 #-----------------------------------------------------------------------
 def execute_add( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _)  = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, _)  = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result   = a + b
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = carry_from( result )
-      s.V = overflow_from_add( a, b, result )
+      s.set_flags_add( a, b, result )
 
     if inst.rd == 15:
       return
@@ -338,16 +313,13 @@ def execute_add( s, inst ):
 #-----------------------------------------------------------------------
 def execute_and( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, cout) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, cout) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result       = a & b
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = cout
-      s.V = s.V
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -379,15 +351,13 @@ def execute_bl( s, inst ):
 #-----------------------------------------------------------------------
 def execute_bic( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, cout) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, cout) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result       = a & trim_32(~b)
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = cout
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -476,13 +446,10 @@ def execute_clz( s, inst ):
 #-----------------------------------------------------------------------
 def execute_cmn( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, _) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result = a + b
 
-    s.N = (result >> 31)&1
-    s.Z = trim_32( result ) == 0
-    s.C = carry_from( result )
-    s.V = overflow_from_add( a, b, result )
+    s.set_flags_add( a, b, result )
 
     if inst.rd == 15:
       return
@@ -493,13 +460,10 @@ def execute_cmn( s, inst ):
 #-----------------------------------------------------------------------
 def execute_cmp( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, _) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result = intmask( a - b )
 
-    s.N = (result >> 31)&1
-    s.Z = trim_32( result ) == 0
-    s.C = not_borrow_from( result )
-    s.V = overflow_from_sub( a, b, result )
+    s.set_flags_sub( a, b, result )
 
     if inst.rd == 15:
       return
@@ -510,16 +474,13 @@ def execute_cmp( s, inst ):
 #-----------------------------------------------------------------------
 def execute_eor( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, cout) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, cout) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result       = a ^ b
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = cout
-      s.V = s.V
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -711,10 +672,13 @@ def execute_ldrt( s, inst ):
 #-----------------------------------------------------------------------
 # mcr
 #-----------------------------------------------------------------------
+# We only model register c0 of coprocessor 7, which enables stats when
+# set to a non-zero value ( mcr p7, 0, Rd, c0, c0, 0 ).
 def execute_mcr( s, inst ):
-  raise FatalError('"mcr" instruction unimplemented!')
+  if inst.cp_num != 7 or inst.rn != 0:
+    raise FatalError('"mcr" instruction unimplemented!')
   if condition_passed( s, inst.cond ):
-    pass
+    s.stats_en = s.rf[ inst.rd ]
   s.rf[PC] = s.fetch_pc() + 4
 
 #-----------------------------------------------------------------------
@@ -755,8 +719,7 @@ def execute_mla( s, inst ):
     s.rf[ inst.rn ] = result
 
     if inst.S:
-      s.N = (result >> 31)&1
-      s.Z = result == 0
+      s.set_flags_logic( result, CARRY_UNCHANGED )
 
   s.rf[PC] = s.fetch_pc() + 4
 
@@ -770,14 +733,11 @@ def execute_mov( s, inst ):
     # else:                        UNPREDICTABLE
       raise FatalError('UNPREDICTABLE in user and system mode!')
 
-    result, cout = shifter_operand( s, inst )
+    result, cout = inst.shifter_operand( s, inst )
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = cout
-      s.V = s.V
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -832,8 +792,7 @@ def execute_mul( s, inst ):
       if inst.rn == 15: raise FatalError('UNPREDICTABLE')
       if inst.rm == 15: raise FatalError('UNPREDICTABLE')
       if inst.rs == 15: raise FatalError('UNPREDICTABLE')
-      s.N = (result >> 31)&1
-      s.Z = result == 0
+      s.set_flags_logic( result, CARRY_UNCHANGED )
 
     if inst.rd == 15:
       return
@@ -844,16 +803,13 @@ def execute_mul( s, inst ):
 #-----------------------------------------------------------------------
 def execute_mvn( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, cout = shifter_operand( s, inst )
+    a, cout = inst.shifter_operand( s, inst )
     result  = trim_32( ~a )
     s.rf[ inst.rd ] = result
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = cout
-      s.V = s.V
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -864,16 +820,13 @@ def execute_mvn( s, inst ):
 #-----------------------------------------------------------------------
 def execute_orr( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, cout) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, cout) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result     = a | b
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = cout
-      s.V = s.V
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -884,16 +837,13 @@ def execute_orr( s, inst ):
 #-----------------------------------------------------------------------
 def execute_rsb( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, _) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result  = intmask( b - a )
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = not_borrow_from( result )
-      s.V = overflow_from_sub( b, a, result )
+      s.set_flags_sub( b, a, result )
 
     if inst.rd == 15:
       return
@@ -904,16 +854,13 @@ def execute_rsb( s, inst ):
 #-----------------------------------------------------------------------
 def execute_rsc( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _) = s.rf[ inst.rn ], shifter_operand( s, inst )
-    result  = intmask( b - a - (not s.C) )
+    a, (b, _) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
+    result  = intmask( b - a - (not s.carry_flag()) )
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = not_borrow_from( result )
-      s.V = overflow_from_sub( b, a, result )
+      s.set_flags_sub( b, a, result )
 
     if inst.rd == 15:
       return
@@ -924,16 +871,13 @@ def execute_rsc( s, inst ):
 #-----------------------------------------------------------------------
 def execute_sbc( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _) = s.rf[ inst.rn ], shifter_operand( s, inst )
-    result  = intmask( a - b - (not s.C) )
+    a, (b, _) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
+    result  = intmask( a - b - (not s.carry_flag()) )
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = not_borrow_from( result )
-      s.V = overflow_from_sub( a, b, result )
+      s.set_flags_sub( a, b, result )
 
     if inst.rd == 15:
       return
@@ -960,6 +904,7 @@ def execute_smlal( s, inst ):
     s.rf[ RdLo ] = trim_32( result )
 
     if inst.S:
+      s.materialize_flags()
       s.N = (result >> 63)&1
       s.Z = (s.rf[RdHi] == s.rf[RdLo] == 0)
   s.rf[PC] = s.fetch_pc() + 4
@@ -984,6 +929,7 @@ def execute_smull( s, inst ):
     s.rf[ RdLo ] = trim_32( result )
 
     if inst.S:
+      s.materialize_flags()
       s.N = (result >> 63)&1
       s.Z = result == 0
   s.rf[PC] = s.fetch_pc() + 4
@@ -1105,16 +1051,13 @@ def execute_strt( s, inst ):
 #-----------------------------------------------------------------------
 def execute_sub( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, _) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, _) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result  = intmask( a - b )
     s.rf[ inst.rd ] = trim_32( result )
 
     if inst.S:
       if inst.rd == 15: raise FatalError('Writing SPSR not implemented!')
-      s.N = (result >> 31)&1
-      s.Z = trim_32( result ) == 0
-      s.C = not_borrow_from( result )
-      s.V = overflow_from_sub( a, b, result )
+      s.set_flags_sub( a, b, result )
 
     if inst.rd == 15:
       return
@@ -1155,13 +1098,11 @@ def execute_swpb( s, inst ):
 #-----------------------------------------------------------------------
 def execute_teq( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, cout) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, cout) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result = trim_32( a ^ b )
 
     if inst.S:
-      s.N = (result >> 31)&1
-      s.Z = result == 0
-      s.C = cout
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -1172,13 +1113,11 @@ def execute_teq( s, inst ):
 #-----------------------------------------------------------------------
 def execute_tst( s, inst ):
   if condition_passed( s, inst.cond ):
-    a, (b, cout) = s.rf[ inst.rn ], shifter_operand( s, inst )
+    a, (b, cout) = s.rf[ inst.rn ], inst.shifter_operand( s, inst )
     result = trim_32( a & b )
 
     if inst.S:
-      s.N = (result >> 31)&1
-      s.Z = result == 0
-      s.C = cout
+      s.set_flags_logic( result, cout )
 
     if inst.rd == 15:
       return
@@ -1205,6 +1144,7 @@ def execute_umlal( s, inst ):
     s.rf[ RdLo ] = trim_32( result )
 
     if inst.S:
+      s.materialize_flags()
       s.N = (result >> 63)&1
       s.Z = (s.rf[RdHi] == s.rf[RdLo] == 0)
   s.rf[PC] = s.fetch_pc() + 4
@@ -1229,6 +1169,7 @@ def execute_umull( s, inst ):
     s.rf[ RdLo ] = trim_32( result )
 
     if inst.S:
+      s.materialize_flags()
       s.N = (result >> 63)&1
       s.Z = (s.rf[RdHi] == s.rf[RdLo] == 0)
   s.rf[PC] = s.fetch_pc() + 4
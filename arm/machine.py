@@ -5,13 +5,23 @@
 from pydgin.machine import Machine
 from pydgin.storage import RegisterFile
 from pydgin.debug   import pad, pad_hex
-from pydgin.utils   import r_uint, specialize
+from pydgin.utils   import r_uint, specialize, intmask, trim_32
+from utils          import carry_from, not_borrow_from, overflow_from_add, \
+                           overflow_from_sub, CARRY_UNCHANGED
+
+# operations which produced the condition flags, see State
+
+FLAGS_VALID = 0
+FLAGS_ADD   = 1
+FLAGS_SUB   = 2
+FLAGS_LOGIC = 3
 
 #-----------------------------------------------------------------------
 # State
 #-----------------------------------------------------------------------
 class State( Machine ):
-  _virtualizable_ = ['pc', 'num_insts', 'N', 'Z', 'C', 'V']
+  _virtualizable_ = ['pc', 'num_insts', 'N', 'Z', 'C', 'V', 'flags_op',
+                     'flags_a', 'flags_b', 'flags_result']
   def __init__( self, memory, debug, reset_addr=0x400 ):
     Machine.__init__(self,
                      memory,
@@ -41,19 +51,114 @@ class State( Machine ):
     # 0b11111     sys
     self.mode = r_uint( 0b10000 )
 
-    # syscall stuff... TODO: should this be here?
-    self.breakpoint = 0
+    # the condition flags are evaluated lazily: flag-setting
+    # instructions record their operation, operands and result, and
+    # NZCV is only computed when the flags are read. N, Z, C and V are
+    # only up to date if flags_op is FLAGS_VALID, for FLAGS_LOGIC C and
+    # V are up to date as well.
+
+    self.flags_op     = FLAGS_VALID
+    self.flags_a      = r_uint( 0 )
+    self.flags_b      = r_uint( 0 )
+    self.flags_result = r_uint( 0 )
 
   def fetch_pc( self ):
     return self.pc
 
   def cpsr( self ):
+    self.materialize_flags()
     return ( r_uint( self.N ) << 31 ) | \
            ( r_uint( self.Z ) << 30 ) | \
            ( r_uint( self.C ) << 29 ) | \
            ( r_uint( self.V ) << 28 ) | \
            ( r_uint( self.mode ) )
 
+  #---------------------------------------------------------------------
+  # set_flags_add, set_flags_sub, set_flags_logic
+  #---------------------------------------------------------------------
+  # Record the result of a flag-setting instruction. The result of
+  # set_flags_add is the untrimmed sum of a, b and the carry in, the
+  # result of set_flags_sub is the signed difference of a, b and the
+  # borrow in. Logical operations only set N, Z and the shifter carry
+  # out cout, which is CARRY_UNCHANGED if C keeps its value.
+
+  def set_flags_add( self, a, b, result ):
+    self.flags_op     = FLAGS_ADD
+    self.flags_a      = a
+    self.flags_b      = b
+    self.flags_result = r_uint( result )
+
+  def set_flags_sub( self, a, b, result ):
+    self.flags_op     = FLAGS_SUB
+    self.flags_a      = a
+    self.flags_b      = b
+    self.flags_result = r_uint( result )
+
+  def set_flags_logic( self, result, cout ):
+    if self.flags_op != FLAGS_LOGIC:
+      self.materialize_flags()
+    if cout != CARRY_UNCHANGED:
+      self.C = cout
+    self.flags_op     = FLAGS_LOGIC
+    self.flags_result = r_uint( result )
+
+  #---------------------------------------------------------------------
+  # materialize_flags
+  #---------------------------------------------------------------------
+  # Computes N, Z, C and V from the recorded operation.
+
+  def materialize_flags( self ):
+    op = self.flags_op
+    if op == FLAGS_VALID:
+      return
+
+    result = self.flags_result
+    if   op == FLAGS_ADD:
+      self.C = carry_from( result )
+      self.V = overflow_from_add( self.flags_a, self.flags_b, result )
+    elif op == FLAGS_SUB:
+      self.C = not_borrow_from( intmask( result ) )
+      self.V = overflow_from_sub( self.flags_a, self.flags_b,
+                                  intmask( result ) )
+    self.N = (result >> 31)&1
+    self.Z = trim_32( result ) == 0
+    self.flags_op = FLAGS_VALID
+
+  #---------------------------------------------------------------------
+  # zero_flag, carry_flag
+  #---------------------------------------------------------------------
+  # Read a single flag, computing only what is needed.
+
+  def zero_flag( self ):
+    if self.flags_op == FLAGS_VALID:
+      return self.Z
+    return trim_32( self.flags_result ) == 0
+
+  def carry_flag( self ):
+    if self.flags_op == FLAGS_ADD or self.flags_op == FLAGS_SUB:
+      self.materialize_flags()
+    return self.C
+
+  def save_checkpoint( self, ckpt ):
+    self.materialize_flags()
+    Machine.save_checkpoint( self, ckpt )
+    ckpt.write_int( self.N )
+    ckpt.write_int( self.Z )
+    ckpt.write_int( self.C )
+    ckpt.write_int( self.V )
+    ckpt.write_int( self.mode )
+    ckpt.write_int( self.mem.get_breakpoint() )
+
+  def restore_checkpoint( self, ckpt ):
+    Machine.restore_checkpoint( self, ckpt )
+    self.N        = ckpt.read_uint()
+    self.Z        = ckpt.read_uint()
+    self.C        = ckpt.read_uint()
+    self.V        = ckpt.read_uint()
+    self.mode     = ckpt.read_uint()
+    self.flags_op = FLAGS_VALID
+    self.mem.set_breakpoint( ckpt.read_uint() )
+
 #-----------------------------------------------------------------------
 # ArmRegisterFile
 #-----------------------------------------------------------------------
@@ -86,6 +191,10 @@ class ArmRegisterFile( RegisterFile ):
         print ':: WR.RF[15] = %s' % ( pad_hex( value ) ),
     else:
       self.regs[idx] = value
+      # writes to the pc are not traced, the pc of the next instruction
+      # is in its trace record
+      if self.debug.trace is not None:
+        self.debug.trace.reg_write( idx, value )
       if self.debug.enabled( "rf" ):
         print ':: WR.RF[%s] = %s' % (
                           pad( "%d" % idx, 2 ),
@@ -95,6 +204,7 @@ class ArmRegisterFile( RegisterFile ):
   # we also print the status flags on print_regs
   def print_regs( self, per_row=6 ):
     RegisterFile.print_regs( self, per_row )
+    self.state.materialize_flags()
     print '%s%s%s%s' % (
       'N' if self.state.N else '-',
       'Z' if self.state.Z else '-',
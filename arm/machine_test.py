@@ -0,0 +1,138 @@
+#=======================================================================
+# machine_test.py
+#=======================================================================
+
+import os
+import sys
+import random
+
+sys.path.append( os.path.join( os.path.dirname( __file__ ), ".." ) )
+
+from pydgin.debug   import Debug
+from pydgin.storage import Memory
+from isa            import decode
+from instruction    import Instruction
+from machine        import State
+from utils          import condition_passed
+
+#-----------------------------------------------------------------------
+# eager reference
+#-----------------------------------------------------------------------
+# The flags of the data-processing instructions computed right away,
+# following AddWithCarry of the ARM ARM rather than the helpers of
+# utils.py.
+
+MASK = 0xFFFFFFFF
+
+OPCODES = [ 'and', 'eor', 'sub', 'rsb', 'add', 'adc', 'sbc', 'rsc',
+            'tst', 'teq', 'cmp', 'cmn', 'orr', 'mov', 'bic', 'mvn' ]
+
+class EagerFlags( object ):
+
+  def __init__( self ):
+    self.N = 0
+    self.Z = 0
+    self.C = 0
+    self.V = 0
+
+  def add_with_carry( self, x, y, carry_in ):
+    total  = x + y + carry_in
+    result = total & MASK
+    self.C = int( total > MASK )
+    self.V = int( x >> 31 == y >> 31 and result >> 31 != x >> 31 )
+    return result
+
+  def execute( self, op, a, b, cout ):
+    if   op == 'add' or op == 'cmn': result = self.add_with_carry( a, b, 0 )
+    elif op == 'adc': result = self.add_with_carry( a, b, self.C )
+    elif op == 'sub' or op == 'cmp':
+      result = self.add_with_carry( a, ~b & MASK, 1 )
+    elif op == 'sbc': result = self.add_with_carry( a, ~b & MASK, self.C )
+    elif op == 'rsb': result = self.add_with_carry( b, ~a & MASK, 1 )
+    elif op == 'rsc': result = self.add_with_carry( b, ~a & MASK, self.C )
+    else:
+      if   op == 'and' or op == 'tst': result = a & b
+      elif op == 'eor' or op == 'teq': result = a ^ b
+      elif op == 'orr': result = a | b
+      elif op == 'bic': result = a & ~b & MASK
+      elif op == 'mov': result = b
+      elif op == 'mvn': result = ~b & MASK
+      if cout is not None:
+        self.C = cout
+    self.N = result >> 31
+    self.Z = int( result == 0 )
+    return result
+
+  def condition_passed( self, cond ):
+    N, Z, C, V = self.N, self.Z, self.C, self.V
+    return [ Z, not Z, C, not C, N, not N, V, not V, C and not Z,
+             not C or Z, N == V, N != V, not Z and N == V,
+             Z or N != V, True ][ cond ]
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+
+OPERANDS = [ 0, 1, 2, 0x7FFFFFFF, 0x80000000, 0x80000001, 0xFFFFFFFE,
+             0xFFFFFFFF ]
+
+def random_operand( rng ):
+  if rng.random() < 0.5:
+    return rng.choice( OPERANDS )
+  return rng.getrandbits( 32 )
+
+# <op>s r2, r0, r1, lsl #shift_imm, the compares have no destination
+# and mov and mvn no first operand
+
+def encode( op, shift_imm ):
+  opcode = OPCODES.index( op )
+  rd     = 0 if op in [ 'tst', 'teq', 'cmp', 'cmn' ] else 2
+  return ( 0b1110 << 28 ) | ( opcode << 21 ) | ( 1 << 20 ) | ( rd << 12 ) \
+         | ( shift_imm << 7 ) | 1
+
+#-----------------------------------------------------------------------
+# test_lazy_flags
+#-----------------------------------------------------------------------
+# Random sequences of flag-setting instructions, read back through the
+# conditions in random order, must see the flags of the eager
+# reference. Reading only EQ and NE keeps the flags lazy, so that chains
+# of lazily evaluated operations are covered as well.
+
+def test_lazy_flags():
+  rng   = random.Random( 0x5eed )
+  s     = State( Memory( size=2**16 ), Debug() )
+  eager = EagerFlags()
+
+  for i in xrange( 5000 ):
+    op        = rng.choice( OPCODES )
+    shift_imm = rng.choice( [ 0, 0, rng.randint( 1, 31 ) ] )
+    a, b      = random_operand( rng ), random_operand( rng )
+
+    bits = encode( op, shift_imm )
+    inst_str, exec_fun = decode( bits )
+    assert inst_str == op
+
+    s.rf[ 0 ] = a
+    s.rf[ 1 ] = b
+    s.rf[ 2 ] = 0
+    exec_fun( s, Instruction( bits, inst_str ) )
+
+    operand = ( b << shift_imm ) & MASK
+    cout    = None if shift_imm == 0 else ( b >> ( 32 - shift_imm ) ) & 1
+    result  = eager.execute( op, a, operand, cout )
+    if op not in [ 'tst', 'teq', 'cmp', 'cmn' ]:
+      assert s.rf[ 2 ] == result, op
+
+    check = rng.randint( 0, 2 )
+    if check == 1:
+      conds = [ 0b0000, 0b0001 ]
+    elif check == 2:
+      conds = rng.sample( range( 15 ), 15 )
+    else:
+      conds = []
+    for cond in conds:
+      assert bool( condition_passed( s, cond ) ) == \
+             bool( eager.condition_passed( cond ) ), ( i, op, cond )
+    if check == 2:
+      assert s.cpsr() >> 28 == \
+             ( eager.N << 3 ) | ( eager.Z << 2 ) | ( eager.C << 1 ) | eager.V
@@ -61,6 +61,8 @@ syscall_funcs = {
 # 122: common.syscall_uname,
 }
 
+syscall_table = common.make_syscall_table( syscall_funcs )
+
 #-------------------------------------------------------------------------
 # do_syscall
 #-------------------------------------------------------------------------
@@ -68,19 +70,21 @@ syscall_funcs = {
 # extract the syscall arguments, get the syscall handling function, do the
 # syscall, and return the result back into the architectural state.
 def do_syscall( s ):
-  syscall_number = s.rf[ v4 ]
-  arg0 = intmask( s.rf[ a1 ] )
-  arg1 = intmask( s.rf[ a2 ] )
-  arg2 = intmask( s.rf[ a3 ] )
+  syscall_number  = intmask( s.rf[ v4 ] )
+  syscall_handler = common.get_syscall_handler( syscall_table,
+                                                syscall_number )
 
-  if syscall_number not in syscall_funcs:
+  if syscall_handler is None:
     print "WARNING: syscall not implemented: %d" % syscall_number
     # TODO: return an error?
   else:
-    syscall_handler = syscall_funcs[ syscall_number ]
+    arg0 = intmask( s.rf[ a1 ] )
+    arg1 = intmask( s.rf[ a2 ] )
+    arg2 = intmask( s.rf[ a3 ] )
 
     # call the syscall handler and get the return and error values
-    retval, errno = syscall_handler( s, arg0, arg1, arg2 )
+    retval, errno = common.call_syscall( s, syscall_handler, syscall_number,
+                                         arg0, arg1, arg2 )
 
     if s.debug.enabled( "syscalls" ):
       print " retval=%x errno=%x" % ( retval, errno )
@@ -5,14 +5,13 @@
 
 from pydgin.utils import trim_32, r_uint
 from pydgin.misc  import FatalError
-from instruction  import *
 
 #=======================================================================
 # Addressing Mode 1 - Data-processing operands (page A5-2)
 #=======================================================================
 
 #-----------------------------------------------------------------------
-# shifter_operand
+# decode_shifter_operand
 #-----------------------------------------------------------------------
 # For data processing instructions, obtaining the value of the second
 # operand is a non-trivial process.  This operand can either be:
@@ -47,28 +46,36 @@ from instruction  import *
 #   and, eor, sub, rsb, add, adc, sbc, rsc
 #   tst, teq, cmp, cmn, orr, mov, bic, mvn
 #
-def shifter_operand( s, inst ):
+# The form of the operand only depends on the instruction bits, so
+# decode_shifter_operand picks the function computing the operand when
+# the instruction is decoded. Data-processing instructions then call
+# inst.shifter_operand( s, inst ), which returns the operand and the
+# shifter carry out.
+#
+def decode_shifter_operand( inst ):
 
   # 32-bit immediate
   # http://stackoverflow.com/a/2835503
   if   inst.I == 1:
-    rotate_imm = inst.rotate
-    operand    = rotate_right( inst.imm_8, rotate_imm*2 )
-    if rotate_imm == 0: cout = s.C
-    else:               cout = (operand >> 31) & 1
-    return operand, cout
+    if inst.rotate == 0: return shifter_operand_imm
+    else:                return shifter_operand_rotated_imm
 
   # 32-bit register shifted by 5-bit immediate
   elif (inst.bits >>  4 & 0b1) == 0:
-    return shifter_operand_imm( s, inst )
+    return decode_shifted_register( inst )
 
   # 32-bit register shifted by 32-bit register
   elif (inst.bits >>  7 & 0b1) == 0:
-    return shifter_operand_reg( s, inst )
+    return shifter_operand_reg
 
   # Arithmetic or Load/Store instruction extension space
   else:
-    raise FatalError('Not a data-processing instruction! PC: %x' % s.fetch_pc())
+    return shifter_operand_invalid
+
+# Shifter carry out of the forms that pass the C flag through, so that
+# the flags do not need to be evaluated (see State in machine.py)
+
+CARRY_UNCHANGED = r_uint( 2 )
 
 # Shifter constants
 
@@ -78,45 +85,92 @@ ARITH_SHIFT_RIGHT = 0b10
 ROTATE_RIGHT      = 0b11
 
 #-----------------------------------------------------------------------
-# shifter_operand_imm
+# decode_shifted_register
 #-----------------------------------------------------------------------
-def shifter_operand_imm( s, inst ):
+# Returns the function for a register shifted by the 5-bit <shift_imm>,
+# which is also used by the scaled register offsets of addressing mode
+# 2. A zero <shift_imm> has a special meaning for all shifts but the
+# logical shift left.
+#
+def decode_shifted_register( inst ):
   shift_op  = inst.shift
-  Rm        = s.rf[ inst.rm ]
   shift_imm = inst.shift_amt
   assert 0 <= shift_imm <= 31
 
   if   shift_op == LOGIC_SHIFT_LEFT:
-    out  = Rm   if (shift_imm == 0) else Rm << shift_imm
-    cout = s.C  if (shift_imm == 0) else (Rm >> 32 - shift_imm)&1
+    if shift_imm == 0: return shifter_operand_reg_nop
+    else:              return shifter_operand_reg_lsl
 
   elif shift_op == LOGIC_SHIFT_RIGHT:
     # NOTE: shift_imm == 0 signifies a shift by 32
-    out  = 0        if (shift_imm == 0) else Rm >> shift_imm
-    cout = Rm >> 31 if (shift_imm == 0) else (Rm >> shift_imm - 1)&1
+    if shift_imm == 0: return shifter_operand_reg_lsr_32
+    else:              return shifter_operand_reg_lsr
 
   elif shift_op == ARITH_SHIFT_RIGHT:
     # NOTE: shift_imm == 0 signifies a shift by 32
-    if shift_imm == 0:
-      if (Rm >> 31) == 0: out, cout = 0,          Rm >> 31
-      else:               out, cout = 0xFFFFFFFF, Rm >> 31
-    else:
-      out  = arith_shift( Rm, shift_imm )
-      cout = (Rm >> shift_imm - 1)&1
+    if shift_imm == 0: return shifter_operand_reg_asr_32
+    else:              return shifter_operand_reg_asr
 
-  elif shift_op == ROTATE_RIGHT:
+  else:
     # NOTE: shift_imm == 0 signifies a rotate right with extend (RRX)
-    if shift_imm == 0:
-      out  = ( r_uint(s.C) << 31 ) | (Rm >> 1)
-      cout = Rm & 1
-    else:
-      out  = rotate_right( Rm, shift_imm )
-      cout = (Rm >> shift_imm - 1)&1
+    if shift_imm == 0: return shifter_operand_reg_rrx
+    else:              return shifter_operand_reg_ror
 
-  else:
-    raise FatalError('Impossible shift_op!')
+#-----------------------------------------------------------------------
+# shifter_operand_imm, shifter_operand_rotated_imm
+#-----------------------------------------------------------------------
+# The rotated immediate and its carry out are computed at decode time.
 
-  return trim_32(out), cout
+def shifter_operand_imm( s, inst ):
+  return inst.imm_operand, CARRY_UNCHANGED
+
+def shifter_operand_rotated_imm( s, inst ):
+  return inst.imm_operand, inst.imm_cout
+
+#-----------------------------------------------------------------------
+# shifter_operand_reg_*
+#-----------------------------------------------------------------------
+# 32-bit register shifted by the 5-bit immediate.
+
+def shifter_operand_reg_nop( s, inst ):
+  return s.rf[ inst.rm ], CARRY_UNCHANGED
+
+def shifter_operand_reg_lsl( s, inst ):
+  Rm = s.rf[ inst.rm ]
+  return trim_32( Rm << inst.shift_amt ), (Rm >> 32 - inst.shift_amt)&1
+
+def shifter_operand_reg_lsr( s, inst ):
+  Rm = s.rf[ inst.rm ]
+  return Rm >> inst.shift_amt, (Rm >> inst.shift_amt - 1)&1
+
+def shifter_operand_reg_lsr_32( s, inst ):
+  Rm = s.rf[ inst.rm ]
+  return r_uint( 0 ), Rm >> 31
+
+def shifter_operand_reg_asr( s, inst ):
+  Rm = s.rf[ inst.rm ]
+  return trim_32( arith_shift( Rm, inst.shift_amt ) ), \
+         (Rm >> inst.shift_amt - 1)&1
+
+def shifter_operand_reg_asr_32( s, inst ):
+  Rm = s.rf[ inst.rm ]
+  if (Rm >> 31) == 0: return r_uint( 0 ),          Rm >> 31
+  else:               return r_uint( 0xFFFFFFFF ), Rm >> 31
+
+def shifter_operand_reg_ror( s, inst ):
+  Rm = s.rf[ inst.rm ]
+  return rotate_right( Rm, inst.shift_amt ), (Rm >> inst.shift_amt - 1)&1
+
+def shifter_operand_reg_rrx( s, inst ):
+  Rm = s.rf[ inst.rm ]
+  return trim_32( ( r_uint(s.carry_flag()) << 31 ) | (Rm >> 1) ), Rm & 1
+
+#-----------------------------------------------------------------------
+# shifter_operand_invalid
+#-----------------------------------------------------------------------
+
+def shifter_operand_invalid( s, inst ):
+  raise FatalError('Not a data-processing instruction! PC: %x' % s.fetch_pc())
 
 #-----------------------------------------------------------------------
 # shifter_operand_reg
@@ -129,19 +183,19 @@ def shifter_operand_reg( s, inst ):
   out = cout = 0
 
   if   shift_op == LOGIC_SHIFT_LEFT:
-    if   Rs ==  0: out, cout = Rm,       s.C
+    if   Rs ==  0: out, cout = Rm,       CARRY_UNCHANGED
     elif Rs <  32: out, cout = Rm << Rs, (Rm >> 32 - Rs)&1
     elif Rs == 32: out, cout = 0,        (Rm)&1
     elif Rs >  32: out, cout = 0,        0
 
   elif shift_op == LOGIC_SHIFT_RIGHT:
-    if   Rs ==  0: out, cout = Rm,       s.C
+    if   Rs ==  0: out, cout = Rm,       CARRY_UNCHANGED
     elif Rs <  32: out, cout = Rm >> Rs, (Rm >> (Rs-1))&1
     elif Rs == 32: out, cout = 0,        (Rm >> 31)&1
     elif Rs >  32: out, cout = 0,        0
 
   elif shift_op == ARITH_SHIFT_RIGHT:
-    if   Rs ==  0: out, cout = Rm,       s.C
+    if   Rs ==  0: out, cout = Rm,       CARRY_UNCHANGED
     elif Rs <  32:
       out  = arith_shift( Rm, Rs )
       cout = (Rm >> (Rs-1))&1
@@ -151,7 +205,7 @@ def shifter_operand_reg( s, inst ):
 
   elif shift_op == ROTATE_RIGHT:
     Rs4 = Rs & 0b1111
-    if   Rs  == 0: out, cout = Rm,                    s.C
+    if   Rs  == 0: out, cout = Rm,                    CARRY_UNCHANGED
     elif Rs4 == 0: out, cout = Rm,                    (Rm >> 31)&1
     elif Rs4 >  0: out, cout = rotate_right(Rm, Rs4), (Rm >> Rs4 - 1)&1
 
@@ -243,7 +297,7 @@ def addressing_mode_2( s, inst ):
 
   # Immediate vs. Register Offset
   if not inst.I: index    = inst.imm_12
-  else:           index, _ = shifter_operand_imm(s, inst)
+  else:           index, _ = inst.shifted_register( s, inst )
 
   Rn          = s.rf[inst.rn]
   offset_addr = Rn + index if inst.U else Rn - index
@@ -324,7 +378,7 @@ def addressing_mode_4( s, inst ):
 
   mode   = (inst.P << 1) | inst.U
   Rn     = s.rf[ inst.rn ]
-  nbytes = 4 * popcount( inst.register_list )
+  nbytes = 4 * inst.register_count
 
   if   mode == IA: start_addr, end_addr = Rn,          Rn+nbytes-4
   elif mode == IB: start_addr, end_addr = Rn+4,        Rn+nbytes
@@ -377,6 +431,26 @@ def addressing_mode_4( s, inst ):
 # 1111  -       See Condition code 0b1111           -
 #
 def condition_passed( s, cond ):
+  # most instructions are unconditional
+  if cond == 0b1110:
+    return True
+
+  # equality tests only need the Z flag, the other conditions need the
+  # lazily evaluated flags to be computed
+
+  if   cond == 0b0000: passed =     s.zero_flag()
+  elif cond == 0b0001: passed = not s.zero_flag()
+  elif cond == 0b1111: passed = True
+  else:
+    s.materialize_flags()
+    passed = condition_passed_nzcv( s, cond )
+
+  if s.debug.enabled('insts') and not passed:
+    print 'Predicated False!',
+
+  return passed
+
+def condition_passed_nzcv( s, cond ):
   if   cond == 0b0000: passed =     s.Z
   elif cond == 0b0001: passed = not s.Z
   elif cond == 0b0010: passed =     s.C
@@ -393,10 +467,6 @@ def condition_passed( s, cond ):
   elif cond == 0b1101: passed = (    s.Z) or  (s.N != s.V)
   elif cond == 0b1110: passed = True
   else:                passed = True
-
-  if s.debug.enabled('insts') and not passed:
-    print 'Predicated False!',
-
   return passed
 
 #-----------------------------------------------------------------------
@@ -129,18 +129,14 @@ def syscall_init( mem, breakpoint, argv, envp, debug ):
 
   # utility functions
 
-  # TODO: we can do more efficient versions of these using Memory object
-  # (writing 4 bytes at once etc.)
-
   def str_to_mem( mem, val, addr ):
-    for i, char in enumerate(val+'\0'):
-      mem.write( addr + i, 1, ord( char ) )
+    mem.write_bytes( addr, val + '\0' )
     return addr + len(val) + 1
 
   def int_to_mem( mem, val, addr ):
     # TODO properly handle endianess
-    for i in range( 4 ):
-      mem.write( addr+i, 1, (val >> 8*i) & 0xFF )
+    mem.write_bytes( addr, ''.join( [ chr( (val >> 8*i) & 0xFF )
+                                      for i in range( 4 ) ] ) )
     return addr + 4
 
   # write end marker to memory
@@ -190,7 +186,7 @@ def syscall_init( mem, breakpoint, argv, envp, debug ):
   state = State( mem, debug, reset_addr=0x1000 )
 
   # TODO: where should this go?
-  state.breakpoint = r_uint( breakpoint )
+  mem.set_breakpoint( r_uint( breakpoint ) )
 
   #print '---'
   #print 'argc = %d (%x)' % ( argc,         stack_off[-1] )
@@ -238,10 +234,10 @@ def test_init( mem, debug ):
 
   # inject bootstrap code into the memory
 
-  for i, data in enumerate( bootstrap_code ):
-    mem.write( bootstrap_addr + i, 1, data )
-  for i, data in enumerate( rewrite_code ):
-    mem.write( rewrite_addr + i, 1, data )
+  mem.write_bytes( bootstrap_addr,
+                   ''.join( [ chr( x ) for x in bootstrap_code ] ) )
+  mem.write_bytes( rewrite_addr,
+                   ''.join( [ chr( x ) for x in rewrite_code ] ) )
 
   # instantiate architectural state with memory and reset address
 
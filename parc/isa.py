@@ -289,17 +289,17 @@ def execute_mfc0( s, inst ):
   #  s.src_ptr += 1
   # return actual core id (this is actually thread id)
   if   inst.rd == reg_map['c0_coreid']:
-    s.rf[inst.rt] = 0
+    s.rf[inst.rt] = s.hartid
   elif inst.rd == reg_map['c0_count']:
     s.rf[inst.rt] = s.num_insts
   elif inst.rd == reg_map['c0_fromsysc0']:
     # return actual core id
-    s.rf[inst.rt] = 0
+    s.rf[inst.rt] = s.hartid
   elif inst.rd == reg_map['c0_fromsysc5']:
     # return core type (always 0 since pydgin has no core type)
     s.rf[inst.rt] = 0
   elif inst.rd == reg_map['c0_numcores']:
-    s.rf[inst.rt] = 1
+    s.rf[inst.rt] = s.num_harts
   elif inst.rd == reg_map['c0_counthi']:
     # print "WARNING: counthi always returns 0..."
     s.rf[inst.rt] = 0
@@ -24,8 +24,17 @@ class State( Machine ):
     # executable name
     self.exe_name = ""
 
-    # syscall stuff... TODO: should this be here?
-    self.breakpoint = r_uint( 0 )
-
   def fetch_pc( self ):
     return self.pc
+
+  def save_checkpoint( self, ckpt ):
+    Machine.save_checkpoint( self, ckpt )
+    ckpt.write_int( self.src_ptr )
+    ckpt.write_int( self.sink_ptr )
+    ckpt.write_int( self.mem.get_breakpoint() )
+
+  def restore_checkpoint( self, ckpt ):
+    Machine.restore_checkpoint( self, ckpt )
+    self.src_ptr  = ckpt.read_int()
+    self.sink_ptr = ckpt.read_int()
+    self.mem.set_breakpoint( ckpt.read_uint() )
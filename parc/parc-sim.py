@@ -25,6 +25,11 @@ class ParcSim( Sim ):
   def __init__( self ):
     Sim.__init__( self, "PARC", jit_enabled=True )
 
+    # branch and jump instructions, for the per-region stats
+
+    self.branch_insts = [ 'j', 'jal', 'jr', 'jalr', 'beq', 'bne',
+                          'blez', 'bgtz', 'bltz', 'bgez' ]
+
   #-----------------------------------------------------------------------
   # decode
   #-----------------------------------------------------------------------
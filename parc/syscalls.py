@@ -94,6 +94,8 @@ syscall_funcs = {
 #4007: yield,
 }
 
+syscall_table = common.make_syscall_table( syscall_funcs )
+
 #-------------------------------------------------------------------------
 # do_syscall
 #-------------------------------------------------------------------------
@@ -101,19 +103,21 @@ syscall_funcs = {
 # extract the syscall arguments, get the syscall handling function, do the
 # syscall, and return the result back into the architectural state.
 def do_syscall( s ):
-  syscall_number = s.rf[ v0 ]
-  arg0 = intmask( s.rf[ a0 ] )
-  arg1 = intmask( s.rf[ a1 ] )
-  arg2 = intmask( s.rf[ a2 ] )
+  syscall_number  = intmask( s.rf[ v0 ] )
+  syscall_handler = common.get_syscall_handler( syscall_table,
+                                                syscall_number )
 
-  if syscall_number not in syscall_funcs:
+  if syscall_handler is None:
     print "WARNING: syscall not implemented: %d" % syscall_number
     # TODO: return an error?
   else:
-    syscall_handler = syscall_funcs[ syscall_number ]
+    arg0 = intmask( s.rf[ a0 ] )
+    arg1 = intmask( s.rf[ a1 ] )
+    arg2 = intmask( s.rf[ a2 ] )
 
     # call the syscall handler and get the return and error values
-    retval, errno = syscall_handler( s, arg0, arg1, arg2 )
+    retval, errno = common.call_syscall( s, syscall_handler, syscall_number,
+                                         arg0, arg1, arg2 )
 
     if s.debug.enabled( "syscalls" ):
       print " retval=%x errno=%x" % ( retval, errno )
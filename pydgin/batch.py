@@ -0,0 +1,124 @@
+#=======================================================================
+# batch.py
+#=======================================================================
+# Runs many simulations one after another in the same process, which
+# avoids paying process startup and JIT warm-up for each of them (the
+# JIT keeps the machine code it compiled for the simulator itself, only
+# the traces of the previous program go unused). The jobs are listed in
+# a manifest file with one job per line, written exactly like the
+# command line of a single simulation without the simulator itself:
+#
+#   # comments and empty lines are ignored
+#   --max-insts 1000000 -e HOME=/tmp bench/vvadd 100
+#   --blocks bench/sort --size 64
+#
+# i.e., the simulator options (--env for the environment, --max-insts
+# for the instruction limit), followed by the program and its arguments.
+# Tokens are separated by whitespace and cannot be quoted. The results
+# of all jobs are written to a JSON file:
+#
+#   { "jobs": [ <job>, ... ], "num_failed": <n> }
+#
+# where each job is
+#
+#   { "line": <line in the manifest>, "argv": [ "<token>", ... ],
+#     "return_code": <n>, "exited": <bool>, "status": <n>,
+#     "num_insts": <n>, "seconds": <wall clock time> }
+#
+# return_code is that of the simulator (0 unless the job could not be
+# started), exited is false if the program did not exit (e.g., it hit
+# --max-insts or an unimplemented instruction), and status is the exit
+# status of the program, or -1 if the program was not loaded. A job
+# fails unless the program exited with status 0.
+
+import os
+
+from pydgin.debug    import pad
+from pydgin.misc     import FatalError
+from pydgin.profiler import json_str
+
+#-----------------------------------------------------------------------
+# split_tokens
+#-----------------------------------------------------------------------
+# Splits line on spaces and tabs.
+
+def split_tokens( line ):
+  tokens = []
+  for token in line.replace( "\t", " " ).split( " " ):
+    if token != "":
+      tokens.append( token )
+  return tokens
+
+#-----------------------------------------------------------------------
+# Job
+#-----------------------------------------------------------------------
+
+class Job( object ):
+
+  def __init__( self, line, argv ):
+    self.line        = line
+    self.argv        = argv
+    self.return_code = 0
+    self.exited      = False
+    self.status      = -1
+    self.num_insts   = 0
+    self.usecs       = 0
+
+  def to_json( self ):
+    return '{ "line": %d, "argv": [ %s ],\n' \
+           '      "return_code": %d, "exited": %s, "status": %d, ' \
+           '"num_insts": %d, "seconds": %d.%s }' % (
+             self.line, ', '.join( [ json_str( token )
+                                     for token in self.argv ] ),
+             self.return_code, "true" if self.exited else "false",
+             self.status, self.num_insts, self.usecs / 1000000,
+             pad( "%d" % ( self.usecs % 1000000 ), 6, "0", False ) )
+
+  def failed( self ):
+    return self.return_code != 0 or not self.exited or self.status != 0
+
+#-----------------------------------------------------------------------
+# read_manifest
+#-----------------------------------------------------------------------
+# Returns the jobs of a manifest file.
+
+def read_manifest( filename ):
+  fd     = os.open( filename, os.O_RDONLY, 0 )
+  chunks = []
+  while True:
+    chunk = os.read( fd, 1 << 20 )
+    if chunk == "":
+      break
+    chunks.append( chunk )
+  os.close( fd )
+
+  jobs  = []
+  lines = ''.join( chunks ).split( "\n" )
+  for i in xrange( len( lines ) ):
+    tokens = split_tokens( lines[i] )
+    if len( tokens ) == 0 or tokens[0].startswith( "#" ):
+      continue
+    jobs.append( Job( i + 1, tokens ) )
+
+  if len( jobs ) == 0:
+    raise FatalError( "%s does not list any jobs" % filename )
+  return jobs
+
+#-----------------------------------------------------------------------
+# write_results
+#-----------------------------------------------------------------------
+
+def write_results( filename, jobs ):
+  num_failed = 0
+  for job in jobs:
+    if job.failed():
+      num_failed += 1
+
+  data = '{ "jobs": [\n    %s ],\n  "num_failed": %d }\n' % (
+           ',\n    '.join( [ job.to_json() for job in jobs ] ), num_failed )
+
+  fd = os.open( filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644 )
+  while len( data ) > 0:
+    nbytes = os.write( fd, data )
+    data   = data[ nbytes: ]
+  os.close( fd )
@@ -0,0 +1,133 @@
+#=======================================================================
+# bbv.py
+#=======================================================================
+# Collects basic block vectors (BBVs) for SimPoint-style sampled
+# simulation. Execution is split into intervals of a fixed number of
+# instructions, and for every interval we count the instructions
+# executed in each basic block. The vectors are written in the .bb
+# format read by the SimPoint clustering tool, one line per interval:
+#
+#   T:<block id>:<num insts> :<block id>:<num insts> ...
+#
+# Block ids are assigned from 1 in the order the blocks are first
+# executed. The intervals picked by SimPoint start at
+# <interval index> * <interval size> instructions, which can be reached
+# quickly by restoring a checkpoint (see checkpoint.py).
+
+import os
+
+try:
+  from rpython.rlib.listsort import TimSort
+except ImportError:
+  TimSort = None
+
+#-----------------------------------------------------------------------
+# BBVProfiler
+#-----------------------------------------------------------------------
+
+class BBVProfiler( object ):
+
+  def __init__( self, interval_size, filename, inst_nbytes=4 ):
+    self.interval_size = interval_size
+    self.filename      = filename
+    self.inst_nbytes   = inst_nbytes
+
+    # maps the start pc of a basic block to its id
+
+    self.block_ids = {}
+
+    # the basic block that is currently executing
+
+    self.block_pc  = 0
+    self.block_len = 0
+
+    # instruction counts per block id in the current interval
+
+    self.counts         = {}
+    self.interval_insts = 0
+    self.num_intervals  = 0
+
+    self.fd = os.open( filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644 )
+
+  #---------------------------------------------------------------------
+  # insts_left
+  #---------------------------------------------------------------------
+  # The number of instructions until the end of the current interval.
+
+  def insts_left( self ):
+    return self.interval_size - self.interval_insts
+
+  #---------------------------------------------------------------------
+  # add_insts
+  #---------------------------------------------------------------------
+  # Called with num_insts instructions executed in a straight line from
+  # pc, after which execution continues at next_pc. The caller must not
+  # add more instructions than insts_left.
+
+  def add_insts( self, pc, num_insts, next_pc ):
+    if self.block_len == 0:
+      self.block_pc = pc
+    self.block_len      += num_insts
+    self.interval_insts += num_insts
+
+    # a basic block ends at any control transfer
+
+    if next_pc != pc + num_insts * self.inst_nbytes:
+      self.end_block()
+
+    if self.interval_insts >= self.interval_size:
+      self.end_interval()
+
+  #---------------------------------------------------------------------
+  # end_block
+  #---------------------------------------------------------------------
+
+  def end_block( self ):
+    if self.block_len == 0:
+      return
+
+    block_id = self.block_ids.get( self.block_pc, 0 )
+    if block_id == 0:
+      block_id = len( self.block_ids ) + 1
+      self.block_ids[ self.block_pc ] = block_id
+
+    self.counts[ block_id ] = self.counts.get( block_id, 0 ) + self.block_len
+    self.block_len = 0
+
+  #---------------------------------------------------------------------
+  # end_interval
+  #---------------------------------------------------------------------
+  # Writes out the vector of the current interval. A basic block that
+  # spans two intervals is counted as two blocks.
+
+  def end_interval( self ):
+    self.end_block()
+
+    # lists have no sort method in RPython
+
+    block_ids = self.counts.keys()
+    if TimSort is not None:
+      TimSort( block_ids ).sort()
+    else:
+      block_ids.sort()
+    line = "T" + "".join( [ ":%d:%d " % ( block_id, self.counts[ block_id ] )
+                            for block_id in block_ids ] ) + "\n"
+    while len( line ) > 0:
+      nbytes = os.write( self.fd, line )
+      line   = line[ nbytes: ]
+
+    self.counts.clear()
+    self.interval_insts = 0
+    self.num_intervals += 1
+
+  #---------------------------------------------------------------------
+  # finish
+  #---------------------------------------------------------------------
+  # Writes out the last, possibly partial, interval.
+
+  def finish( self ):
+    if self.interval_insts > 0:
+      self.end_interval()
+    os.close( self.fd )
+    print "Wrote %d basic block vectors of %d instructions to %s" \
+          % ( self.num_intervals, self.interval_size, self.filename )
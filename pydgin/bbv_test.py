@@ -0,0 +1,46 @@
+#=======================================================================
+# bbv_test.py
+#=======================================================================
+
+from pydgin.bbv import BBVProfiler
+
+#-----------------------------------------------------------------------
+# test_format
+#-----------------------------------------------------------------------
+# Blocks are numbered in the order they first execute, their counts add
+# up over the interval, and a block that spans two intervals continues
+# as a new block. The last interval is written even if it is partial.
+
+def test_format( tmpdir ):
+  filename = str( tmpdir.join( "test.bb" ) )
+  bbv      = BBVProfiler( 10, filename )
+
+  bbv.add_insts( 0x100, 1, 0x104 )
+  bbv.add_insts( 0x104, 1, 0x108 )
+  bbv.add_insts( 0x108, 1, 0x200 )
+  bbv.add_insts( 0x200, 4, 0x100 )
+  assert bbv.insts_left() == 3
+  bbv.add_insts( 0x100, 3, 0x10c )
+  assert bbv.insts_left() == 10
+  bbv.add_insts( 0x10c, 2, 0x300 )
+  bbv.finish()
+
+  assert tmpdir.join( "test.bb" ).read() == "T:1:6 :2:4 \n" \
+                                            "T:3:2 \n"
+
+#-----------------------------------------------------------------------
+# test_sorted_ids
+#-----------------------------------------------------------------------
+# The blocks of an interval are written in the numeric order of their
+# ids.
+
+def test_sorted_ids( tmpdir ):
+  filename = str( tmpdir.join( "test.bb" ) )
+  bbv      = BBVProfiler( 12, filename, inst_nbytes=2 )
+
+  for i in range( 12 ):
+    bbv.add_insts( 0x1000 + i * 0x10, 1, 0x1000 + ( i + 1 ) * 0x10 )
+  bbv.finish()
+
+  assert tmpdir.join( "test.bb" ).read() == \
+    "T" + "".join( [ ":%d:1 " % ( i + 1 ) for i in range( 12 ) ] ) + "\n"
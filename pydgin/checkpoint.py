@@ -0,0 +1,123 @@
+#=======================================================================
+# checkpoint.py
+#=======================================================================
+# Saves the state of a running simulation to a file and restores it
+# later, so that long initialization phases only need to be simulated
+# once. A checkpoint holds the architectural state, which the State of
+# each ISA writes and reads in its save_checkpoint and
+# restore_checkpoint methods, the non-zero parts of memory, and the
+# files opened by the simulated program.
+#
+# The file format is described in serialize.py.
+
+import os
+
+from pydgin.misc      import FatalError
+from pydgin.serialize import BinaryReader, BinaryWriter
+from pydgin.syscalls  import file_descriptors, file_info
+from pydgin.vfs       import vfs
+
+CHECKPOINT_MAGIC = "PYDGIN-CKPT-3\n"
+
+#-----------------------------------------------------------------------
+# save_checkpoint
+#-----------------------------------------------------------------------
+
+def save_checkpoint( state, filename ):
+  ckpt = BinaryWriter( CHECKPOINT_MAGIC )
+  state.save_checkpoint( ckpt )
+  save_memory( ckpt, state.mem )
+  save_files( ckpt )
+  vfs.save_checkpoint( ckpt )
+  ckpt.save( filename )
+
+#-----------------------------------------------------------------------
+# restore_checkpoint
+#-----------------------------------------------------------------------
+# The state should be freshly initialized for the same program, and the
+# same virtual filesystem image should be mounted.
+
+def restore_checkpoint( state, filename ):
+  ckpt = BinaryReader( filename, CHECKPOINT_MAGIC, "checkpoint" )
+  state.restore_checkpoint( ckpt )
+  restore_memory( ckpt, state.mem )
+  restore_files( ckpt )
+  vfs.restore_checkpoint( ckpt )
+
+#-----------------------------------------------------------------------
+# save_memory, restore_memory
+#-----------------------------------------------------------------------
+# Only the non-zero ranges of memory are saved. Memory which is non-zero
+# before the restore, e.g., the loaded program and its initial stack, is
+# cleared first so that it matches the checkpoint. These are not
+# accesses of the program, so they are not printed or traced.
+
+def save_memory( ckpt, mem ):
+  mem.suppress_debug = True
+  ranges = mem.nonzero_ranges()
+  ckpt.write_int( len( ranges ) )
+  for addr, nbytes in ranges:
+    ckpt.write_int( addr )
+    ckpt.write_str( mem.read_bytes( addr, nbytes ) )
+  mem.suppress_debug = False
+
+def restore_memory( ckpt, mem ):
+  mem.suppress_debug = True
+  for addr, nbytes in mem.nonzero_ranges():
+    mem.write_bytes( addr, '\0' * nbytes )
+
+  num_ranges = ckpt.read_int()
+  for i in xrange( num_ranges ):
+    addr = ckpt.read_int()
+    mem.write_bytes( addr, ckpt.read_str() )
+  mem.suppress_debug = False
+
+#-----------------------------------------------------------------------
+# save_files, restore_files
+#-----------------------------------------------------------------------
+# Host files opened by the program are reopened on restore with the same
+# file descriptor and offset. The standard streams are left alone. The
+# file descriptor must not be open in the simulator already, e.g., for
+# a file of its own or the socket of a server worker.
+
+def save_files( ckpt ):
+  fds = [ fd for fd in file_descriptors.keys() if fd > 2 ]
+  ckpt.write_int( len( fds ) )
+  for fd in fds:
+    filename, flags = file_info[ fd ]
+    ckpt.write_int( fd )
+    ckpt.write_str( filename )
+    ckpt.write_int( flags )
+    ckpt.write_int( os.lseek( fd, 0, os.SEEK_CUR ) )
+
+def restore_files( ckpt ):
+  num_files = ckpt.read_int()
+  for i in xrange( num_files ):
+    fd       = ckpt.read_int()
+    filename = ckpt.read_str()
+    flags    = ckpt.read_int()
+    offset   = ckpt.read_int()
+
+    # the file must not be created or truncated again
+
+    reopen_flags = flags & ~( os.O_CREAT | os.O_TRUNC | os.O_EXCL )
+    try:
+      os.fstat( fd )
+      in_use = True
+    except OSError:
+      in_use = False
+    if in_use:
+      raise FatalError( "Could not reopen %s as fd %d, which is already "
+                        "in use" % ( filename, fd ) )
+
+    try:
+      new_fd = os.open( filename, reopen_flags, 0 )
+      if new_fd != fd:
+        os.dup2( new_fd, fd )
+        os.close( new_fd )
+      os.lseek( fd, offset, os.SEEK_SET )
+    except OSError as e:
+      raise FatalError( "Could not reopen %s (errno=%d)" % ( filename, e.errno ) )
+
+    file_descriptors[ fd ] = fd
+    file_info[ fd ] = ( filename, flags )
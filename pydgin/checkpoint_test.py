@@ -0,0 +1,103 @@
+#=======================================================================
+# checkpoint_test.py
+#=======================================================================
+
+import os
+import pytest
+
+from pydgin.checkpoint import save_checkpoint, restore_checkpoint
+from pydgin.debug      import Debug
+from pydgin.misc       import FatalError
+from pydgin.storage    import Memory
+from pydgin.syscalls   import syscall_open, syscall_read, put_str, \
+                              close_files
+from pydgin.vfs        import vfs
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+# A minimal state, the architectural state of the isas is tested by the
+# asm tests.
+
+class State( object ):
+
+  def __init__( self ):
+    self.mem   = Memory( size=2**20 )
+    self.debug = Debug()
+    self.pc    = 0
+
+  def save_checkpoint( self, ckpt ):
+    ckpt.write_int( self.pc )
+
+  def restore_checkpoint( self, ckpt ):
+    self.pc = ckpt.read_int()
+
+def open_file( s, path ):
+  put_str( s, 0x100, path + "\0" )
+  fd, errno = syscall_open( s, 0x100, 0x0002, 0644 )
+  assert errno == 0
+  return fd
+
+def read_file( s, fd, nbytes ):
+  num_read, errno = syscall_read( s, fd, 0x200, nbytes )
+  assert errno == 0
+  return s.mem.read_bytes( 0x200, num_read )
+
+@pytest.fixture
+def files( request, tmpdir, monkeypatch ):
+  tmpdir.join( "data.txt" ).write( "0123456789" )
+  tmpdir.mkdir( "other" )
+  monkeypatch.chdir( tmpdir )
+  vfs.mount( {} )
+  request.addfinalizer( close_files )
+  return tmpdir
+
+#-----------------------------------------------------------------------
+# test_round_trip
+#-----------------------------------------------------------------------
+# A file opened with a relative path is reopened at the same fd and
+# offset, even if the restore runs in another directory.
+
+def test_round_trip( files ):
+  state = State()
+  state.pc = 0x10074
+  state.mem.write_bytes( 0x8000, "abc" )
+  fd = open_file( state, "data.txt" )
+  assert read_file( state, fd, 4 ) == "0123"
+
+  filename = str( files.join( "test.ckpt" ) )
+  save_checkpoint( state, filename )
+  close_files()
+  os.chdir( "other" )
+
+  restored = State()
+  restored.mem.write_bytes( 0x9000, "stale" )
+  restore_checkpoint( restored, filename )
+
+  assert restored.pc == 0x10074
+  assert restored.mem.read_bytes( 0x8000, 3 ) == "abc"
+  assert restored.mem.read_bytes( 0x9000, 5 ) == "\0" * 5
+  assert restored.mem.nonzero_ranges() == state.mem.nonzero_ranges()
+  assert read_file( restored, fd, 4 ) == "4567"
+
+#-----------------------------------------------------------------------
+# test_fd_in_use
+#-----------------------------------------------------------------------
+# A restore must not replace a file descriptor the simulator uses.
+
+def test_fd_in_use( files ):
+  state = State()
+  fd    = open_file( state, "data.txt" )
+
+  filename = str( files.join( "test.ckpt" ) )
+  save_checkpoint( state, filename )
+  close_files()
+
+  sim_fd = os.open( str( files.join( "data.txt" ) ), os.O_RDONLY )
+  try:
+    assert sim_fd == fd
+    with pytest.raises( FatalError ):
+      restore_checkpoint( State(), filename )
+    assert os.read( sim_fd, 2 ) == "01"
+  finally:
+    os.close( sim_fd )
@@ -3,13 +3,14 @@
 #=======================================================================
 
 from pydgin.utils import specialize
+from pydgin.trace import TracerPair
 
 #-----------------------------------------------------------------------
 # Debug
 #-----------------------------------------------------------------------
 # a class that contains different debug flags
 class Debug( object ):
-  _immutable_fields_ = [ 'enabled_flags', 'start_after', 'state' ]
+  _immutable_fields_ = [ 'enabled_flags', 'start_after', 'state', 'trace' ]
 
   # NOTE: it doesn't seem possible to have conditional debug prints
   # without incurring performance losses. So, instead we are
@@ -24,6 +25,9 @@ class Debug( object ):
     self.start_after = start_after
     # we need the state to check the number of cycles
     self.state = None
+    # the tracer notified of the register writes and memory accesses of
+    # the objects that share this debug object if enabled (see trace.py)
+    self.trace = None
 
   #---------------------------------------------------------------------
   # enabled
@@ -41,6 +45,16 @@ class Debug( object ):
   def set_state( self, state ):
     self.state = state
 
+  #---------------------------------------------------------------------
+  # add_trace
+  #---------------------------------------------------------------------
+  # Adds a tracer, both are notified if there already is one.
+  def add_trace( self, trace ):
+    if self.trace is None:
+      self.trace = trace
+    else:
+      self.trace = TracerPair( self.trace, trace )
+
 #-------------------------------------------------------------------------
 # pad
 #-------------------------------------------------------------------------
@@ -0,0 +1,140 @@
+#=======================================================================
+# decode_cache.py
+#=======================================================================
+# Per-simulator cache of decoded instructions keyed by PC. Without it,
+# every fetch builds a fresh Instruction object and walks the generated
+# decoder, which dominates interpreted and non-JIT runs. The JIT already
+# constant-folds decode for traced code, so JIT builds do not use it.
+
+from pydgin.utils import intmask, specialize
+
+#-----------------------------------------------------------------------
+# DecodeCacheEntry
+#-----------------------------------------------------------------------
+# A decoded instruction and the function that executes it.
+
+class DecodeCacheEntry( object ):
+  _immutable_fields_ = [ 'inst', 'exec_fun' ]
+
+  def __init__( self, inst, exec_fun ):
+    self.inst     = inst
+    self.exec_fun = exec_fun
+
+#-----------------------------------------------------------------------
+# Block
+#-----------------------------------------------------------------------
+# A straight-line run of decoded instructions starting at pc, used by the
+# block execution mode of the simulator. Blocks are marked invalid when
+# any cached instruction is modified, so that a block which is executing
+# stops at the next instruction.
+
+class Block( object ):
+  _immutable_fields_ = [ 'pc', 'entries[*]' ]
+
+  def __init__( self, pc, entries ):
+    self.pc      = pc
+    self.entries = entries[:]   # fixed-size, so entries[*] is immutable
+    self.valid   = True
+
+#-----------------------------------------------------------------------
+# DecodeCache
+#-----------------------------------------------------------------------
+# Maps PC to a DecodeCacheEntry. We also keep track of the pages that
+# hold cached instructions, so that memory writes can cheaply check
+# whether they might be modifying cached code. Only the entries that
+# overlap a store are invalidated, so data stores to a page shared with
+# code do not throw away the rest of the page. Addresses are signed or
+# unsigned depending on the ISA, so they are converted with intmask.
+
+class DecodeCache( object ):
+  _immutable_fields_ = [ 'page_bits', 'inst_nbytes' ]
+
+  def __init__( self, page_bits=12, inst_nbytes=4 ):
+    self.page_bits   = page_bits
+    self.inst_nbytes = inst_nbytes
+    self.entries     = {}
+    self.blocks      = {}
+    # NOTE: used as a set, see the note on file_descriptors in
+    # syscalls.py
+    self.code_pages  = {}
+
+  #---------------------------------------------------------------------
+  # lookup
+  #---------------------------------------------------------------------
+  # Returns the cached entry for pc or None on a miss.
+
+  def lookup( self, pc ):
+    return self.entries.get( intmask( pc ), None )
+
+  #---------------------------------------------------------------------
+  # insert
+  #---------------------------------------------------------------------
+
+  def insert( self, pc, inst, exec_fun ):
+    pc    = intmask( pc )
+    entry = DecodeCacheEntry( inst, exec_fun )
+    self.entries[ pc ] = entry
+    page = pc >> self.page_bits
+    self.code_pages[ page ] = page
+    return entry
+
+  #---------------------------------------------------------------------
+  # lookup_block
+  #---------------------------------------------------------------------
+  # Returns the cached block starting at pc or None on a miss.
+
+  def lookup_block( self, pc ):
+    return self.blocks.get( intmask( pc ), None )
+
+  #---------------------------------------------------------------------
+  # insert_block
+  #---------------------------------------------------------------------
+  # The entries of the block must have been inserted to the cache, so
+  # that writes to them invalidate the block.
+
+  def insert_block( self, pc, entries ):
+    block = Block( pc, entries )
+    self.blocks[ intmask( pc ) ] = block
+    return block
+
+  #---------------------------------------------------------------------
+  # invalidate
+  #---------------------------------------------------------------------
+  # Called by the memory on every write. Drops the entries of all
+  # instructions overlapping [start_addr, start_addr+num_bytes).
+
+  @specialize.argtype(1, 2)
+  def invalidate( self, start_addr, num_bytes ):
+    start_addr = intmask( start_addr )
+    end_addr   = start_addr + num_bytes - 1
+    if ( start_addr >> self.page_bits ) not in self.code_pages and \
+       ( end_addr   >> self.page_bits ) not in self.code_pages:
+      return
+
+    pc = start_addr - ( start_addr % self.inst_nbytes )
+    while pc <= end_addr:
+      if pc in self.entries:
+        del self.entries[ pc ]
+        self.flush_blocks()
+      pc += self.inst_nbytes
+
+  #---------------------------------------------------------------------
+  # flush
+  #---------------------------------------------------------------------
+  # Drops all entries, e.g., on fence.i.
+
+  def flush( self ):
+    self.entries.clear()
+    self.code_pages.clear()
+    self.flush_blocks()
+
+  #---------------------------------------------------------------------
+  # flush_blocks
+  #---------------------------------------------------------------------
+  # Self-modifying code is rare, so we drop all blocks instead of
+  # tracking which blocks contain a modified instruction.
+
+  def flush_blocks( self ):
+    for block in self.blocks.values():
+      block.valid = False
+    self.blocks.clear()
@@ -0,0 +1,84 @@
+#=======================================================================
+# decode_cache_test.py
+#=======================================================================
+
+from pydgin.decode_cache import DecodeCache
+from pydgin.storage      import _PagedMemory, _ArrayMemory
+from pydgin.utils        import r_uint
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+# The entries hold their pc as the instruction, the cache does not look
+# at them.
+
+def make_cache( pcs ):
+  mem              = _PagedMemory( _ArrayMemory, page_bits=12 )
+  cache            = DecodeCache()
+  mem.decode_cache = cache
+  for pc in pcs:
+    cache.insert( pc, pc, None )
+  return mem, cache
+
+def cached( cache, pcs ):
+  return [ pc for pc in pcs if cache.lookup( pc ) is not None ]
+
+#-----------------------------------------------------------------------
+# test_store
+#-----------------------------------------------------------------------
+# Stores drop the instructions they overlap, and only those.
+
+def test_store():
+  pcs = [ 0x1000, 0x1004, 0x1008, 0x100c ]
+  mem, cache = make_cache( pcs )
+
+  mem.write( 0x1004, 4, 0x13 )
+  assert cached( cache, pcs ) == [ 0x1000, 0x1008, 0x100c ]
+
+  mem.write( 0x100a, 4, 0x13 )
+  assert cached( cache, pcs ) == [ 0x1000 ]
+
+  mem.write( 0x1100, 8, 0 )
+  mem.write( 0x2000, 4, 0 )
+  assert cached( cache, pcs ) == [ 0x1000 ]
+
+  mem.write_bytes( 0xffe, "ab" )
+  assert cached( cache, pcs ) == [ 0x1000 ]
+  mem.write_bytes( 0xfff, "ab" )
+  assert cached( cache, pcs ) == []
+
+#-----------------------------------------------------------------------
+# test_blocks
+#-----------------------------------------------------------------------
+# A store to any cached instruction invalidates the blocks, a store to
+# data does not.
+
+def test_blocks():
+  pcs = [ 0x1000, 0x1004 ]
+  mem, cache = make_cache( pcs )
+  block = cache.insert_block( 0x1000, [ cache.lookup( pc ) for pc in pcs ] )
+
+  mem.write( 0x1010, 4, 0 )
+  assert block.valid
+  assert cache.lookup_block( 0x1000 ) is block
+
+  mem.write( 0x1004, 1, 0 )
+  assert not block.valid
+  assert cache.lookup_block( 0x1000 ) is None
+
+#-----------------------------------------------------------------------
+# test_flush
+#-----------------------------------------------------------------------
+# fence.i flushes the whole cache, and unsigned and signed pcs are the
+# same entry.
+
+def test_flush():
+  pcs = [ 0x1000, 0x80000000 ]
+  mem, cache = make_cache( pcs )
+  assert cache.lookup( r_uint( 0x80000000 ) ) is not None
+  block = cache.insert_block( 0x1000, [ cache.lookup( 0x1000 ) ] )
+
+  cache.flush()
+  assert cached( cache, pcs ) == []
+  assert not block.valid
+  assert cache.code_pages == {}
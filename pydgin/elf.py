@@ -21,6 +21,7 @@
 # Author : Christopher Batten
 # Date   : May 20, 2014
 
+import mmap
 import struct
 from   pydgin.utils import intmask
 try:
@@ -453,12 +454,36 @@ class ElfSymTabEntry (object):
    self.shndx,
 )
 
+#-------------------------------------------------------------------------
+# ZeroFill
+#-------------------------------------------------------------------------
+# Stands in for the data of .bss and .sbss sections when reading lazily,
+# so that the zeros are only materialized for the parts that are used.
+
+class ZeroFill( object ):
+
+  def __init__( self, size ):
+    self.size = size
+
+  def __len__( self ):
+    return self.size
+
+  def __getitem__( self, idx ):
+    return '\0' * len( xrange( *idx.indices( self.size ) ) )
+
 #-------------------------------------------------------------------------
 # elf_reader
 #-------------------------------------------------------------------------
-# Opens and parses an ELF file into a sparse memory image object.
+# Opens and parses an ELF file into a sparse memory image object. If lazy
+# is set, the file is mmapped copy-on-write and the section data are
+# views into the mapping rather than strings read from the file. This is
+# not RPython.
+
+def elf_reader( file_obj, is_64bit=False, lazy=False ):
 
-def elf_reader( file_obj, is_64bit=False ):
+  file_map = None
+  if lazy:
+    file_map = mmap.mmap( file_obj.fileno(), 0, access=mmap.ACCESS_COPY )
 
   # Read the data for the ELF header
 
@@ -536,8 +561,11 @@ def elf_reader( file_obj, is_64bit=False ):
     # Read the section data if it exists
 
     if section_name not in ['.sbss', '.bss']:
-      file_obj.seek( intmask( shdr.offset ) )
-      data = file_obj.read( intmask( shdr.size ) )
+      if lazy:
+        data = buffer( file_map, intmask( shdr.offset ), intmask( shdr.size ) )
+      else:
+        file_obj.seek( intmask( shdr.offset ) )
+        data = file_obj.read( intmask( shdr.size ) )
 
     # NOTE: the .bss and .sbss sections don't actually contain any
     # data in the ELF.  These sections should be initialized to zero.
@@ -545,6 +573,8 @@ def elf_reader( file_obj, is_64bit=False ):
     #
     # - http://stackoverflow.com/questions/610682/bss-section-in-elf-file
 
+    elif lazy:
+      data = ZeroFill( intmask( shdr.size ) )
     else:
       data = '\0' * shdr.size
 
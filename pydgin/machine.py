@@ -2,6 +2,8 @@
 # machine.py
 #=======================================================================
 
+from pydgin.utils import r_uint
+
 #-----------------------------------------------------------------------
 # Machine
 #-----------------------------------------------------------------------
@@ -22,9 +24,37 @@ class Machine( object ):
     self.num_insts       = 0
     self.stat_num_insts  = 0
 
+    # the id of this hart and the number of harts sharing the memory
+    self.hartid    = 0
+    self.num_harts = 1
+
     # we need a dedicated running flag because status could be 0 on a
     # syscall_exit
     self.running       = True
 
   def fetch_pc( self ):
     return self.pc
+
+  #---------------------------------------------------------------------
+  # save_checkpoint, restore_checkpoint
+  #---------------------------------------------------------------------
+  # Write and read the architectural state to and from a checkpoint, see
+  # pydgin/checkpoint.py. States with more registers extend these.
+
+  def save_checkpoint( self, ckpt ):
+    ckpt.write_int( self.pc )
+    for i in range( self.rf.num_regs ):
+      ckpt.write_int( self.rf.regs[i] )
+    ckpt.write_int( self.status )
+    ckpt.write_int( self.stats_en )
+    ckpt.write_int( self.num_insts )
+    ckpt.write_int( self.stat_num_insts )
+
+  def restore_checkpoint( self, ckpt ):
+    self.pc = ckpt.read_uint()
+    for i in range( self.rf.num_regs ):
+      self.rf.regs[i] = ckpt.read_uint()
+    self.status         = ckpt.read_uint()
+    self.stats_en       = ckpt.read_uint()
+    self.num_insts      = ckpt.read_int()
+    self.stat_num_insts = ckpt.read_int()
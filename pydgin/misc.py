@@ -2,8 +2,10 @@
 # misc.py
 #=======================================================================
 
+import os
 import re
 import elf
+import errno
 from jit import elidable
 from pydgin.utils import intmask, r_uint
 
@@ -40,28 +42,39 @@ class NotImplementedInstError( FatalError ):
 #-----------------------------------------------------------------------
 # load_program
 #-----------------------------------------------------------------------
+# Untranslated simulators map the sections into memories which support
+# it, so that pages are only filled in from the ELF file when touched.
+
 def load_program( fp, mem, alignment=0, is_64bit=False ):
 
-  mem_image  = elf.elf_reader( fp, is_64bit=is_64bit )
+  try:
+    from rpython.rlib.objectmodel import we_are_translated
+    lazy = not we_are_translated()
+  except ImportError:
+    lazy = True
+  lazy = lazy and hasattr( mem, 'map_lazy' )
+
+  mem_image  = elf.elf_reader( fp, is_64bit=is_64bit, lazy=lazy )
   sections   = mem_image.get_sections()
   entrypoint = -1
 
   for section in sections:
-    start_addr = section.addr
-    for i, data in enumerate( section.data ):
-      mem.write( start_addr+i, 1, ord( data ) )
+    if lazy:
+      mem.map_lazy( section.addr, section.data )
+    else:
+      mem.write_bytes( intmask( section.addr ), section.data )
 
     # TODO: HACK should really have elf_reader return the entry point
     #       address in the elf header!
     if section.name == '.text':
       entrypoint = intmask( section.addr )
     if section.name == '.data':
-      mem.data_section = section.addr
+      mem.data_section = intmask( section.addr )
 
   assert entrypoint >= 0
 
   last_sec   = sections[-1]
-  breakpoint = last_sec.addr + len( last_sec.data )
+  breakpoint = intmask( last_sec.addr ) + len( last_sec.data )
 
   if alignment > 0:
     def round_up( val, alignment ):
@@ -73,6 +86,21 @@ def load_program( fp, mem, alignment=0, is_64bit=False ):
 #-----------------------------------------------------------------------
 # create_risc_decoder
 #-----------------------------------------------------------------------
+# Generates a decoder which walks a decision tree over the instruction
+# bits instead of testing every encoding in turn. Each node of the tree
+# switches on a bit field fixed by the encodings which are still
+# possible (e.g., the opcode, then funct3 and funct7 in RISC-V), so the
+# cost of decoding is proportional to the depth of the tree. RPython
+# turns the if/elif chain of each node into a switch.
+#
+# Encodings may overlap, e.g., mul is a special case of and in ARM. An
+# instruction matching more than one encoding is decoded as the most
+# specific one, which is the encoding that fixes the most significant
+# bit the others leave as don't care. Hence the order of the encodings
+# only matters for identical encodings, of which the first one listed
+# is decoded as in the original linear decoder (e.g., the RISC-V nop
+# placeholders for fld and fsd are only used if FP is disabled).
+
 def create_risc_decoder( encodings, isa_globals, debug=False ):
 
   # removes all characters other than '0', '1', and 'x'
@@ -83,40 +111,123 @@ def create_risc_decoder( encodings, isa_globals, debug=False ):
 
   inst_nbits = len( encodings[0][1] )
 
-  def split_encodings( enc ):
-    return [x for x in re.split( '(x*)', enc ) if x]
-
-  bit_fields = [ split_encodings( x[1] ) for x in encodings ]
-
-  decoder = ''
-  for i, inst in enumerate( bit_fields ):
-    #print i, encodings[i][0], inst
-    bit = 0
-    conditions = []
-    for field in reversed( inst ):
-      nbits = len( field )
-      if field[0] != 'x':
-        mask = (1 << nbits) - 1
-        cond = '(inst >> {}) & r_uint(0x{:X}) == r_uint(0b{})'.format( bit, mask, field )
-        conditions.append( cond )
-      bit += nbits
-    decoder += 'if   ' if i == 0 else '  elif '
-    decoder += ' and '.join( reversed(conditions) ) + ':\n'
+  names   = [ x[0] for x in encodings ]
+  masks   = [ int( x[1].replace( '0', '1' ).replace( 'x', '0' ), 2 )
+              for x in encodings ]
+  matches = [ int( x[1].replace( 'x', '0' ), 2 ) for x in encodings ]
+
+  # the most specific of the encodings matching all instructions that
+  # reach a leaf of the tree, the first one listed if they are identical
+
+  def most_specific( cands ):
+    return max( cands, key=lambda i: ( masks[i], -i ) )
+
+  def return_stmt( i ):
     if debug:
-      decoder += '    return "{0}", execute_{0}\n'.format( encodings[i][0] )
+      return 'return "{0}", execute_{0}'.format( names[i] )
     else:
-      decoder += '    return execute_{}\n'.format( encodings[i][0] )
+      return 'return execute_{}'.format( names[i] )
+
+  invalid_stmt = "raise FatalError('Invalid instruction 0x%x!' % inst )"
+
+  # emits the subtree which decodes the instructions matching the bits
+  # in tested among the candidate encodings cands
+
+  def gen_tree( cands, tested, indent, lines ):
+    pad = '  ' * indent
+
+    if not cands:
+      lines.append( pad + invalid_stmt )
+      return
+
+    # a single candidate checks all its remaining bits at once
+
+    if len( cands ) == 1:
+      i    = cands[0]
+      mask = masks[i] & ~tested
+      if mask:
+        lines.append( pad + 'if ( inst & r_uint(0x{:X}) ) == r_uint(0x{:X}):'
+                            .format( mask, matches[i] & mask ) )
+        lines.append( pad + '  ' + return_stmt( i ) )
+        lines.append( pad + invalid_stmt )
+      else:
+        lines.append( pad + return_stmt( i ) )
+      return
+
+    # find the candidates which fix each bit not tested yet
+
+    fixers = {}
+    for bit in range( inst_nbits ):
+      if not ( tested >> bit ) & 1:
+        fixers[ bit ] = tuple( i for i in cands if ( masks[i] >> bit ) & 1 )
+
+    fixers = dict( ( b, f ) for b, f in fixers.items() if f )
+
+    # all candidates match every instruction that reaches this node
+
+    if not fixers:
+      lines.append( pad + return_stmt( most_specific( cands ) ) )
+      return
+
+    # switch on the bit fixed by most candidates, extended to a field
+    # of adjacent bits fixed by the same candidates
+
+    bit = max( fixers, key=lambda b: ( len( fixers[b] ), b ) )
+    lsb = msb = bit
+    while fixers.get( lsb - 1 ) == fixers[ bit ]: lsb -= 1
+    while fixers.get( msb + 1 ) == fixers[ bit ]: msb += 1
+
+    field_mask = ( 1 << ( msb - lsb + 1 ) ) - 1
+    fixed      = fixers[ bit ]
+    wildcards  = [ i for i in cands if i not in fixed ]
+    tested    |= field_mask << lsb
+
+    values = {}
+    for i in fixed:
+      values.setdefault( ( matches[i] >> lsb ) & field_mask, [] ).append( i )
+
+    lines.append( pad + 'bits = ( inst >> {} ) & r_uint(0x{:X})'
+                        .format( lsb, field_mask ) )
+    for n, value in enumerate( sorted( values ) ):
+      lines.append( pad + ( 'if   ' if n == 0 else 'elif ' )
+                        + 'bits == r_uint(0x{:X}):'.format( value ) )
+      subset = sorted( values[ value ] + wildcards )
+      gen_tree( subset, tested, indent + 1, lines )
+    lines.append( pad + 'else:' )
+    gen_tree( wildcards, tested, indent + 1, lines )
+
+  lines = []
+  gen_tree( range( len( encodings ) ), 0, 1, lines )
 
   source = Source('''
 @elidable
 def decode( inst ):
-  {decoder_tree}
-  else:
-    raise FatalError('Invalid instruction 0x%x!' % inst )
-  '''.format( decoder_tree = decoder ))
+{decoder_tree}
+  '''.format( decoder_tree = '\n'.join( lines ) ))
 
   #print source
   environment = dict(globals().items() + isa_globals.items())
   exec source.compile() in environment
 
   return environment['decode']
+
+#-----------------------------------------------------------------------
+# create_unlinked_file
+#-----------------------------------------------------------------------
+# Creates an empty file in the first of dirs that exists and returns
+# its file descriptor. The file is unlinked, so that it is deleted when
+# the last process using it closes it. tempfile is not RPython.
+
+def create_unlinked_file( dirs ):
+  for tmp_dir in dirs:
+    for i in xrange( 100 ):
+      path = "%s/pydgin-%d-%d" % ( tmp_dir, os.getpid(), i )
+      try:
+        fd = os.open( path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0600 )
+      except OSError as e:
+        if e.errno == errno.EEXIST:
+          continue
+        break
+      os.unlink( path )
+      return fd
+  raise OSError( errno.ENOENT, "no directory for a temporary file" )
@@ -0,0 +1,116 @@
+#=======================================================================
+# parallel.py
+#=======================================================================
+# Runs the harts of a multi-hart simulation in parallel, each in its own
+# host process, on a memory shared by the processes (see _SharedMemory
+# in storage.py). Hart 0 runs in the simulator process and the other
+# harts in forked processes, which run their hart a quantum at a time
+# and stop once hart 0 has exited. Each process writes the status and
+# instruction count of its hart to the control words of the shared
+# memory for the final report.
+
+import os
+import sys
+
+from pydgin.storage  import SharedMemory
+from pydgin.syscalls import output_buffer
+from pydgin.utils    import we_are_translated, intmask
+
+# the control words hold a stop flag followed by the status and the
+# instruction count of each hart
+
+def control_idx( hartid, field ):
+  return 1 + 2 * hartid + field
+
+#-----------------------------------------------------------------------
+# share_memory
+#-----------------------------------------------------------------------
+# Moves the memory of the harts to shared memory, after the program has
+# been loaded and the harts initialized.
+
+def share_memory( sim ):
+  mem    = sim.state.mem
+  shared = SharedMemory( mem, num_control_words=control_idx(
+                                len( sim.harts ), 0 ) )
+  shared.debug = mem.debug
+  for hart in sim.harts:
+    hart.mem = shared
+  sim.shared_mem = shared
+
+#-----------------------------------------------------------------------
+# flush_output
+#-----------------------------------------------------------------------
+# Don't let the forked processes inherit unwritten output. Translated
+# simulators write what they print right away.
+
+def flush_output():
+  output_buffer.flush_all()
+  if not we_are_translated():
+    sys.stdout.flush()
+
+#-----------------------------------------------------------------------
+# run_parallel
+#-----------------------------------------------------------------------
+
+def run_parallel( sim ):
+  harts = sim.harts
+  mem   = sim.shared_mem
+
+  # the memory is never shared in the isas without multiple harts
+
+  assert mem is not None
+  flush_output()
+
+  pids = []
+  for hart in harts[1:]:
+    pid = os.fork()
+    if pid == 0:
+      run_hart( sim, hart )
+      flush_output()
+      os._exit( 0 )
+    pids.append( pid )
+
+  # hart 0 runs until it exits, then the other harts are stopped
+
+  sim.state       = harts[0]
+  sim.quantum_end = 0
+  if sim.block_mode:
+    sim.run_blocks()
+  else:
+    sim.run_insts()
+
+  mem.write_control( 0, 1 )
+  for pid in pids:
+    os.waitpid( pid, 0 )
+
+  for hart in harts[1:]:
+    hart.status    = mem.read_control( control_idx( hart.hartid, 0 ) )
+    hart.num_insts = intmask( mem.read_control(
+                                control_idx( hart.hartid, 1 ) ) )
+    hart.running   = False
+
+#-----------------------------------------------------------------------
+# run_hart
+#-----------------------------------------------------------------------
+# Runs a hart in a forked process until it exits, hits an error or
+# max_insts, or hart 0 exits.
+
+def run_hart( sim, hart ):
+  mem = sim.shared_mem
+  assert mem is not None
+
+  sim.harts = [ hart ]
+  sim.state = hart
+  sim.debug.set_state( hart )
+
+  while hart.running and mem.read_control( 0 ) == 0:
+    sim.quantum_end = hart.num_insts + sim.quantum
+    if sim.block_mode:
+      sim.run_blocks()
+    else:
+      sim.run_insts()
+    if hart.num_insts != sim.quantum_end:
+      break
+
+  mem.write_control( control_idx( hart.hartid, 0 ), hart.status )
+  mem.write_control( control_idx( hart.hartid, 1 ), hart.num_insts )
@@ -0,0 +1,259 @@
+#=======================================================================
+# profiler.py
+#=======================================================================
+# Counts how often each instruction mnemonic, each pc and each basic
+# block is executed. A sorted report of the most executed ones is
+# printed at the end of the simulation, and the full profile is written
+# to a JSON file:
+#
+#   { "num_insts": <n>,
+#     "mnemonics": [ [ "<mnemonic>", <count> ], ... ],
+#     "pcs":       [ [ <pc>, "<mnemonic>", <count> ], ... ],
+#     "blocks":    [ [ <start pc>, <num insts>, <count> ], ... ] }
+#
+# All lists are sorted by decreasing count. A basic block ends at any
+# control transfer, and blocks which start at the same pc but have
+# different lengths (e.g., due to a branch into the middle of a block)
+# are counted separately.
+
+import os
+
+from pydgin.debug import pad, pad_hex
+
+#-----------------------------------------------------------------------
+# sort_by_count, sort_pcs_by_count
+#-----------------------------------------------------------------------
+# Return keys sorted by decreasing counts[ key ], keys with the same
+# count are sorted in increasing order. Lists can't be sorted in RPython,
+# and an RPython function only takes one type of list, so there is a
+# merge sort for the mnemonics and one for the pcs (and block keys).
+
+def make_sort_by_count():
+
+  def merge_sort( keys, counts ):
+    if len( keys ) <= 1:
+      return keys[:]
+    mid   = len( keys ) / 2
+    left  = merge_sort( keys[ :mid ], counts )
+    right = merge_sort( keys[ mid: ], counts )
+
+    merged = []
+    i = j = 0
+    while i < len( left ) and j < len( right ):
+      left_count  = counts[ left[i] ]
+      right_count = counts[ right[j] ]
+      if right_count > left_count or \
+         ( right_count == left_count and right[j] < left[i] ):
+        merged.append( right[j] )
+        j += 1
+      else:
+        merged.append( left[i] )
+        i += 1
+    merged.extend( left[ i: ] )
+    merged.extend( right[ j: ] )
+    return merged
+
+  return merge_sort
+
+sort_by_count     = make_sort_by_count()
+sort_pcs_by_count = make_sort_by_count()
+
+#-----------------------------------------------------------------------
+# json_str
+#-----------------------------------------------------------------------
+# Quotes value as a JSON string. str.replace only replaces characters
+# in RPython, so the string is escaped a character at a time.
+
+def json_str( value ):
+  chars = [ '"' ]
+  for c in value:
+    if c == '"' or c == '\\':
+      chars.append( '\\' + c )
+    elif ord( c ) < 0x20:
+      chars.append( '\\u00' + pad( "%x" % ord( c ), 2, "0", False ) )
+    else:
+      chars.append( c )
+  chars.append( '"' )
+  return ''.join( chars )
+
+#-----------------------------------------------------------------------
+# Profiler
+#-----------------------------------------------------------------------
+
+class Profiler( object ):
+
+  def __init__( self, filename, inst_nbytes=4, report_len=20 ):
+    self.filename    = filename
+    self.inst_nbytes = inst_nbytes
+    self.report_len  = report_len
+
+    self.num_insts = 0
+
+    # executions per pc, and the mnemonic of the instruction at each pc
+
+    self.pc_counts = {}
+    self.mnemonics = {}
+
+    # executions per basic block, keyed by the start pc and the number
+    # of instructions packed into an int (see block_key)
+
+    self.block_counts = {}
+    self.block_pc     = 0
+    self.block_len    = 0
+
+  #---------------------------------------------------------------------
+  # add_inst
+  #---------------------------------------------------------------------
+  # Called after the instruction inst at pc executed, after which
+  # execution continues at next_pc.
+
+  def add_inst( self, pc, inst, next_pc ):
+    if pc in self.pc_counts:
+      self.pc_counts[ pc ] += 1
+    else:
+      self.pc_counts[ pc ] = 1
+      self.mnemonics[ pc ] = inst.str
+    self.num_insts += 1
+
+    if self.block_len == 0:
+      self.block_pc = pc
+    self.block_len += 1
+    if next_pc != pc + self.inst_nbytes:
+      self.end_block()
+
+  #---------------------------------------------------------------------
+  # add_entries
+  #---------------------------------------------------------------------
+  # Called after the first count decode cache entries of a block
+  # starting at pc executed in block mode.
+
+  def add_entries( self, pc, entries, count, next_pc ):
+    for i in range( count ):
+      inst_pc = pc + i * self.inst_nbytes
+      if inst_pc in self.pc_counts:
+        self.pc_counts[ inst_pc ] += 1
+      else:
+        self.pc_counts[ inst_pc ] = 1
+        self.mnemonics[ inst_pc ] = entries[ i ].inst.str
+    self.num_insts += count
+
+    if self.block_len == 0:
+      self.block_pc = pc
+    self.block_len += count
+    if next_pc != pc + count * self.inst_nbytes:
+      self.end_block()
+
+  #---------------------------------------------------------------------
+  # end_block
+  #---------------------------------------------------------------------
+  # Blocks are keyed by the start pc shifted left by 16 bits, plus the
+  # number of instructions (capped to 16 bits).
+
+  def block_key( self, pc, num_insts ):
+    return ( pc << 16 ) | min( num_insts, 0xFFFF )
+
+  def end_block( self ):
+    if self.block_len == 0:
+      return
+    key = self.block_key( self.block_pc, self.block_len )
+    self.block_counts[ key ] = self.block_counts.get( key, 0 ) + 1
+    self.block_len = 0
+
+  #---------------------------------------------------------------------
+  # mnemonic_counts
+  #---------------------------------------------------------------------
+
+  def mnemonic_counts( self ):
+    counts = {}
+    for pc, count in self.pc_counts.items():
+      mnemonic = self.mnemonics[ pc ]
+      counts[ mnemonic ] = counts.get( mnemonic, 0 ) + count
+    return counts
+
+  #---------------------------------------------------------------------
+  # finish
+  #---------------------------------------------------------------------
+  # Prints the report and writes the JSON profile.
+
+  def finish( self ):
+    self.end_block()
+
+    mnemonic_counts = self.mnemonic_counts()
+    mnemonics = sort_by_count( mnemonic_counts.keys(), mnemonic_counts )
+    pcs       = sort_pcs_by_count( self.pc_counts.keys(), self.pc_counts )
+    blocks    = sort_pcs_by_count( self.block_counts.keys(),
+                                   self.block_counts )
+
+    self.print_report( mnemonics, mnemonic_counts, pcs, blocks )
+    try:
+      self.write_json( mnemonics, mnemonic_counts, pcs, blocks )
+    except OSError as e:
+      print "Could not write the profile to %s (errno=%d)" \
+            % ( self.filename, e.errno )
+      return
+    print "Wrote the profile of %d instructions to %s" \
+          % ( self.num_insts, self.filename )
+
+  def percent( self, count ):
+    if self.num_insts == 0:
+      return "0.00"
+    frac = 10000 * count / self.num_insts % 100
+    return "%d.%s" % ( 100 * count / self.num_insts,
+                       pad( "%d" % frac, 2, "0", False ) )
+
+  def print_report( self, mnemonics, mnemonic_counts, pcs, blocks ):
+    print "Instruction mix (%d instructions):" % self.num_insts
+    for mnemonic in mnemonics[ :self.report_len ]:
+      count = mnemonic_counts[ mnemonic ]
+      print "  %s %s %s%%" % ( pad( mnemonic, 12 ),
+                               pad( "%d" % count, 12, " ", False ),
+                               pad( self.percent( count ), 6, " ", False ) )
+
+    print "Hottest pcs:"
+    for pc in pcs[ :self.report_len ]:
+      count = self.pc_counts[ pc ]
+      print "  %s %s %s %s%%" % ( pad_hex( pc ),
+                                  pad( self.mnemonics[ pc ], 12 ),
+                                  pad( "%d" % count, 12, " ", False ),
+                                  pad( self.percent( count ), 6, " ", False ) )
+
+    print "Hottest basic blocks:"
+    for key in blocks[ :self.report_len ]:
+      count     = self.block_counts[ key ]
+      num_insts = key & 0xFFFF
+      print "  %s %s insts %s %s%%" % (
+              pad_hex( key >> 16 ),
+              pad( "%d" % num_insts, 5, " ", False ),
+              pad( "%d" % count, 12, " ", False ),
+              pad( self.percent( count * num_insts ), 6, " ", False ) )
+
+  def write_json( self, mnemonics, mnemonic_counts, pcs, blocks ):
+    lines = [ '{ "num_insts": %d,' % self.num_insts ]
+
+    lines.append( '  "mnemonics": [' )
+    lines.append( ',\n'.join( [
+      '    [ %s, %d ]' % ( json_str( mnemonic ), mnemonic_counts[ mnemonic ] )
+      for mnemonic in mnemonics ] ) )
+    lines.append( '  ],' )
+
+    lines.append( '  "pcs": [' )
+    lines.append( ',\n'.join( [
+      '    [ %d, %s, %d ]' % ( pc, json_str( self.mnemonics[ pc ] ),
+                              self.pc_counts[ pc ] )
+      for pc in pcs ] ) )
+    lines.append( '  ],' )
+
+    lines.append( '  "blocks": [' )
+    lines.append( ',\n'.join( [
+      '    [ %d, %d, %d ]' % ( key >> 16, key & 0xFFFF,
+                              self.block_counts[ key ] )
+      for key in blocks ] ) )
+    lines.append( '  ] }\n' )
+
+    data = '\n'.join( lines )
+    fd   = os.open( self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                    0644 )
+    while len( data ) > 0:
+      nbytes = os.write( fd, data )
+      data   = data[ nbytes: ]
+    os.close( fd )
@@ -0,0 +1,196 @@
+#=======================================================================
+# replay.py
+#=======================================================================
+# Records the results of the syscalls of a simulation to a log, and
+# replays them from the log in later simulations of the same program
+# instead of calling the syscall handlers. Replayed simulations are
+# deterministic and do no host file I/O, so they can run on machines
+# that don't have the input files of the program, and the host syscall
+# overhead does not distort timing comparisons between simulator builds.
+#
+# For each syscall, the log holds the hart, the syscall number and the
+# arguments, which are checked against the replayed syscall, the return
+# value and errno, and the data the handler wrote to the simulated
+# memory (e.g., by read, fstat and uname). The log is the magic string
+# followed by the records in the format of serialize.py, each of which
+# is written as soon as its syscall returns, so that the log of a
+# simulation that dies is complete up to its last syscall:
+#
+#   hartid, syscall number, arg0, arg1, arg2, return value, errno,
+#   number of memory writes, ( address, data ) of each memory write
+#
+# Only the handlers that have no effect outside the simulation (exit
+# and brk) run while replaying, as well as writes to stdout and stderr
+# so that the output of the program is shown (see call_syscall in
+# syscalls.py).
+
+import os
+
+from pydgin.misc      import FatalError
+from pydgin.serialize import BinaryReader, BinaryWriter, write_all
+
+SYSCALL_LOG_MAGIC = "PYDGIN-SYSCALLS-1\n"
+
+LOG_NONE   = 0
+LOG_RECORD = 1
+LOG_REPLAY = 2
+
+#-----------------------------------------------------------------------
+# SyscallLog
+#-----------------------------------------------------------------------
+
+class SyscallLog( object ):
+
+  def __init__( self ):
+    self.fd = -1
+    self.stop()
+
+  #---------------------------------------------------------------------
+  # record, replay, stop
+  #---------------------------------------------------------------------
+  # Start recording to or replaying from filename, or stop either. The
+  # log is shared by all simulations in a process, so each simulation
+  # sets the mode. record raises OSError if the log cannot be created.
+
+  def record( self, filename ):
+    self.stop()
+    self.fd       = os.open( filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                             0644 )
+    self.mode     = LOG_RECORD
+    self.filename = filename
+    self.write_log( SYSCALL_LOG_MAGIC )
+
+  def replay( self, filename ):
+    self.stop()
+    self.reader   = BinaryReader( filename, SYSCALL_LOG_MAGIC, "syscall log" )
+    self.mode     = LOG_REPLAY
+    self.filename = filename
+
+  def stop( self ):
+    self.close_log()
+    self.mode         = LOG_NONE
+    self.filename     = ""
+    self.reader       = None
+    self.num_syscalls = 0
+
+    # the memory writes of the current syscall while recording
+
+    self.write_addrs = []
+    self.write_data  = []
+
+  #---------------------------------------------------------------------
+  # add_mem_write
+  #---------------------------------------------------------------------
+  # Called by the syscall handlers for the data they write to memory.
+
+  def add_mem_write( self, addr, data ):
+    if self.mode == LOG_RECORD:
+      self.write_addrs.append( addr )
+      self.write_data.append( data )
+
+  #---------------------------------------------------------------------
+  # write_log, close_log
+  #---------------------------------------------------------------------
+  # A failed write stops the recording, the simulation goes on.
+
+  def write_log( self, data ):
+    try:
+      write_all( self.fd, data )
+    except OSError as e:
+      print "Could not write the syscall log to %s (errno=%d), " \
+            "recording stopped" % ( self.filename, e.errno )
+      self.stop()
+
+  def close_log( self ):
+    if self.fd >= 0:
+      try:
+        os.close( self.fd )
+      except OSError:
+        pass
+      self.fd = -1
+
+  #---------------------------------------------------------------------
+  # record_syscall
+  #---------------------------------------------------------------------
+  # The record is appended to the log right away.
+
+  def record_syscall( self, s, syscall_number, arg0, arg1, arg2,
+                      retval, errno ):
+    writer = BinaryWriter( "" )
+    writer.write_int( s.hartid )
+    writer.write_int( syscall_number )
+    writer.write_int( arg0 )
+    writer.write_int( arg1 )
+    writer.write_int( arg2 )
+    writer.write_int( retval )
+    writer.write_int( errno )
+    writer.write_int( len( self.write_addrs ) )
+    for i in xrange( len( self.write_addrs ) ):
+      writer.write_int( self.write_addrs[i] )
+      writer.write_str( self.write_data[i] )
+
+    self.write_addrs  = []
+    self.write_data   = []
+    self.num_syscalls += 1
+    self.write_log( writer.get_data() )
+
+  #---------------------------------------------------------------------
+  # replay_syscall
+  #---------------------------------------------------------------------
+  # Writes the recorded data of the next syscall to memory and returns
+  # its return value and errno. Raises FatalError if the simulation has
+  # diverged from the recorded one.
+
+  def replay_syscall( self, s, syscall_number, arg0, arg1, arg2 ):
+    if self.reader.at_end():
+      raise FatalError( "Syscall %d is not in the syscall log %s, which "
+                        "ends after %d syscalls"
+                        % ( syscall_number, self.filename,
+                            self.num_syscalls ) )
+
+    hartid = self.reader.read_int()
+    number = self.reader.read_int()
+    args   = [ self.reader.read_signed() for i in range( 3 ) ]
+    if hartid != s.hartid or number != syscall_number or \
+       args[0] != arg0 or args[1] != arg1 or args[2] != arg2:
+      raise FatalError( "Syscall %d of hart %d does not match syscall %d "
+                        "of hart %d in the syscall log %s (syscall #%d), "
+                        "the simulation has diverged from the recorded one"
+                        % ( syscall_number, s.hartid, number, hartid,
+                            self.filename, self.num_syscalls ) )
+
+    retval     = self.reader.read_signed()
+    errno      = self.reader.read_signed()
+    num_writes = self.reader.read_int()
+    for i in xrange( num_writes ):
+      addr = self.reader.read_int()
+      data = self.reader.read_str()
+      assert addr >= 0
+      s.mem.write_bytes( addr, data )
+
+    self.num_syscalls += 1
+    return retval, errno
+
+  #---------------------------------------------------------------------
+  # finish
+  #---------------------------------------------------------------------
+  # Closes the log, and stops recording or replaying.
+
+  def finish( self ):
+    if self.mode == LOG_RECORD:
+      print "Recorded %d syscalls to %s" \
+            % ( self.num_syscalls, self.filename )
+
+    elif self.mode == LOG_REPLAY:
+      print "Replayed %d syscalls from %s" \
+            % ( self.num_syscalls, self.filename )
+      if not self.reader.at_end():
+        print "WARNING: the simulation ended before the end of the " \
+              "syscall log"
+
+    self.stop()
+
+# the syscall log used by the syscalls, which is off unless recording or
+# replaying
+
+syscall_log = SyscallLog()
@@ -0,0 +1,43 @@
+#=======================================================================
+# replay_test.py
+#=======================================================================
+
+from pydgin.replay  import SyscallLog, SYSCALL_LOG_MAGIC
+from pydgin.storage import Memory
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+
+class State( object ):
+
+  def __init__( self ):
+    self.mem    = Memory( size=2**16 )
+    self.hartid = 0
+
+#-----------------------------------------------------------------------
+# test_streamed
+#-----------------------------------------------------------------------
+# Each syscall is in the log as soon as it is recorded, so the log of a
+# simulation that dies before finish can be replayed up to that point.
+
+def test_streamed( tmpdir ):
+  filename = str( tmpdir.join( "syscalls.log" ) )
+
+  log = SyscallLog()
+  log.record( filename )
+  log.add_mem_write( 0x1000, "abc" )
+  log.record_syscall( State(), 63, 0, 0x1000, 3, 3, 0 )
+
+  s        = State()
+  replayed = SyscallLog()
+  replayed.replay( filename )
+  assert replayed.replay_syscall( s, 63, 0, 0x1000, 3 ) == ( 3, 0 )
+  assert s.mem.read_bytes( 0x1000, 3 ) == "abc"
+  assert replayed.reader.at_end()
+
+  # a new recording drops the old one
+
+  log.record( filename )
+  log.finish()
+  assert tmpdir.join( "syscalls.log" ).size() == len( SYSCALL_LOG_MAGIC )
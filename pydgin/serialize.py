@@ -0,0 +1,101 @@
+#=======================================================================
+# serialize.py
+#=======================================================================
+# Reads and writes the simple binary format of checkpoints and virtual
+# filesystem images: a magic string followed by 64-bit little-endian
+# integers and length-prefixed strings.
+
+import os
+
+from pydgin.misc  import FatalError
+from pydgin.utils import r_uint, r_ulonglong, intmask, specialize, \
+                         we_are_translated
+
+#-----------------------------------------------------------------------
+# BinaryWriter
+#-----------------------------------------------------------------------
+
+class BinaryWriter( object ):
+
+  def __init__( self, magic ):
+    self.chunks = [ magic ]
+
+  @specialize.argtype(1)
+  def write_int( self, value ):
+    value = r_ulonglong( value )
+    self.chunks.append( ''.join( [ chr( intmask( (value >> 8*i) & 0xFF ) )
+                                   for i in range( 8 ) ] ) )
+
+  def write_str( self, value ):
+    self.write_int( len( value ) )
+    self.chunks.append( value )
+
+  def get_data( self ):
+    return ''.join( self.chunks )
+
+  def save( self, filename ):
+    fd = os.open( filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644 )
+    write_all( fd, self.get_data() )
+    os.close( fd )
+
+def write_all( fd, data ):
+  while len( data ) > 0:
+    nbytes = os.write( fd, data )
+    data   = data[ nbytes: ]
+
+#-----------------------------------------------------------------------
+# BinaryReader
+#-----------------------------------------------------------------------
+# kind is the type of file used in error messages.
+
+class BinaryReader( object ):
+
+  def __init__( self, filename, magic, kind ):
+    fd     = os.open( filename, os.O_RDONLY, 0 )
+    chunks = []
+    while True:
+      chunk = os.read( fd, 1 << 20 )
+      if chunk == "":
+        break
+      chunks.append( chunk )
+    os.close( fd )
+
+    self.kind = kind
+    self.data = ''.join( chunks )
+    self.idx  = len( magic )
+    if self.data[ : self.idx ] != magic:
+      raise FatalError( "%s is not a %s file" % ( filename, kind ) )
+
+  def read_uint( self ):
+    if self.idx + 8 > len( self.data ):
+      raise FatalError( "Truncated %s file" % self.kind )
+    value = r_uint( 0 )
+    for i in range( 8 ):
+      value = value | ( r_uint( ord( self.data[ self.idx + i ] ) ) << 8*i )
+    self.idx += 8
+    return value
+
+  def read_int( self ):
+    return intmask( self.read_uint() )
+
+  # intmask does not wrap in untranslated simulators, so negative values
+  # need to be converted explicitly
+
+  def read_signed( self ):
+    value = self.read_int()
+    if not we_are_translated() and value >= 0x8000000000000000:
+      value -= 0x10000000000000000
+    return value
+
+  def read_str( self ):
+    nbytes = self.read_int()
+    start  = self.idx
+    end    = start + nbytes
+    if nbytes < 0 or end > len( self.data ):
+      raise FatalError( "Truncated %s file" % self.kind )
+    assert start >= 0 and end >= 0
+    self.idx = end
+    return self.data[ start : end ]
+
+  def at_end( self ):
+    return self.idx == len( self.data )
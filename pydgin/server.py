@@ -0,0 +1,658 @@
+#=======================================================================
+# server.py
+#=======================================================================
+# A job server which runs simulations for clients on a pool of worker
+# processes. The server listens on a Unix domain socket and forks
+# num_workers workers, which accept connections in turn, so at most
+# num_workers simulations run at the same time. Each worker runs a job
+# per connection and stays alive for the next one, i.e., process startup
+# is paid once per worker, and the workers keep the loaded modules and
+# the cached virtual filesystem images (see vfs.py) between jobs. A
+# worker that dies is replaced.
+#
+# A client sends a request as a single line of JSON and gets the result
+# as a single line of JSON, after which the connection is closed:
+#
+#   request:  { "argv": [ "<token>", ... ], "cwd": "<directory>" }
+#   response: { "argv": [ "<token>", ... ], "return_code": <n>,
+#               "exited": <bool>, "status": <n>, "num_insts": <n>,
+#               "seconds": <wall clock time>,
+#               "stdout": "<output>", "stderr": "<output>" }
+#
+# argv is the command line of the job without the simulator itself, and
+# cwd the directory it runs in (the working directory of the server by
+# default). The fields of the response are those of a batch job (see
+# batch.py), plus everything the simulator and the program wrote to
+# stdout and stderr, with invalid UTF-8 replaced by U+FFFD. The program
+# reads from /dev/null. Invalid requests and jobs that fail with an
+# internal error get a response with an "error" message instead.
+# scripts/submit-job.py submits jobs from the command line.
+#
+# socket, signal and json are not RPython, so translated simulators use
+# rsocket and rsignal instead, and both parse the requests with the
+# small JSON parser below. The rpython modules are only imported where
+# they are used so that they don't slow down the startup of untranslated
+# simulators.
+
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import traceback
+
+from pydgin.batch    import Job
+from pydgin.debug    import pad
+from pydgin.misc     import FatalError, create_unlinked_file
+from pydgin.profiler import json_str
+from pydgin.syscalls import output_buffer
+from pydgin.utils    import we_are_translated
+
+MAX_REQUEST_NBYTES = 1 << 20
+MAX_JSON_DEPTH     = 64
+
+#-----------------------------------------------------------------------
+# SocketError
+#-----------------------------------------------------------------------
+
+class SocketError( Exception ):
+
+  def __init__( self, msg ):
+    self.msg = msg
+
+#-----------------------------------------------------------------------
+# Socket
+#-----------------------------------------------------------------------
+# A Unix domain stream socket, on top of socket or rsocket.
+
+class Socket( object ):
+
+  def __init__( self, sock=None ):
+    if sock is None:
+      if not we_are_translated():
+        sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+      else:
+        from rpython.rlib import rsocket
+        sock = rsocket.RSocket( rsocket.AF_UNIX, rsocket.SOCK_STREAM )
+    self.sock = sock
+
+  def connect( self, path ):
+    if not we_are_translated():
+      try:
+        self.sock.connect( path )
+      except socket.error as e:
+        raise SocketError( str( e ) )
+    else:
+      from rpython.rlib import rsocket
+      try:
+        self.sock.connect( rsocket.UNIXAddress( path ) )
+      except rsocket.SocketError as e:
+        raise SocketError( e.get_msg() )
+
+  def bind( self, path ):
+    if not we_are_translated():
+      try:
+        self.sock.bind( path )
+        self.sock.listen( 128 )
+      except socket.error as e:
+        raise SocketError( str( e ) )
+    else:
+      from rpython.rlib import rsocket
+      try:
+        self.sock.bind( rsocket.UNIXAddress( path ) )
+        self.sock.listen( 128 )
+      except rsocket.SocketError as e:
+        raise SocketError( e.get_msg() )
+
+  def accept( self ):
+    if not we_are_translated():
+      try:
+        conn, _ = self.sock.accept()
+      except socket.error as e:
+        raise SocketError( str( e ) )
+      return Socket( conn )
+    else:
+      from rpython.rlib import rsocket
+      try:
+        fd, _ = self.sock.accept()
+      except rsocket.SocketError as e:
+        raise SocketError( e.get_msg() )
+      return Socket( rsocket.RSocket( rsocket.AF_UNIX, rsocket.SOCK_STREAM,
+                                      fd=fd ) )
+
+  def recv( self, max_nbytes ):
+    if not we_are_translated():
+      try:
+        return self.sock.recv( max_nbytes )
+      except socket.error as e:
+        raise SocketError( str( e ) )
+    else:
+      from rpython.rlib import rsocket
+      try:
+        return self.sock.recv( max_nbytes )
+      except rsocket.SocketError as e:
+        raise SocketError( e.get_msg() )
+
+  def sendall( self, data ):
+    if not we_are_translated():
+      try:
+        self.sock.sendall( data )
+      except socket.error as e:
+        raise SocketError( str( e ) )
+    else:
+      from rpython.rlib import rsocket
+      try:
+        self.sock.sendall( data )
+      except rsocket.SocketError as e:
+        raise SocketError( e.get_msg() )
+
+  def close( self ):
+    if not we_are_translated():
+      self.sock.close()
+    else:
+      from rpython.rlib import rsocket
+      try:
+        self.sock.close()
+      except rsocket.SocketError:
+        pass
+
+#-----------------------------------------------------------------------
+# read_line
+#-----------------------------------------------------------------------
+
+def read_line( conn, max_nbytes ):
+  chunks = []
+  nbytes = 0
+  while True:
+    chunk = conn.recv( 65536 )
+    if chunk == "":
+      break
+    chunks.append( chunk )
+    nbytes += len( chunk )
+    if "\n" in chunk or nbytes > max_nbytes:
+      break
+  return "".join( chunks ).split( "\n" )[0]
+
+#-----------------------------------------------------------------------
+# JSON requests
+#-----------------------------------------------------------------------
+# Parses JSON into the values below, strings are kept as UTF-8. Raises
+# ValueError on invalid JSON.
+
+class JsonValue( object ):
+  pass
+
+class JsonObject( JsonValue ):
+
+  def __init__( self, fields ):
+    self.fields = fields
+
+class JsonArray( JsonValue ):
+
+  def __init__( self, items ):
+    self.items = items
+
+class JsonString( JsonValue ):
+
+  def __init__( self, value ):
+    self.value = value
+
+# numbers, booleans and null
+
+class JsonLiteral( JsonValue ):
+
+  def __init__( self, text ):
+    self.text = text
+
+class JsonParser( object ):
+
+  def __init__( self, text ):
+    self.text = text
+    self.pos  = 0
+
+  def parse( self ):
+    value = self.parse_value( 0 )
+    self.skip_space()
+    if self.pos != len( self.text ):
+      raise ValueError( "trailing data" )
+    return value
+
+  def skip_space( self ):
+    while self.pos < len( self.text ) and self.text[ self.pos ] in " \t\r\n":
+      self.pos += 1
+
+  def next_char( self ):
+    self.skip_space()
+    if self.pos >= len( self.text ):
+      raise ValueError( "unexpected end" )
+    return self.text[ self.pos ]
+
+  def expect( self, c ):
+    if self.next_char() != c:
+      raise ValueError( "expected %s" % c )
+    self.pos += 1
+
+  def parse_value( self, depth ):
+    if depth > MAX_JSON_DEPTH:
+      raise ValueError( "nested too deeply" )
+
+    c = self.next_char()
+    if c == "{":
+      return self.parse_object( depth )
+    elif c == "[":
+      return self.parse_array( depth )
+    elif c == '"':
+      return JsonString( self.parse_string() )
+
+    start = self.pos
+    while self.pos < len( self.text ) and \
+          self.text[ self.pos ] in "+-.0123456789eEaflnrstu":
+      self.pos += 1
+    text = self.text[ start : self.pos ]
+    if text not in [ "true", "false", "null" ]:
+      for c in text:
+        if c not in "+-.0123456789eE":
+          raise ValueError( "invalid literal" )
+      if text == "" or text[0] not in "-0123456789":
+        raise ValueError( "invalid literal" )
+    return JsonLiteral( text )
+
+  def parse_object( self, depth ):
+    self.expect( "{" )
+    fields = {}
+    if self.next_char() == "}":
+      self.pos += 1
+      return JsonObject( fields )
+    while True:
+      if self.next_char() != '"':
+        raise ValueError( "expected a key" )
+      key = self.parse_string()
+      self.expect( ":" )
+      fields[ key ] = self.parse_value( depth + 1 )
+      c = self.next_char()
+      self.pos += 1
+      if c == "}":
+        return JsonObject( fields )
+      if c != ",":
+        raise ValueError( "expected , or }" )
+
+  def parse_array( self, depth ):
+    self.expect( "[" )
+    items = []
+    if self.next_char() == "]":
+      self.pos += 1
+      return JsonArray( items )
+    while True:
+      items.append( self.parse_value( depth + 1 ) )
+      c = self.next_char()
+      self.pos += 1
+      if c == "]":
+        return JsonArray( items )
+      if c != ",":
+        raise ValueError( "expected , or ]" )
+
+  def parse_string( self ):
+    self.expect( '"' )
+    chars = []
+    while True:
+      if self.pos >= len( self.text ):
+        raise ValueError( "unterminated string" )
+      c = self.text[ self.pos ]
+      self.pos += 1
+      if c == '"':
+        return "".join( chars )
+      elif ord( c ) < 0x20:
+        raise ValueError( "control character in string" )
+      elif c != "\\":
+        chars.append( c )
+        continue
+
+      if self.pos >= len( self.text ):
+        raise ValueError( "unterminated string" )
+      c = self.text[ self.pos ]
+      self.pos += 1
+      if c in '"\\/':
+        chars.append( c )
+      elif c == "b":
+        chars.append( "\b" )
+      elif c == "f":
+        chars.append( "\f" )
+      elif c == "n":
+        chars.append( "\n" )
+      elif c == "r":
+        chars.append( "\r" )
+      elif c == "t":
+        chars.append( "\t" )
+      elif c == "u":
+        code = self.parse_hex4()
+        if 0xdc00 <= code < 0xe000:
+          raise ValueError( "unpaired surrogate" )
+        if 0xd800 <= code < 0xdc00:
+          if self.text[ self.pos : self.pos + 2 ] != "\\u":
+            raise ValueError( "unpaired surrogate" )
+          self.pos += 2
+          low = self.parse_hex4()
+          if not ( 0xdc00 <= low < 0xe000 ):
+            raise ValueError( "unpaired surrogate" )
+          code = 0x10000 + ( ( code - 0xd800 ) << 10 ) + ( low - 0xdc00 )
+        chars.append( utf8_encode( code ) )
+      else:
+        raise ValueError( "invalid escape" )
+
+  def parse_hex4( self ):
+    digits = self.text[ self.pos : self.pos + 4 ]
+    if len( digits ) != 4:
+      raise ValueError( "invalid escape" )
+    code = 0
+    for c in digits:
+      if "0" <= c <= "9":
+        code = code * 16 + ord( c ) - ord( "0" )
+      elif "a" <= c <= "f":
+        code = code * 16 + ord( c ) - ord( "a" ) + 10
+      elif "A" <= c <= "F":
+        code = code * 16 + ord( c ) - ord( "A" ) + 10
+      else:
+        raise ValueError( "invalid escape" )
+    self.pos += 4
+    return code
+
+def utf8_encode( code ):
+  if code < 0x80:
+    return chr( code )
+  elif code < 0x800:
+    return chr( 0xc0 | code >> 6 ) + chr( 0x80 | code & 0x3f )
+  elif code < 0x10000:
+    return chr( 0xe0 | code >> 12 ) + chr( 0x80 | code >> 6 & 0x3f ) + \
+           chr( 0x80 | code & 0x3f )
+  return chr( 0xf0 | code >> 18 ) + chr( 0x80 | code >> 12 & 0x3f ) + \
+         chr( 0x80 | code >> 6 & 0x3f ) + chr( 0x80 | code & 0x3f )
+
+# Returns the argv and the cwd of a request.
+
+def parse_request( line ):
+  request = JsonParser( line ).parse()
+  if not isinstance( request, JsonObject ) or "argv" not in request.fields:
+    raise ValueError( "expected an object with an argv" )
+
+  argv_value = request.fields[ "argv" ]
+  if not isinstance( argv_value, JsonArray ):
+    raise ValueError( "argv is not an array" )
+  argv = []
+  for token in argv_value.items:
+    if not isinstance( token, JsonString ):
+      raise ValueError( "argv holds a token that is not a string" )
+    argv.append( token.value )
+
+  cwd = os.getcwd()
+  if "cwd" in request.fields:
+    cwd_value = request.fields[ "cwd" ]
+    if not isinstance( cwd_value, JsonString ):
+      raise ValueError( "cwd is not a string" )
+    cwd = cwd_value.value
+
+  return argv, cwd
+
+# Replaces invalid UTF-8 in data with U+FFFD.
+
+def valid_utf8( data ):
+  if not we_are_translated():
+    return data.decode( "utf-8", "replace" ).encode( "utf-8" )
+  from rpython.rlib import runicode
+  text, _ = runicode.str_decode_utf_8( data, len( data ), "replace",
+                                       final=True )
+  return runicode.unicode_encode_utf_8( text, len( text ), "strict" )
+
+#-----------------------------------------------------------------------
+# catch_signals, check_signals, default_signals
+#-----------------------------------------------------------------------
+# SIGTERM and SIGINT stop the server. Untranslated simulators raise
+# StopServing from the signal handler, translated simulators only set a
+# flag, which interrupts os.waitpid and is checked by check_signals.
+# The workers stop on SIGTERM and SIGINT, and ignore SIGPIPE like the
+# python interpreter does, so that a client which closes its connection
+# early gets a SocketError instead of killing the worker.
+
+class StopServing( Exception ):
+  pass
+
+def stop_serving( signum, frame ):
+  raise StopServing()
+
+def catch_signals():
+  if not we_are_translated():
+    signal.signal( signal.SIGTERM, stop_serving )
+    signal.signal( signal.SIGINT,  stop_serving )
+  else:
+    from rpython.rlib import rsignal
+    rsignal.pypysig_setflag( signal.SIGTERM )
+    rsignal.pypysig_setflag( signal.SIGINT )
+
+def check_signals():
+  if we_are_translated():
+    from rpython.rlib import rsignal
+    if rsignal.pypysig_poll() != -1:
+      raise StopServing()
+
+def default_signals():
+  if not we_are_translated():
+    signal.signal( signal.SIGTERM, signal.SIG_DFL )
+    signal.signal( signal.SIGINT,  signal.SIG_DFL )
+  else:
+    from rpython.rlib import rsignal
+    rsignal.pypysig_default( signal.SIGTERM )
+    rsignal.pypysig_default( signal.SIGINT )
+    rsignal.pypysig_ignore( signal.SIGPIPE )
+
+#-----------------------------------------------------------------------
+# flush_output
+#-----------------------------------------------------------------------
+# Translated simulators write what they print right away.
+
+def flush_output():
+  output_buffer.flush_all()
+  if not we_are_translated():
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+#-----------------------------------------------------------------------
+# serve
+#-----------------------------------------------------------------------
+# Runs the server until it is interrupted or terminated. run_job(
+# sim_name, job ) runs a batch.Job and records its results.
+
+def serve( socket_path, num_workers, sim_name, run_job ):
+  listener = listen( socket_path )
+  print "Serving jobs on %s with %d workers" % ( socket_path, num_workers )
+  flush_output()
+
+  catch_signals()
+  workers = []
+  try:
+    run_workers( listener, num_workers, sim_name, run_job, workers )
+  except StopServing:
+    pass
+  finally:
+    for pid in workers:
+      try:
+        os.kill( pid, signal.SIGTERM )
+        os.waitpid( pid, 0 )
+      except OSError:
+        pass
+    listener.close()
+    os.unlink( socket_path )
+
+  print "Stopped serving jobs on %s" % socket_path
+
+# Keeps num_workers workers running until StopServing is raised. The
+# pids of the workers are kept in workers.
+
+def run_workers( listener, num_workers, sim_name, run_job, workers ):
+  while True:
+    while len( workers ) < num_workers:
+      workers.append( fork_worker( listener, sim_name, run_job ) )
+    check_signals()
+    try:
+      pid, status = os.waitpid( -1, 0 )
+    except OSError as e:
+      if e.errno != errno.EINTR:
+        raise
+      continue
+    if pid in workers:
+      workers.remove( pid )
+      print "Worker %d exited (status %d), starting a new one" \
+            % ( pid, status )
+      flush_output()
+
+# A socket file left by a server that did not shut down cleanly is
+# replaced, a socket that another server listens on is not.
+
+def listen( socket_path ):
+  try:
+    os.stat( socket_path )
+    exists = True
+  except OSError:
+    exists = False
+
+  if exists:
+    probe = Socket()
+    try:
+      probe.connect( socket_path )
+      listening = True
+    except SocketError:
+      listening = False
+    probe.close()
+    if listening:
+      raise FatalError( "Another server is listening on %s" % socket_path )
+    os.unlink( socket_path )
+
+  listener = Socket()
+  try:
+    listener.bind( socket_path )
+  except SocketError as e:
+    listener.close()
+    raise FatalError( "Could not listen on %s: %s" % ( socket_path, e.msg ) )
+  return listener
+
+#-----------------------------------------------------------------------
+# fork_worker
+#-----------------------------------------------------------------------
+# Returns the pid of the new worker.
+
+def fork_worker( listener, sim_name, run_job ):
+  pid = os.fork()
+  if pid != 0:
+    return pid
+
+  default_signals()
+  try:
+    while True:
+      conn = listener.accept()
+      try:
+        handle_request( conn, sim_name, run_job )
+      except SocketError as e:
+        print "Could not serve a request: %s" % e.msg
+        flush_output()
+      conn.close()
+  finally:
+    os._exit( 1 )
+
+#-----------------------------------------------------------------------
+# handle_request
+#-----------------------------------------------------------------------
+
+def handle_request( conn, sim_name, run_job ):
+  try:
+    argv, cwd = parse_request( read_line( conn, MAX_REQUEST_NBYTES ) )
+  except ValueError:
+    conn.sendall( '{ "error": "Invalid request" }\n' )
+    return
+
+  job = Job( 0, argv )
+  stdout, stderr, error = run_captured( job, cwd, sim_name, run_job )
+
+  fields = [
+    '"argv": [ %s ]' % ', '.join( [ json_str( token )
+                                    for token in job.argv ] ),
+    '"return_code": %d' % job.return_code,
+    '"exited": %s' % ( "true" if job.exited else "false" ),
+    '"status": %d' % job.status,
+    '"num_insts": %d' % job.num_insts,
+    '"seconds": %d.%s' % ( job.usecs / 1000000,
+                           pad( "%d" % ( job.usecs % 1000000 ), 6, "0",
+                                False ) ),
+    '"stdout": %s' % json_str( valid_utf8( stdout ) ),
+    '"stderr": %s' % json_str( valid_utf8( stderr ) ),
+  ]
+  if error != "":
+    fields.append( '"error": %s' % json_str( valid_utf8( error ) ) )
+  conn.sendall( "{ %s }\n" % ", ".join( fields ) )
+
+#-----------------------------------------------------------------------
+# run_captured
+#-----------------------------------------------------------------------
+# Runs a job in cwd with stdout and stderr redirected to temporary files
+# and returns what was written to them, and a description of an
+# internal error (or "").
+
+def run_captured( job, cwd, sim_name, run_job ):
+  server_cwd = os.getcwd()
+  stdout_fd  = create_unlinked_file( [ "/tmp" ] )
+  stderr_fd  = create_unlinked_file( [ "/tmp" ] )
+  null_fd    = os.open( "/dev/null", os.O_RDONLY, 0 )
+
+  flush_output()
+  saved_fds = [ os.dup( fd ) for fd in [ 0, 1, 2 ] ]
+  os.dup2( null_fd,   0 )
+  os.dup2( stdout_fd, 1 )
+  os.dup2( stderr_fd, 2 )
+
+  error = ""
+  try:
+    try:
+      os.chdir( cwd )
+      run_job( sim_name, job )
+    except OSError as e:
+      error = "Could not run the job in %s (errno=%d)" % ( cwd, e.errno )
+    except Exception:
+      if not we_are_translated():
+        error = traceback.format_exc()
+      else:
+        error = "The job failed with an internal error"
+  finally:
+    flush_output()
+    for fd in [ 0, 1, 2 ]:
+      os.dup2( saved_fds[ fd ], fd )
+      os.close( saved_fds[ fd ] )
+    os.close( null_fd )
+    os.chdir( server_cwd )
+
+  return read_file( stdout_fd ), read_file( stderr_fd ), error
+
+# Reads a file from the start and closes it.
+
+def read_file( fd ):
+  os.lseek( fd, 0, 0 )
+  chunks = []
+  while True:
+    chunk = os.read( fd, 1 << 20 )
+    if chunk == "":
+      break
+    chunks.append( chunk )
+  os.close( fd )
+  return "".join( chunks )
+
+#-----------------------------------------------------------------------
+# submit
+#-----------------------------------------------------------------------
+# Submits a job to the server listening on socket_path and returns the
+# response. Used by clients, untranslated only.
+
+def submit( socket_path, argv, cwd ):
+  conn = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+  try:
+    conn.connect( socket_path )
+    conn.sendall( json.dumps( { "argv": argv, "cwd": cwd } ) + "\n" )
+    return json.loads( read_line( conn, sys.maxint ) )
+  finally:
+    conn.close()
@@ -0,0 +1,70 @@
+#=======================================================================
+# server_test.py
+#=======================================================================
+
+import os
+import json
+import pytest
+
+from pydgin.server import parse_request, valid_utf8, run_captured
+
+#-----------------------------------------------------------------------
+# test_parse_request
+#-----------------------------------------------------------------------
+# The requests must parse like they do with json, with the strings
+# encoded as UTF-8.
+
+def test_parse_request():
+  argv = [ "--max-insts", "100", "a b\t\"c\"\\", u"caf\xe9", u"\U0001f600" ]
+  line = json.dumps( { "argv": argv, "cwd": "/tmp", "extra": [ 1, -2.5e3,
+                       True, False, None, { "x": [] } ] } )
+
+  assert parse_request( line ) == \
+    ( [ token.encode( "utf-8" ) for token in argv ], "/tmp" )
+  assert parse_request( '{"argv":[]}' ) == ( [], os.getcwd() )
+  assert parse_request( ' { "argv" : [ "\\u00e9\\/" ] } ' )[0] == \
+    [ "\xc3\xa9/" ]
+
+@pytest.mark.parametrize( "line", [
+  '', '[]', '{}', '{ "argv": "a" }', '{ "argv": [ 1 ] }',
+  '{ "argv": [], "cwd": null }', '{ "argv": [] } x', '{ "argv": [ "a" ',
+  '{ "argv": [ "a\nb" ] }', '{ "argv": [ "\\x" ] }',
+  '{ "argv": [ "\\ud800" ] }', '{ "argv": [ "\\udc00" ] }',
+  '{ "argv": [], "x": tru }', '{ "argv": [], "x": [ 1, ] }',
+  '{ "argv": [], "x": %s }' % ( "[" * 100 + "]" * 100 ),
+] )
+def test_parse_invalid_request( line ):
+  with pytest.raises( ValueError ):
+    parse_request( line )
+
+#-----------------------------------------------------------------------
+# test_valid_utf8
+#-----------------------------------------------------------------------
+
+def test_valid_utf8():
+  assert valid_utf8( "abc \xc3\xa9" ) == "abc \xc3\xa9"
+  assert valid_utf8( "a\xffb\xc3" ) == "a\xef\xbf\xbdb\xef\xbf\xbd"
+
+#-----------------------------------------------------------------------
+# test_run_captured
+#-----------------------------------------------------------------------
+# The output of a job is captured in its directory, and the directory
+# of the server is restored afterwards.
+
+def run_job( sim_name, job ):
+  os.write( 1, "%s %s in %s\n" % ( sim_name, job, os.getcwd() ) )
+  os.write( 2, "error\n" )
+
+def test_run_captured( tmpdir ):
+  cwd = os.getcwd()
+  stdout, stderr, error = run_captured( "job", str( tmpdir ), "sim",
+                                        run_job )
+  assert stdout == "sim job in %s\n" % tmpdir
+  assert stderr == "error\n"
+  assert error  == ""
+  assert os.getcwd() == cwd
+
+  stdout, stderr, error = run_captured( "job", str( tmpdir.join( "x" ) ),
+                                        "sim", run_job )
+  assert stdout == ""
+  assert error.startswith( "Could not run the job in" )
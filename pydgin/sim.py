@@ -6,6 +6,8 @@
 
 import os
 import sys
+import time
+import traceback
 
 # ensure we know where the pypy source code is
 # XXX: removed the dependency to PYDGIN_PYPY_SRC_DIR because rpython
@@ -18,9 +20,23 @@ import sys
 #  print "NOTE: PYDGIN_PYPY_SRC_DIR not defined, using pure python " \
 #        "implementation"
 
-from pydgin.debug import Debug, pad, pad_hex
-from pydgin.misc  import FatalError, NotImplementedInstError
-from pydgin.jit   import JitDriver, hint, set_user_param, set_param
+from pydgin.debug        import Debug, pad, pad_hex
+from pydgin.misc         import FatalError, NotImplementedInstError
+from pydgin.jit          import JitDriver, hint, set_user_param, set_param
+from pydgin.decode_cache import DecodeCache
+from pydgin.checkpoint   import save_checkpoint, restore_checkpoint
+from pydgin.bbv          import BBVProfiler
+from pydgin.profiler     import Profiler
+from pydgin.trace        import TraceWriter
+from pydgin.stats        import StatsCollector
+from pydgin.parallel     import run_parallel, share_memory
+from pydgin.server       import serve
+from pydgin.utils        import we_are_translated, intmask
+from pydgin.batch        import read_manifest, write_results
+from pydgin.syscalls     import output_buffer, buffer_policies, BUFFER_NONE, \
+                                close_files
+from pydgin.vfs          import vfs, load_image
+from pydgin.replay       import syscall_log
 
 def jitpolicy(driver):
   from rpython.jit.codewriter.policy import JitPolicy
@@ -59,6 +75,56 @@ class Sim( object ):
 
     self.max_insts = 0
 
+    # cache of decoded instructions keyed by pc, this is disabled in
+    # translation if the jit is enabled (see target)
+
+    self.decode_cache = DecodeCache()
+
+    # block mode executes straight-line runs of cached instructions and
+    # does the per-instruction bookkeeping once per block
+
+    self.block_mode    = False
+    self.max_block_len = 32
+
+    # a checkpoint is saved once checkpoint_at instructions have been
+    # executed, 0 disables checkpointing
+
+    self.checkpoint_at   = 0
+    self.checkpoint_file = ""
+
+    # collects basic block vectors for sampled simulation if enabled
+
+    self.bbv = None
+
+    # counts the executed instructions per mnemonic, pc and basic block
+    # if enabled
+
+    self.profiler = None
+
+    # collects per-region statistics if enabled. Child classes list the
+    # mnemonics of their branch and jump instructions in branch_insts,
+    # and set writes_pc if other instructions can write the pc (see
+    # StatsCollector).
+
+    self.stats        = None
+    self.branch_insts = []
+    self.writes_pc    = None
+
+    # the states of the harts sharing the memory, which are scheduled
+    # round-robin for quantum instructions each. state is the hart that
+    # is currently running, and quantum_end the instruction count at
+    # which it is switched out (0 if there is a single hart).
+
+    self.harts       = []
+    self.quantum     = 1000
+    self.quantum_end = 0
+
+    # runs each hart in its own process instead, on the shared memory
+    # (see parallel.py)
+
+    self.parallel   = False
+    self.shared_mem = None
+
   #-----------------------------------------------------------------------
   # decode
   #-----------------------------------------------------------------------
@@ -85,6 +151,54 @@ class Sim( object ):
   def init_state( self, exe_file, exe_name, run_argv, testbin ):
     raise NotImplementedError()
 
+  #-----------------------------------------------------------------------
+  # init_harts
+  #-----------------------------------------------------------------------
+  # Child classes that support multiple harts override this to create
+  # the states of harts 1 to num_harts-1 after init_state, and return
+  # the states of all harts.
+
+  def init_harts( self, num_harts ):
+    raise FatalError( "%s does not support multiple harts"
+                      % self.arch_name_human )
+
+  #-----------------------------------------------------------------------
+  # reset
+  #-----------------------------------------------------------------------
+  # Drops the options and the state of the previous simulation, so that
+  # another simulation can run in the same process (see batch.py).
+
+  def reset( self ):
+    self.max_insts       = 0
+    self.block_mode      = False
+    self.checkpoint_at   = 0
+    self.checkpoint_file = ""
+    self.bbv             = None
+    self.profiler        = None
+    self.stats           = None
+    self.state           = None
+    self.harts           = []
+    self.quantum         = 1000
+    self.quantum_end     = 0
+    self.parallel        = False
+    self.shared_mem      = None
+
+    if self.decode_cache is not None:
+      self.decode_cache.flush()
+
+    close_files()
+
+  #-----------------------------------------------------------------------
+  # total_insts
+  #-----------------------------------------------------------------------
+  # Returns the number of instructions executed by all harts.
+
+  def total_insts( self ):
+    num_insts = 0
+    for hart in self.harts:
+      num_insts += hart.num_insts
+    return num_insts
+
   #-----------------------------------------------------------------------
   # help message
   #-----------------------------------------------------------------------
@@ -93,11 +207,25 @@ class Sim( object ):
   help_message = """
   Pydgin %s Instruction Set Simulator
   usage: %s <args> <sim_exe> <sim_args>
+         %s --batch <manifest> [<results>]
+         %s --server <socket> [<workers>]
 
   <sim_exe>  the executable to be simulated
   <sim_args> arguments to be passed to the simulated executable
   <args>     the following optional arguments are supported:
 
+    --batch <manifest> [<results>]
+                    Run the jobs listed in <manifest> one after another in
+                    this process and write their results to <results> (by
+                    default batch-results.json). Each line of <manifest>
+                    has the <args> <sim_exe> <sim_args> of a job (see
+                    pydgin/batch.py). Must be the first argument
+    --server <socket> [<workers>]
+                    Run jobs submitted on the Unix domain socket <socket>
+                    (e.g., with scripts/submit-job.py) on <workers>
+                    worker processes (by default 1), until terminated
+                    (see pydgin/server.py). Must be the first argument
+
     --help,-h       Show this message and exit
     --test          Run in testing mode (for running asm tests)
     --env,-e <NAME>=<VALUE>
@@ -116,7 +244,67 @@ class Sim( object ):
          syscalls           syscall information
          bootstrap          initial stack and register state
 
-    --max-insts <i> Run until the maximum number of instructions
+    --max-insts <i> Run until the maximum number of instructions (per hart)
+    --harts <n>     Run <n> harts which share the memory (RISC-V only).
+                    All harts start at the entry point, hart i with its
+                    stack below the stack of hart i-1. The simulation
+                    ends when hart 0 exits
+    --quantum <i>   Switch to the next hart after <i> instructions
+                    (default 1000)
+    --parallel      Run each hart in its own process on shared memory
+                    instead of switching between them (see
+                    pydgin/parallel.py)
+    --checkpoint-at <i>[:<file>]
+                    Save a checkpoint of the simulation to <file> (by
+                    default checkpoint-<i>.ckpt) after <i> instructions
+                    and continue running
+    --restore <file>
+                    Load the program and then restore the checkpoint in
+                    <file> before running. The program and its arguments
+                    should be the same as when the checkpoint was saved
+    --bbv <i>[:<file>]
+                    Collect a basic block vector for every interval of
+                    <i> instructions and write them to <file> (by
+                    default pydgin.bb) in the SimPoint .bb format
+    --buffer-output <policy>[:<size>]
+                    Buffer the writes of the simulated program to stdout
+                    and stderr on the host. <policy> is one of line (flush
+                    on newlines), full (flush when <size> bytes, by
+                    default 4096, are buffered) or exit (flush when the
+                    program exits). Buffers are always flushed before
+                    reads from stdin
+    --vfs <image>   Serve the files in the virtual filesystem <image>
+                    (created with scripts/mkvfs.py) from memory. Writes to
+                    these files are not written back to the image or the
+                    host
+    --profile <file>
+                    Count the executions of each instruction mnemonic, pc
+                    and basic block, print the most executed ones at the
+                    end and write the full profile to <file> as JSON
+    --stats <file>  Collect statistics (instruction mix, loads and stores,
+                    branches and memory footprint) for each region of the
+                    program in which stats are enabled, print them at the
+                    end and write them to <file> as JSON
+    --trace <file>  Write a binary trace of the executed instructions,
+                    register writes and memory accesses to <file> (see
+                    pydgin/trace.py and scripts/dump-trace.py). <file> can
+                    be a named pipe, or "|<command>" to stream the trace
+                    to the standard input of <command>
+    --trace-compress
+                    Compress the trace in blocks with zlib
+    --record-syscalls <file>
+                    Record the results of all syscalls, including the data
+                    they write to memory, to <file>
+    --replay-syscalls <file>
+                    Replay the syscalls recorded in <file> instead of
+                    executing them on the host (see pydgin/replay.py). The
+                    program, its arguments and the simulator options that
+                    affect it must be the same as when recording
+    --blocks        Execute cached blocks of straight-line instructions
+                    instead of one instruction at a time. This is faster
+                    without the JIT, but the insts, rf and regdump debug
+                    flags, the pre/post execute hooks and --trace are not
+                    supported
     --jit <flags>   Set flags to tune the JIT (see
                     rpython.rlib.jit.PARAMETER_DOCS)
 
@@ -136,6 +324,106 @@ class Sim( object ):
   # run
   #-----------------------------------------------------------------------
   def run( self ):
+    if len( self.harts ) > 1:
+      if self.parallel:
+        run_parallel( self )
+      else:
+        self.run_harts()
+    elif self.block_mode:
+      self.run_blocks()
+    else:
+      self.run_insts()
+
+    if self.bbv is not None:
+      self.bbv.finish()
+
+    if self.profiler is not None:
+      self.profiler.finish()
+
+    if self.stats is not None:
+      self.stats.finish()
+
+    if self.state.debug.trace is not None:
+      self.state.debug.trace.close()
+
+    syscall_log.finish()
+
+    # the program may not have exited through the exit syscall
+
+    output_buffer.flush_all()
+
+    print 'DONE! Status =', self.state.status
+    if len( self.harts ) > 1:
+      for hart in self.harts:
+        print 'Hart %d: %d instructions' % ( hart.hartid, hart.num_insts )
+      print 'Instructions Executed =', self.total_insts()
+    else:
+      print 'Instructions Executed =', self.state.num_insts
+
+  #-----------------------------------------------------------------------
+  # run_harts
+  #-----------------------------------------------------------------------
+  # Runs each hart that has not exited for a quantum in turn, until hart
+  # 0 or all harts have exited. run_insts and run_blocks return at the
+  # end of the quantum, any other return (an error or max_insts) ends
+  # the simulation.
+
+  def run_harts( self ):
+    while self.harts[0].running:
+      num_running = 0
+      for hart in self.harts:
+        if not hart.running:
+          continue
+
+        self.state       = hart
+        self.quantum_end = hart.num_insts + self.quantum
+        self.debug.set_state( hart )
+        if self.stats is not None:
+          self.stats.state = hart
+
+        if self.block_mode:
+          self.run_blocks()
+        else:
+          self.run_insts()
+
+        # the next hart does not continue the basic block of this one
+
+        if self.profiler is not None:
+          self.profiler.end_block()
+        if self.bbv is not None:
+          self.bbv.end_block()
+
+        if hart.running and hart.num_insts != self.quantum_end:
+          self.state = self.harts[0]
+          return
+        if hart.running:
+          num_running += 1
+
+      if num_running == 0:
+        break
+
+    self.state = self.harts[0]
+
+  #-----------------------------------------------------------------------
+  # take_checkpoint
+  #-----------------------------------------------------------------------
+
+  def take_checkpoint( self ):
+    try:
+      save_checkpoint( self.state, self.checkpoint_file )
+    except OSError as e:
+      print "Could not save checkpoint to %s (errno=%d)" \
+            % ( self.checkpoint_file, e.errno )
+      return
+    print "Saved checkpoint to %s after %d instructions" \
+          % ( self.checkpoint_file, self.state.num_insts )
+
+  #-----------------------------------------------------------------------
+  # run_insts
+  #-----------------------------------------------------------------------
+  # Executes one instruction at a time.
+
+  def run_insts( self ):
     self = hint( self, promote=True )
     s = self.state
 
@@ -163,14 +451,25 @@ class Sim( object ):
       # So we use normal read if memcheck is enabled which includes the
       # memory checks
 
-      if s.debug.enabled( "memcheck" ):
+      entry = None
+      if self.decode_cache is not None:
+        entry = self.decode_cache.lookup( pc )
+
+      if entry is not None:
+        inst_bits = entry.inst.bits
+      elif s.debug.enabled( "memcheck" ):
         inst_bits = mem.read( pc, 4 )
       else:
         # we use trace elidable iread instead of just read
         inst_bits = mem.iread( pc, 4 )
 
       try:
-        inst, exec_fun = self.decode( inst_bits )
+        if entry is not None:
+          inst, exec_fun = entry.inst, entry.exec_fun
+        else:
+          inst, exec_fun = self.decode( inst_bits )
+          if self.decode_cache is not None:
+            self.decode_cache.insert( pc, inst, exec_fun )
 
         if s.debug.enabled( "insts" ):
           print "%s %s %s" % (
@@ -178,6 +477,9 @@ class Sim( object ):
                   pad( inst.str, 12 ),
                   pad( "%d" % s.num_insts, 8 ), ),
 
+        if s.debug.trace is not None:
+          s.debug.trace.inst( pc, inst_bits )
+
         self.pre_execute()
 
         exec_fun( s, inst )
@@ -196,6 +498,13 @@ class Sim( object ):
       s.num_insts += 1    # TODO: should this be done inside instruction definition?
       if s.stats_en: s.stat_num_insts += 1
 
+      if self.bbv is not None:
+        self.bbv.add_insts( pc, 1, s.fetch_pc() )
+      if self.profiler is not None:
+        self.profiler.add_inst( pc, inst, s.fetch_pc() )
+      if self.stats is not None:
+        self.stats.add_inst( pc, inst, s.fetch_pc() )
+
       self.post_execute()
 
       if s.debug.enabled( "insts" ):
@@ -209,6 +518,14 @@ class Sim( object ):
         print "Reached the max_insts (%d), exiting." % max_insts
         break
 
+      if s.num_insts == self.checkpoint_at:
+        self.take_checkpoint()
+
+      # give the next hart its turn
+
+      if s.num_insts == self.quantum_end:
+        break
+
       if s.fetch_pc() < old:
         jitdriver.can_enter_jit(
           pc        = s.fetch_pc(),
@@ -217,8 +534,149 @@ class Sim( object ):
           sim       = self,
         )
 
-    print 'DONE! Status =', s.status
-    print 'Instructions Executed =', s.num_insts
+  #-----------------------------------------------------------------------
+  # get_block
+  #-----------------------------------------------------------------------
+  # Returns the cached block starting at pc, decoding a new one if
+  # necessary. A block ends at max_block_len instructions, at a page
+  # boundary, or before an instruction that cannot be decoded. We don't
+  # stop at control-flow instructions since run_blocks leaves the block
+  # as soon as the pc does not fall through, so blocks are effectively
+  # superblocks along the fall-through path.
+
+  def get_block( self, pc ):
+    cache = self.decode_cache
+    block = cache.lookup_block( pc )
+    if block is not None:
+      return block
+
+    mem     = self.state.mem
+    entries = []
+    addr    = pc
+    while len( entries ) < self.max_block_len:
+      entry = cache.lookup( addr )
+      if entry is None:
+        inst_bits = mem.iread( addr, 4 )
+        try:
+          inst, exec_fun = self.decode( inst_bits )
+        except FatalError:
+          # only the first instruction needs to be valid, the others may
+          # be data after an unconditional jump
+          if len( entries ) == 0:
+            raise
+          break
+        entry = cache.insert( addr, inst, exec_fun )
+      entries.append( entry )
+      addr += 4
+      if ( addr >> cache.page_bits ) != ( pc >> cache.page_bits ):
+        break
+
+    return cache.insert_block( pc, entries )
+
+  #-----------------------------------------------------------------------
+  # run_blocks
+  #-----------------------------------------------------------------------
+  # Executes a cached block at a time. Within a block we only check that
+  # execution falls through to the next instruction, that the simulator
+  # is still running, and that the block has not been invalidated by a
+  # write to its instructions. The instruction counts, stats and the
+  # max_insts check are updated once per block.
+
+  def run_blocks( self ):
+    s = self.state
+
+    max_insts = self.max_insts
+
+    while s.running:
+
+      pc = s.fetch_pc()
+
+      try:
+        block = self.get_block( pc )
+      except FatalError as error:
+        print "Exception in execution (pc: 0x%s), aborting!" % pad_hex( pc )
+        print "Exception message: %s" % error.msg
+        break
+
+      # don't run past max_insts
+
+      num_entries = len( block.entries )
+      if max_insts != 0 and max_insts - s.num_insts < num_entries:
+        num_entries = max_insts - s.num_insts
+
+      # or past the checkpoint
+
+      if self.checkpoint_at > s.num_insts and \
+         self.checkpoint_at - s.num_insts < num_entries:
+        num_entries = self.checkpoint_at - s.num_insts
+
+      # or past the end of the quantum of the hart
+
+      if self.quantum_end > s.num_insts and \
+         self.quantum_end - s.num_insts < num_entries:
+        num_entries = self.quantum_end - s.num_insts
+
+      # or past the end of a bbv interval
+
+      if self.bbv is not None and self.bbv.insts_left() < num_entries:
+        num_entries = self.bbv.insts_left()
+
+      stats_en  = s.stats_en
+      count     = 0
+      next_pc   = pc
+      error_msg = ""
+
+      try:
+        while count < num_entries:
+          entry = block.entries[ count ]
+          count += 1
+          entry.exec_fun( s, entry.inst )
+          next_pc += 4
+          if s.fetch_pc() != next_pc or not s.running or not block.valid \
+             or s.stats_en != stats_en:
+            break
+
+      # next_pc is still the pc of an instruction that raises
+
+      except NotImplementedInstError:
+        count -= 1
+        error_msg = "Instruction not implemented: %s (pc: 0x%s), aborting!" \
+                    % ( block.entries[ count ].inst.str, pad_hex( next_pc ) )
+      except FatalError as error:
+        count -= 1
+        error_msg = "Exception in execution (pc: 0x%s), aborting!\n" \
+                    % pad_hex( next_pc ) + \
+                    "Exception message: %s" % error.msg
+
+      # like in run_insts, an instruction that changes stats_en is
+      # counted according to the new value
+
+      s.num_insts += count
+      if count > 0:
+        if stats_en:   s.stat_num_insts += count - 1
+        if s.stats_en: s.stat_num_insts += 1
+
+      if self.bbv is not None and count > 0:
+        self.bbv.add_insts( pc, count, s.fetch_pc() )
+      if self.profiler is not None and count > 0:
+        self.profiler.add_entries( pc, block.entries, count, s.fetch_pc() )
+      if self.stats is not None and count > 0:
+        self.stats.add_entries( pc, block.entries, count, s.fetch_pc(),
+                                stats_en )
+
+      if error_msg != "":
+        print error_msg
+        break
+
+      if max_insts != 0 and s.num_insts >= max_insts:
+        print "Reached the max_insts (%d), exiting." % max_insts
+        break
+
+      if s.num_insts == self.checkpoint_at:
+        self.take_checkpoint()
+
+      if s.num_insts == self.quantum_end:
+        break
 
   #-----------------------------------------------------------------------
   # get_entry_point
@@ -227,18 +685,30 @@ class Sim( object ):
   # simulator
 
   def get_entry_point( self ):
-    def entry_point( argv ):
 
-      # set the trace_limit parameter of the jitdriver
-      if self.jit_enabled:
-        set_param( self.jitdriver, "trace_limit", self.default_trace_limit )
+    # runs a single simulation with the given command line
+
+    def run_job( argv ):
 
       filename_idx       = 0
       debug_flags        = []
       debug_starts_after = 0
       testbin            = False
       max_insts          = 0
+      num_harts          = 1
       envp               = []
+      restore_file       = ""
+      bbv_interval       = 0
+      bbv_file           = "pydgin.bb"
+      buffer_policy      = BUFFER_NONE
+      buffer_size        = 4096
+      vfs_image          = ""
+      profile_file       = ""
+      stats_file         = ""
+      trace_file         = ""
+      trace_compress     = False
+      record_file        = ""
+      replay_file        = ""
 
       # we're using a mini state machine to parse the args
 
@@ -250,6 +720,18 @@ class Sim( object ):
                            "-e", "--env",
                            "-d", "--debug",
                            "--max-insts",
+                           "--harts",
+                           "--quantum",
+                           "--checkpoint-at",
+                           "--restore",
+                           "--bbv",
+                           "--buffer-output",
+                           "--vfs",
+                           "--profile",
+                           "--stats",
+                           "--trace",
+                           "--record-syscalls",
+                           "--replay-syscalls",
                            "--jit",
                          ]
 
@@ -261,12 +743,26 @@ class Sim( object ):
         if prev_token == "":
 
           if token == "--help" or token == "-h":
-            print self.help_message % ( self.arch_name_human, argv[0] )
+            print self.help_message % ( self.arch_name_human, argv[0],
+                                        argv[0], argv[0] )
             return 0
 
           elif token == "--test":
             testbin = True
 
+          elif token == "--parallel":
+            self.parallel = True
+
+          elif token == "--trace-compress":
+            trace_compress = True
+
+          elif token == "--blocks":
+            if self.decode_cache is None:
+              print "WARNING: block mode needs the decode cache, which is " + \
+                    "disabled in JIT translations. Ignoring --blocks."
+            else:
+              self.block_mode = True
+
           elif token == "--debug" or token == "-d":
             prev_token = token
             # warn the user if debugs are not enabled for this translation
@@ -288,23 +784,84 @@ class Sim( object ):
             break
 
         else:
-          if prev_token == "--env" or prev_token == "-e":
-            envp.append( token )
-
-          elif prev_token == "--debug" or prev_token == "-d":
-            # if debug start after provided (using a colon), parse it
-            debug_tokens = token.split( ":" )
-            if len( debug_tokens ) > 1:
-              debug_starts_after = int( debug_tokens[1] )
-
-            debug_flags = debug_tokens[0].split( "," )
-
-          elif prev_token == "--max-insts":
-            self.max_insts = int( token )
-
-          elif prev_token == "--jit":
-            # pass the jit flags to rpython.rlib.jit
-            set_user_param( self.jitdriver, token )
+          # the integer values raise ValueError if they are malformed
+
+          try:
+            if prev_token == "--env" or prev_token == "-e":
+              envp.append( token )
+
+            elif prev_token == "--debug" or prev_token == "-d":
+              # if debug start after provided (using a colon), parse it
+              debug_tokens = token.split( ":" )
+              if len( debug_tokens ) > 1:
+                debug_starts_after = int( debug_tokens[1] )
+
+              debug_flags = debug_tokens[0].split( "," )
+
+            elif prev_token == "--max-insts":
+              self.max_insts = int( token )
+
+            elif prev_token == "--harts":
+              num_harts = int( token )
+
+            elif prev_token == "--quantum":
+              self.quantum = int( token )
+
+            elif prev_token == "--checkpoint-at":
+              # if a checkpoint file is provided (using a colon), parse it
+              checkpoint_tokens = token.split( ":" )
+              self.checkpoint_at = int( checkpoint_tokens[0] )
+              if len( checkpoint_tokens ) > 1:
+                self.checkpoint_file = checkpoint_tokens[1]
+              else:
+                self.checkpoint_file = "checkpoint-%d.ckpt" \
+                                       % self.checkpoint_at
+
+            elif prev_token == "--restore":
+              restore_file = token
+
+            elif prev_token == "--bbv":
+              # if a bbv file is provided (using a colon), parse it
+              bbv_tokens   = token.split( ":" )
+              bbv_interval = int( bbv_tokens[0] )
+              if len( bbv_tokens ) > 1:
+                bbv_file = bbv_tokens[1]
+
+            elif prev_token == "--buffer-output":
+              # if a buffer size is provided (using a colon), parse it
+              buffer_tokens = token.split( ":" )
+              if buffer_tokens[0] not in buffer_policies:
+                print "Unknown output buffering policy %s" % buffer_tokens[0]
+                return 1
+              buffer_policy = buffer_policies[ buffer_tokens[0] ]
+              if len( buffer_tokens ) > 1:
+                buffer_size = int( buffer_tokens[1] )
+
+            elif prev_token == "--vfs":
+              vfs_image = token
+
+            elif prev_token == "--profile":
+              profile_file = token
+
+            elif prev_token == "--stats":
+              stats_file = token
+
+            elif prev_token == "--trace":
+              trace_file = token
+
+            elif prev_token == "--record-syscalls":
+              record_file = token
+
+            elif prev_token == "--replay-syscalls":
+              replay_file = token
+
+            elif prev_token == "--jit":
+              # pass the jit flags to rpython.rlib.jit
+              set_user_param( self.jitdriver, token )
+
+          except ValueError:
+            print "Invalid value %s for %s" % ( token, prev_token )
+            return 1
 
           prev_token = ""
 
@@ -312,10 +869,77 @@ class Sim( object ):
         print "You must supply a filename"
         return 1
 
+      if num_harts > 1 and ( restore_file != "" or self.checkpoint_at != 0
+                             or trace_file != "" ):
+        print "--restore, --checkpoint-at and --trace are not supported " + \
+              "with multiple harts"
+        return 1
+
+      if self.quantum <= 0:
+        print "The quantum must be at least 1 instruction"
+        return 1
+
+      if self.parallel:
+        if num_harts < 2:
+          print "--parallel needs at least 2 harts"
+          return 1
+        if bbv_interval > 0 or profile_file != "" or stats_file != "":
+          print "--bbv, --profile and --stats are not supported with " + \
+                "--parallel"
+          return 1
+        if record_file != "" or replay_file != "":
+          print "--record-syscalls and --replay-syscalls are not " + \
+                "supported with --parallel"
+          return 1
+
+      if record_file != "" and replay_file != "":
+        print "--record-syscalls and --replay-syscalls cannot be combined"
+        return 1
+
+      # the buffer is shared by all simulators in the process, so the
+      # policy is always set
+
+      output_buffer.set_policy( buffer_policy, buffer_size )
+
+      # the same goes for the syscall log
+
+      if record_file != "":
+        try:
+          syscall_log.record( record_file )
+        except OSError as e:
+          print "Could not create %s (errno=%d)" % ( record_file, e.errno )
+          return 1
+      elif replay_file != "":
+        try:
+          syscall_log.replay( replay_file )
+        except OSError as e:
+          print "Could not open %s (errno=%d)" % ( replay_file, e.errno )
+          return 1
+        except FatalError as error:
+          print "Could not load %s: %s" % ( replay_file, error.msg )
+          return 1
+      else:
+        syscall_log.stop()
+
       # create a Debug object which contains the debug flags
 
       self.debug = Debug( debug_flags, debug_starts_after )
 
+      # block mode cannot print per-instruction traces, and it does not
+      # call the pre/post execute hooks, which print with rf on arm
+
+      if self.block_mode and ( "insts"   in debug_flags or
+                               "rf"      in debug_flags or
+                               "regdump" in debug_flags ):
+        print "WARNING: insts, rf and regdump debug flags are not " + \
+              "supported in block mode. Ignoring --blocks."
+        self.block_mode = False
+
+      if self.block_mode and trace_file != "":
+        print "WARNING: --trace is not supported in block mode. " + \
+              "Ignoring --blocks."
+        self.block_mode = False
+
       filename = argv[ filename_idx ]
 
       # args after program are args to the simulated program
@@ -332,17 +956,97 @@ class Sim( object ):
         return 1
 
       # Call ISA-dependent init_state to load program, initialize memory
-      # etc.
+      # etc. The executable is closed right away, also if loading fails,
+      # so that a restored file of the program can take its file
+      # descriptor and the server does not leak it.
 
-      self.init_state( exe_file, filename, run_argv, envp, testbin )
+      try:
+        self.init_state( exe_file, filename, run_argv, envp, testbin )
+      finally:
+        exe_file.close()
+
+      # mount the virtual filesystem, the files of the previous
+      # simulation in this process are dropped in any case
+
+      if vfs_image != "":
+        try:
+          vfs.mount( load_image( vfs_image ) )
+        except OSError as e:
+          print "Could not open %s (errno=%d)" % ( vfs_image, e.errno )
+          return 1
+        except FatalError as error:
+          print "Could not load %s: %s" % ( vfs_image, error.msg )
+          return 1
+      else:
+        vfs.mount( {} )
+
+      # restore the checkpoint over the freshly loaded program, this
+      # needs to happen before the decode cache is attached below
+
+      if restore_file != "":
+        try:
+          restore_checkpoint( self.state, restore_file )
+        except OSError as e:
+          print "Could not restore checkpoint %s (errno=%d)" \
+                % ( restore_file, e.errno )
+          return 1
+        except FatalError as error:
+          print "Could not restore checkpoint %s: %s" \
+                % ( restore_file, error.msg )
+          return 1
+        print "Restored checkpoint %s at %d instructions" \
+              % ( restore_file, self.state.num_insts )
+
+      # create the other harts, which share the memory of the first one
+
+      self.harts = [ self.state ]
+      if num_harts > 1:
+        try:
+          self.harts = self.init_harts( num_harts )
+        except FatalError as error:
+          print error.msg
+          return 1
+        if self.parallel:
+          try:
+            share_memory( self )
+          except OSError as e:
+            print "Could not create the shared memory (errno=%d)" % e.errno
+            return 1
 
       # pass the state to debug for cycle-triggered debugging
 
       self.debug.set_state( self.state )
 
-      # Close after loading
+      # the trace starts after the program is loaded
+
+      if trace_file != "":
+        try:
+          self.debug.add_trace( TraceWriter( trace_file, trace_compress ) )
+        except OSError as e:
+          print "Could not open %s (errno=%d)" % ( trace_file, e.errno )
+          return 1
+
+      # the stats observe the memory accesses through debug
+
+      if stats_file != "":
+        self.stats = StatsCollector( stats_file, self.state,
+                                     self.branch_insts,
+                                     writes_pc=self.writes_pc )
+        self.debug.add_trace( self.stats )
+
+      if bbv_interval > 0:
+        try:
+          self.bbv = BBVProfiler( bbv_interval, bbv_file )
+        except OSError as e:
+          print "Could not open %s (errno=%d)" % ( bbv_file, e.errno )
+          return 1
+
+      if profile_file != "":
+        self.profiler = Profiler( profile_file )
+
+      # let the memory invalidate the decode cache on writes to code
 
-      exe_file.close()
+      self.state.mem.decode_cache = self.decode_cache
 
       # Execute the program
 
@@ -350,6 +1054,113 @@ class Sim( object ):
 
       return 0
 
+    # runs a job of a batch or of the job server in a clean simulator
+    # and records its results
+
+    def run_recorded_job( sim_name, job ):
+      self.reset()
+      start_time = time.time()
+
+      # an error in the job (e.g., a program that is not an ELF file)
+      # only fails that job instead of ending the batch or the worker
+
+      try:
+        job.return_code = run_job( [ sim_name ] + job.argv )
+      except Exception:
+        if not we_are_translated():
+          traceback.print_exc( file=sys.stdout )
+        print "The job failed with an error"
+        job.return_code = 1
+
+        # keep the syscalls and the output of the job up to the error
+
+        syscall_log.finish()
+        output_buffer.flush_all()
+      job.usecs = int( ( time.time() - start_time ) * 1000000 )
+
+      if self.state is not None:
+        job.exited    = not self.state.running
+        job.status    = intmask( self.state.status )
+        job.num_insts = self.total_insts()
+
+    # runs the jobs of a manifest, see batch.py
+
+    def run_batch( argv ):
+
+      if len( argv ) < 3 or len( argv ) > 4:
+        print "usage: %s --batch <manifest> [<results>]" % argv[0]
+        return 1
+
+      manifest_file = argv[2]
+      results_file  = "batch-results.json"
+      if len( argv ) > 3:
+        results_file = argv[3]
+
+      try:
+        jobs = read_manifest( manifest_file )
+      except OSError as e:
+        print "Could not open %s (errno=%d)" % ( manifest_file, e.errno )
+        return 1
+      except FatalError as error:
+        print error.msg
+        return 1
+
+      num_failed = 0
+      for i in xrange( len( jobs ) ):
+        job = jobs[i]
+        print "Batch job %d/%d (line %d): %s" \
+              % ( i + 1, len( jobs ), job.line, " ".join( job.argv ) )
+
+        run_recorded_job( argv[0], job )
+        if job.failed():
+          num_failed += 1
+
+      try:
+        write_results( results_file, jobs )
+      except OSError as e:
+        print "Could not write the results to %s (errno=%d)" \
+              % ( results_file, e.errno )
+        return 1
+      print "Ran %d jobs (%d failed), wrote the results to %s" \
+            % ( len( jobs ), num_failed, results_file )
+
+      return 0
+
+    # serves jobs submitted by clients, see server.py
+
+    def run_server( argv ):
+
+      if len( argv ) < 3 or len( argv ) > 4:
+        print "usage: %s --server <socket> [<workers>]" % argv[0]
+        return 1
+
+      num_workers = 1
+      if len( argv ) > 3:
+        num_workers = int( argv[3] )
+      if num_workers <= 0:
+        print "The server needs at least 1 worker"
+        return 1
+
+      try:
+        serve( argv[2], num_workers, argv[0], run_recorded_job )
+      except FatalError as error:
+        print error.msg
+        return 1
+
+      return 0
+
+    def entry_point( argv ):
+
+      # set the trace_limit parameter of the jitdriver
+      if self.jit_enabled:
+        set_param( self.jitdriver, "trace_limit", self.default_trace_limit )
+
+      if len( argv ) > 1 and argv[1] == "--batch":
+        return run_batch( argv )
+      if len( argv ) > 1 and argv[1] == "--server":
+        return run_server( argv )
+      return run_job( argv )
+
     return entry_point
 
   #-----------------------------------------------------------------------
@@ -377,6 +1188,12 @@ class Sim( object ):
     if Debug.global_enabled:
       exe_name += "-debug"
 
+    # the jit already constant-folds the decode of traced instructions,
+    # so the decode cache only pays off without the jit
+
+    if driver.config.translation.jit:
+      self.decode_cache = None
+
     print "Translated binary name:", exe_name
     driver.exe_name = exe_name
 
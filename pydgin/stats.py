@@ -0,0 +1,262 @@
+#=======================================================================
+# stats.py
+#=======================================================================
+# Collects statistics for the stats regions of a program, i.e., the
+# parts of the execution in which stats_en is set. Programs set and
+# clear stats_en around the code they want to measure (e.g., the timed
+# kernel of a microbenchmark) with mtc0 statsen on PARC, the stats CSR
+# on RISC-V, and a write to coprocessor 7 on ARM.
+#
+# Each time stats_en is set, a new region starts. For each region, and
+# for all regions together, we count the instructions per mnemonic, the
+# loads and stores, the taken and not-taken branches and jumps, and the
+# number of distinct cache lines accessed by loads and stores (the
+# memory footprint). Each copy of a syscall from or to the memory of the
+# program (e.g., the buffer of a read or write) counts as one load or
+# store of its size. The statistics are printed at the end of the
+# simulation and written to a JSON file:
+#
+#   { "regions": [ <region>, ... ], "total": <region> }
+#
+# where each region is
+#
+#   { "start_inst": <instructions executed before the region>,
+#     "num_insts": <n>, "loads": <n>, "stores": <n>,
+#     "load_bytes": <n>, "store_bytes": <n>,
+#     "branches_taken": <n>, "branches_not_taken": <n>,
+#     "footprint_bytes": <n>,
+#     "mnemonics": [ [ "<mnemonic>", <count> ], ... ] }
+
+import os
+
+from pydgin.trace    import Tracer
+from pydgin.utils    import intmask
+from pydgin.profiler import sort_by_count, json_str
+
+# the footprint is counted in cache lines of 2**FOOTPRINT_LINE_BITS bytes
+
+FOOTPRINT_LINE_BITS = 6
+
+#-----------------------------------------------------------------------
+# RegionStats
+#-----------------------------------------------------------------------
+
+class RegionStats( object ):
+
+  def __init__( self, start_inst ):
+    self.start_inst         = start_inst
+    self.num_insts          = 0
+    self.mnemonic_counts    = {}
+    self.loads              = 0
+    self.stores             = 0
+    self.load_bytes         = 0
+    self.store_bytes        = 0
+    self.branches_taken     = 0
+    self.branches_not_taken = 0
+
+    # the accessed cache lines, used as a set
+
+    self.lines = {}
+
+  def add_inst( self, mnemonic, is_branch, taken ):
+    self.num_insts += 1
+    self.mnemonic_counts[ mnemonic ] = \
+      self.mnemonic_counts.get( mnemonic, 0 ) + 1
+    if is_branch:
+      if taken: self.branches_taken     += 1
+      else:     self.branches_not_taken += 1
+
+  def add_access( self, addr, nbytes, is_store ):
+    if is_store:
+      self.stores      += 1
+      self.store_bytes += nbytes
+    else:
+      self.loads       += 1
+      self.load_bytes  += nbytes
+
+    line = addr >> FOOTPRINT_LINE_BITS
+    last = ( addr + nbytes - 1 ) >> FOOTPRINT_LINE_BITS
+    while line <= last:
+      self.lines[ line ] = True
+      line += 1
+
+  #---------------------------------------------------------------------
+  # merge
+  #---------------------------------------------------------------------
+  # Adds the statistics of another region to this one.
+
+  def merge( self, other ):
+    self.num_insts          += other.num_insts
+    self.loads              += other.loads
+    self.stores             += other.stores
+    self.load_bytes         += other.load_bytes
+    self.store_bytes        += other.store_bytes
+    self.branches_taken     += other.branches_taken
+    self.branches_not_taken += other.branches_not_taken
+    for mnemonic, count in other.mnemonic_counts.items():
+      self.mnemonic_counts[ mnemonic ] = \
+        self.mnemonic_counts.get( mnemonic, 0 ) + count
+    for line in other.lines.keys():
+      self.lines[ line ] = True
+
+  def footprint_bytes( self ):
+    return len( self.lines ) << FOOTPRINT_LINE_BITS
+
+  def to_json( self, indent ):
+    mnemonics = sort_by_count( self.mnemonic_counts.keys(),
+                               self.mnemonic_counts )
+    fields = [
+      '"start_inst": %d'         % self.start_inst,
+      '"num_insts": %d'          % self.num_insts,
+      '"loads": %d'              % self.loads,
+      '"stores": %d'             % self.stores,
+      '"load_bytes": %d'         % self.load_bytes,
+      '"store_bytes": %d'        % self.store_bytes,
+      '"branches_taken": %d'     % self.branches_taken,
+      '"branches_not_taken": %d' % self.branches_not_taken,
+      '"footprint_bytes": %d'    % self.footprint_bytes(),
+      '"mnemonics": [ %s ]' % ', '.join( [
+        '[ %s, %d ]' % ( json_str( mnemonic ),
+                         self.mnemonic_counts[ mnemonic ] )
+        for mnemonic in mnemonics ] ),
+    ]
+    return '{ ' + ( ',\n' + indent + '  ' ).join( fields ) + ' }'
+
+#-----------------------------------------------------------------------
+# StatsCollector
+#-----------------------------------------------------------------------
+# branch_insts are the mnemonics of the branch and jump instructions of
+# the ISA. ISAs in which other instructions can write the pc (e.g., mov
+# pc, lr in ARM) also pass writes_pc, a function that returns True for
+# those instructions. A branch is taken if execution does not continue
+# at the next instruction.
+
+class StatsCollector( Tracer ):
+
+  def __init__( self, filename, state, branch_insts, inst_nbytes=4,
+                writes_pc=None ):
+    self.filename    = filename
+    self.state       = state
+    self.inst_nbytes = inst_nbytes
+    self.writes_pc   = writes_pc
+
+    self.branch_insts = {}
+    for mnemonic in branch_insts:
+      self.branch_insts[ mnemonic ] = True
+
+    self.regions = []
+    self.region  = None
+
+  # returns the current region, starting a new one if necessary
+
+  def current_region( self, start_inst ):
+    if self.region is None:
+      self.region = RegionStats( start_inst )
+      self.regions.append( self.region )
+    return self.region
+
+  #---------------------------------------------------------------------
+  # mem_read, mem_write, mem_read_bytes, mem_write_bytes
+  #---------------------------------------------------------------------
+  # Called by the memory through Debug.trace during the execution of an
+  # instruction, before it is counted. The bulk accesses of syscalls are
+  # counted as single accesses. The addresses are masked to ints, since
+  # the memories of the isas pass both ints and r_uints.
+
+  def mem_read( self, addr, nbytes, value ):
+    if self.state.stats_en:
+      self.current_region( self.state.num_insts ).add_access(
+        intmask( addr ), nbytes, False )
+
+  def mem_write( self, addr, nbytes, value ):
+    if self.state.stats_en:
+      self.current_region( self.state.num_insts ).add_access(
+        intmask( addr ), nbytes, True )
+
+  def mem_read_bytes( self, addr, data ):
+    if self.state.stats_en and len( data ) > 0:
+      self.current_region( self.state.num_insts ).add_access(
+        intmask( addr ), len( data ), False )
+
+  def mem_write_bytes( self, addr, data ):
+    if self.state.stats_en and len( data ) > 0:
+      self.current_region( self.state.num_insts ).add_access(
+        intmask( addr ), len( data ), True )
+
+  #---------------------------------------------------------------------
+  # add_inst, add_entries
+  #---------------------------------------------------------------------
+  # Called after the instruction inst at pc executed, after which
+  # execution continues at next_pc. Like stat_num_insts, an instruction
+  # that changes stats_en is counted according to the new value.
+
+  def add_inst( self, pc, inst, next_pc ):
+    self.count_inst( inst, next_pc != pc + self.inst_nbytes,
+                     self.state.stats_en != 0, self.state.num_insts - 1 )
+
+  # Called after the first count decode cache entries of a block starting
+  # at pc executed in block mode. Blocks end at changes of stats_en, so
+  # all but the last instruction executed with stats_en_before.
+
+  def add_entries( self, pc, entries, count, next_pc, stats_en_before ):
+    start_inst = self.state.num_insts - count
+    for i in range( count - 1 ):
+      self.count_inst( entries[ i ].inst, False, stats_en_before != 0,
+                       start_inst + i )
+    end_pc = intmask( pc ) + count * self.inst_nbytes
+    self.count_inst( entries[ count - 1 ].inst, intmask( next_pc ) != end_pc,
+                     self.state.stats_en != 0, start_inst + count - 1 )
+
+  def count_inst( self, inst, taken, enabled, inst_idx ):
+    if not enabled:
+      self.region = None
+      return
+    is_branch = inst.str in self.branch_insts
+    if not is_branch and self.writes_pc is not None:
+      is_branch = self.writes_pc( inst )
+    self.current_region( inst_idx ).add_inst( inst.str, is_branch, taken )
+
+  #---------------------------------------------------------------------
+  # finish
+  #---------------------------------------------------------------------
+  # Prints a summary of each region and writes the JSON statistics.
+
+  def finish( self ):
+    total = RegionStats( 0 )
+    for region in self.regions:
+      total.merge( region )
+
+    print "Stats regions: %d" % len( self.regions )
+    for i in range( len( self.regions ) ):
+      self.print_region( "region %d" % i, self.regions[ i ] )
+    if len( self.regions ) > 1:
+      self.print_region( "total", total )
+
+    try:
+      self.write_json( total )
+    except OSError as e:
+      print "Could not write the stats to %s (errno=%d)" \
+            % ( self.filename, e.errno )
+      return
+    print "Wrote the stats of %d regions to %s" \
+          % ( len( self.regions ), self.filename )
+
+  def print_region( self, name, region ):
+    print "  %s: %d insts, %d loads, %d stores, %d/%d branches " \
+          "taken/not taken, %d bytes footprint" \
+          % ( name, region.num_insts, region.loads, region.stores,
+              region.branches_taken, region.branches_not_taken,
+              region.footprint_bytes() )
+
+  def write_json( self, total ):
+    data = '{ "regions": [\n    %s ],\n  "total": %s }\n' % (
+             ',\n    '.join( [ region.to_json( '    ' )
+                               for region in self.regions ] ),
+             total.to_json( '  ' ) )
+
+    fd = os.open( self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                  0644 )
+    while len( data ) > 0:
+      nbytes = os.write( fd, data )
+      data   = data[ nbytes: ]
+    os.close( fd )
@@ -0,0 +1,52 @@
+#=======================================================================
+# stats_test.py
+#=======================================================================
+
+from pydgin.debug    import Debug
+from pydgin.stats    import StatsCollector
+from pydgin.storage  import Memory
+from pydgin.syscalls import syscall_open, syscall_read, put_str, \
+                            close_files
+from pydgin.vfs      import vfs
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+
+class State( object ):
+
+  def __init__( self ):
+    self.mem       = Memory( size=2**16 )
+    self.debug     = Debug()
+    self.mem.debug = self.debug
+    self.stats_en  = 0
+    self.num_insts = 0
+
+#-----------------------------------------------------------------------
+# test_syscall_accesses
+#-----------------------------------------------------------------------
+# The copy of a syscall counts as one store of its size in the region
+# in which the syscall executes, and outside of the regions not at all.
+
+def test_syscall_accesses( request ):
+  vfs.mount( { "in.txt" : "0123456789" * 10 } )
+  request.addfinalizer( close_files )
+
+  s     = State()
+  stats = StatsCollector( "stats.json", s, [] )
+  s.debug.add_trace( stats )
+  put_str( s, 0x2000, "in.txt\0" )
+  fd, errno = syscall_open( s, 0x2000, 0, 0 )
+  assert errno == 0
+
+  syscall_read( s, fd, 0x1000, 10 )
+  assert stats.regions == []
+
+  s.stats_en = 1
+  s.mem.write( 0x1000, 4, 0x12345678 )
+  assert syscall_read( s, fd, 0x1040, 70 ) == ( 70, 0 )
+
+  region = stats.current_region( 0 )
+  assert ( region.loads, region.stores ) == ( 0, 2 )
+  assert region.store_bytes               == 74
+  assert region.footprint_bytes()         == 3 * 64
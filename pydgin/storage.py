@@ -2,9 +2,16 @@
 # storage.py
 #=======================================================================
 
+import os
+import mmap
+import fcntl
+import struct
+from array import array
 from pydgin.jit               import elidable, unroll_safe, hint
 from debug                    import Debug, pad, pad_hex
-from pydgin.utils             import r_uint, specialize
+from pydgin.utils             import r_uint, intmask, specialize
+from pydgin.misc              import create_unlinked_file
+from pydgin.trace             import split_access, bytes_value
 try:
   from rpython.rlib.rarithmetic import r_uint32, widen
 except ImportError:
@@ -12,6 +19,15 @@ except ImportError:
   r_uint32 = int
   def widen( value ):
     return value
+try:
+  from rpython.rlib.objectmodel       import we_are_translated
+  from rpython.rlib                   import rmmap
+  from rpython.rtyper.lltypesystem    import rffi, lltype
+  from rpython.translator.tool.cbuild import ExternalCompilationInfo
+except ImportError:
+  def we_are_translated():
+    return False
+  rmmap = None
 
 #-----------------------------------------------------------------------
 # RegisterFile
@@ -41,6 +57,8 @@ class RegisterFile( object ):
 
   def _set_item( self, idx, value ):
     self.regs[idx] = value
+    if self.debug.trace is not None:
+      self.debug.trace.reg_write( idx, value )
     if self.debug.enabled( "rf" ):
       print ':: WR.RF[%s] = %s' % (
                         pad( "%d" % idx, 2 ),
@@ -49,6 +67,8 @@ class RegisterFile( object ):
   def _set_item_const_zero( self, idx, value ):
     if idx != 0:
       self.regs[idx] = value
+      if self.debug.trace is not None:
+        self.debug.trace.reg_write( idx, value )
       if self.debug.enabled( "rf" ):
         print ':: WR.RF[%s] = %s' % (
                           pad( "%d" % idx, 2 ),
@@ -71,7 +91,8 @@ class RegisterFile( object ):
 #-----------------------------------------------------------------------
 # Memory
 #-----------------------------------------------------------------------
-def Memory( data=None, size=2**10, byte_storage=False ):
+def Memory( data=None, size=2**10, byte_storage=False, paged_storage=True,
+            page_bits=12 ):
   # use sparse storage if not translated
   try:
     from rpython.rlib.objectmodel import we_are_translated
@@ -80,22 +101,88 @@ def Memory( data=None, size=2**10, byte_storage=False ):
     sparse_storage = True
 
   if sparse_storage:
-    print "NOTE: Using sparse storage"
-    if byte_storage:
-      return _SparseMemory( _ByteMemory )
+    # byte_storage only matters for translated simulators, untranslated
+    # ones always keep their pages in arrays
+    BlockMemory = _ArrayMemory
+    if paged_storage:
+      print "NOTE: Using paged storage"
+      return _PagedMemory( BlockMemory, page_bits )
     else:
-      return _SparseMemory( _WordMemory )
+      print "NOTE: Using sparse storage"
+      return _SparseMemory( BlockMemory )
   else:
     if byte_storage:
       return _ByteMemory( data, size )
     else:
       return _WordMemory( data, size )
 
+# granularity of the ranges returned by nonzero_ranges
+_range_nbytes = 4096
+
+#-----------------------------------------------------------------------
+# _Memory
+#-----------------------------------------------------------------------
+# The atomic accesses of memories that are private to the simulator
+# process, in which each instruction executes atomically anyway. The
+# atomic memory operations bracket their accesses with atomic_begin and
+# atomic_end, and a store conditional only succeeds if
+# reservation_held. See _SharedMemory for memory shared by several
+# simulator processes.
+#
+# The memory also holds the program break (see syscall_brk), which is a
+# property of the address space and so shared by all harts using the
+# memory.
+
+class _Memory( object ):
+
+  breakpoint = r_uint( 0 )
+
+  def get_breakpoint( self ):
+    return self.breakpoint
+
+  def set_breakpoint( self, breakpoint ):
+    self.breakpoint = breakpoint
+
+  def atomic_begin( self, addr ):
+    pass
+
+  def atomic_end( self, addr ):
+    pass
+
+  def reservation_held( self, addr, num_bytes, value ):
+    return True
+
+  # The bulk accesses of read_bytes and write_bytes are printed and
+  # traced like those of read and write, unless the memory is part of
+  # another one or a checkpoint is saved.
+
+  suppress_debug = False
+
+  def debug_read_bytes( self, start_addr, data ):
+    if self.suppress_debug:
+      return
+    if self.debug.enabled( "mem" ):
+      for offset, nbytes in split_access( start_addr, len( data ) ):
+        print ':: RD.MEM[%s] = %s' % ( pad_hex( start_addr + offset ),
+               pad_hex( bytes_value( data, offset, nbytes ) ) ),
+    if self.debug.trace is not None:
+      self.debug.trace.mem_read_bytes( start_addr, data )
+
+  def debug_write_bytes( self, start_addr, data ):
+    if self.suppress_debug:
+      return
+    if self.debug.trace is not None:
+      self.debug.trace.mem_write_bytes( start_addr, data )
+    if self.debug.enabled( "mem" ):
+      for offset, nbytes in split_access( start_addr, len( data ) ):
+        print ':: WR.MEM[%s] = %s' % ( pad_hex( start_addr + offset ),
+               pad_hex( bytes_value( data, offset, nbytes ) ) ),
+
 #-------------------------------------------------------------------------
 # _WordMemory
 #-------------------------------------------------------------------------
 # Memory that uses ints instead of chars
-class _WordMemory( object ):
+class _WordMemory( _Memory ):
   def __init__( self, data=None, size=2**10, suppress_debug=False ):
     self.data  = data if data else [ r_uint32(0) ] * (size >> 2)
     self.size  = r_uint(len( self.data ) << 2)
@@ -105,6 +192,9 @@ class _WordMemory( object ):
     # TODO: pass data_section to memory for bounds checking
     self.data_section = 0x00000000
 
+    # set by the simulator to invalidate decoded instructions on writes
+    self.decode_cache = None
+
   def bounds_check( self, addr, x ):
     # check if the accessed data is larger than the memory size
     if addr > self.size:
@@ -149,6 +239,8 @@ class _WordMemory( object ):
 
     if self.debug.enabled( "mem" ):
       print '%s' % pad_hex( value ),
+    if self.debug.trace is not None and not self.suppress_debug:
+      self.debug.trace.mem_read( start_addr, num_bytes, value )
 
     return r_uint( value )
 
@@ -172,6 +264,10 @@ class _WordMemory( object ):
 
     if self.debug.enabled( "memcheck" ) and not self.suppress_debug:
       self.bounds_check( start_addr, 'WR' )
+    if self.debug.trace is not None and not self.suppress_debug:
+      self.debug.trace.mem_write( start_addr, num_bytes, value )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, num_bytes )
 
     if   num_bytes == 4:  # TODO: byte should only be 0 (only aligned)
       pass # no masking needed
@@ -191,16 +287,64 @@ class _WordMemory( object ):
                                      pad_hex( value ) ),
     self.data[ word ] = r_uint32( value )
 
+  #---------------------------------------------------------------------
+  # read_bytes, write_bytes
+  #---------------------------------------------------------------------
+  # Bulk copies between the memory and strings, used by the loader and
+  # syscalls instead of a read or write call per byte.
+
+  def read_bytes( self, start_addr, num_bytes ):
+    chars = [ '\0' ] * num_bytes
+    for i in xrange( num_bytes ):
+      addr     = start_addr + i
+      word     = widen( self.data[ addr >> 2 ] )
+      chars[i] = chr( ( word >> ((addr & 0b11) * 8) ) & 0xFF )
+    data = ''.join( chars )
+    self.debug_read_bytes( start_addr, data )
+    return data
+
+  def write_bytes( self, start_addr, data ):
+    self.debug_write_bytes( start_addr, data )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, len( data ) )
+    for i in xrange( len( data ) ):
+      addr = start_addr + i
+      byte = addr & 0b11
+      mask = ~(0xFF << (byte * 8)) & r_uint( 0xFFFFFFFF )
+      word = ( widen( self.data[ addr >> 2 ] ) & mask ) \
+             | ( r_uint( ord( data[i] ) ) << (byte * 8) )
+      self.data[ addr >> 2 ] = r_uint32( word )
+
+  #---------------------------------------------------------------------
+  # nonzero_ranges
+  #---------------------------------------------------------------------
+  # Returns ( start_addr, num_bytes ) pairs covering all non-zero bytes
+  # of the memory, which is what a checkpoint needs to save.
+
+  def nonzero_ranges( self ):
+    ranges = []
+    size   = len( self.data ) << 2
+    for addr in xrange( 0, size, _range_nbytes ):
+      nbytes = min( _range_nbytes, size - addr )
+      for i in xrange( addr >> 2, ( addr + nbytes ) >> 2 ):
+        if widen( self.data[i] ) != 0:
+          ranges.append( ( addr, nbytes ) )
+          break
+    return ranges
+
 #-----------------------------------------------------------------------
 # _ByteMemory
 #-----------------------------------------------------------------------
-class _ByteMemory( object ):
+class _ByteMemory( _Memory ):
   def __init__( self, data=None, size=2**10, suppress_debug=False ):
     self.data  = data if data else [' '] * size
     self.size  = len( self.data )
     self.debug = Debug()
     self.suppress_debug = suppress_debug
 
+    # set by the simulator to invalidate decoded instructions on writes
+    self.decode_cache = None
+
   def bounds_check( self, addr ):
     # check if the accessed data is larger than the memory size
     if addr > self.size:
@@ -222,6 +366,8 @@ class _ByteMemory( object ):
       value = value | ord( self.data[ start_addr + i ] )
     if self.debug.enabled( "mem" ) and not self.suppress_debug:
       print '%s' % pad_hex( value ),
+    if self.debug.trace is not None and not self.suppress_debug:
+      self.debug.trace.mem_read( start_addr, num_bytes, value )
     return value
 
   # this is instruction read, which is otherwise identical to read. The
@@ -240,18 +386,190 @@ class _ByteMemory( object ):
   def write( self, start_addr, num_bytes, value ):
     if self.debug.enabled( "memcheck" ) and not self.suppress_debug:
       self.bounds_check( start_addr )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, num_bytes )
     if self.debug.enabled( "mem" ) and not self.suppress_debug:
       print ':: WR.MEM[%s] = %s' % ( pad_hex( start_addr ),
                                      pad_hex( value ) ),
+    if self.debug.trace is not None and not self.suppress_debug:
+      self.debug.trace.mem_write( start_addr, num_bytes, value )
     for i in range( num_bytes ):
       self.data[ start_addr + i ] = chr(value & 0xFF)
       value = value >> 8
 
+  #---------------------------------------------------------------------
+  # read_bytes, write_bytes
+  #---------------------------------------------------------------------
+
+  def read_bytes( self, start_addr, num_bytes ):
+    data = ''.join( self.data[ start_addr : start_addr + num_bytes ] )
+    self.debug_read_bytes( start_addr, data )
+    return data
+
+  def write_bytes( self, start_addr, data ):
+    self.debug_write_bytes( start_addr, data )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, len( data ) )
+    for i in xrange( len( data ) ):
+      self.data[ start_addr + i ] = data[i]
+
+  #---------------------------------------------------------------------
+  # nonzero_ranges
+  #---------------------------------------------------------------------
+
+  def nonzero_ranges( self ):
+    ranges = []
+    for addr in xrange( 0, self.size, _range_nbytes ):
+      nbytes = min( _range_nbytes, self.size - addr )
+      for i in xrange( addr, addr + nbytes ):
+        if self.data[i] != '\0':
+          ranges.append( ( addr, nbytes ) )
+          break
+    return ranges
+
+#-----------------------------------------------------------------------
+# _ArrayMemory
+#-----------------------------------------------------------------------
+# Memory backed by an array of unsigned 32-bit words, used by
+# untranslated simulators. A list of boxed words takes several times the
+# space of the data it holds, while an array stores the words unboxed.
+# array is not RPython, so translated simulators use _WordMemory or
+# _ByteMemory instead.
+
+_word_typecode = 'I' if array( 'I' ).itemsize == 4 else 'L'
+
+class _ArrayMemory( _Memory ):
+  def __init__( self, data=None, size=2**10, suppress_debug=False ):
+    self.data  = data if data else array( _word_typecode, [0] ) * (size >> 2)
+    self.size  = len( self.data ) << 2
+    self.debug = Debug()
+    self.suppress_debug = suppress_debug
+
+    # TODO: pass data_section to memory for bounds checking
+    self.data_section = 0x00000000
+
+    # set by the simulator to invalidate decoded instructions on writes
+    self.decode_cache = None
+
+  def bounds_check( self, addr, x ):
+    # check if the accessed data is larger than the memory size
+    if addr > self.size:
+      print ("WARNING: %s accessing larger address than memory size. "
+             "addr=%s size=%s") % ( x, pad_hex( addr ), pad_hex( self.size ) )
+      raise Exception()
+    if addr == 0:
+      print "WARNING: accessing null pointer!"
+      raise Exception()
+
+    # Special write checks
+    if x == 'WR' and addr < self.data_section:
+      print ("WARNING: %s writing address below .data section!!!. "
+             "addr=%s size=%s") % ( x, pad_hex( addr ), pad_hex( self.data_section ) )
+      raise Exception()
+
+  def read( self, start_addr, num_bytes ):
+    word = start_addr >> 2
+    byte = start_addr &  0b11
+
+    if not self.suppress_debug and self.debug.enabled( "mem" ):
+      print ':: RD.MEM[%s] = ' % pad_hex( start_addr ),
+    if not self.suppress_debug and self.debug.enabled( "memcheck" ):
+      self.bounds_check( start_addr, 'RD' )
+
+    if   num_bytes == 4:  # TODO: byte should only be 0 (only aligned)
+      value = self.data[ word ]
+    elif num_bytes == 8:  # TODO: byte should only be 0 (only aligned)
+      value = self.data[ word ] | ( self.data[ word+1 ] << 32 )
+    elif num_bytes == 2:  # TODO: byte should only be 0, 1, 2, not 3
+      value = ( self.data[ word ] >> (byte * 8) ) & 0xFFFF
+    elif num_bytes == 1:
+      value = ( self.data[ word ] >> (byte * 8) ) & 0xFF
+    else:
+      raise Exception('Invalid num_bytes: %d!' % num_bytes)
+
+    if not self.suppress_debug and self.debug.enabled( "mem" ):
+      print '%s' % pad_hex( value ),
+    if not self.suppress_debug and self.debug.trace is not None:
+      self.debug.trace.mem_read( start_addr, num_bytes, value )
+
+    return r_uint( value )
+
+  # this is instruction read, which is otherwise identical to read
+  def iread( self, start_addr, num_bytes ):
+    assert start_addr & 0b11 == 0  # only aligned accesses allowed
+    return r_uint( self.data[ start_addr >> 2 ] )
+
+  def write( self, start_addr, num_bytes, value ):
+    word = start_addr >> 2
+    byte = start_addr &  0b11
+
+    if not self.suppress_debug and self.debug.enabled( "memcheck" ):
+      self.bounds_check( start_addr, 'WR' )
+    if not self.suppress_debug and self.debug.trace is not None:
+      self.debug.trace.mem_write( start_addr, num_bytes, value )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, num_bytes )
+
+    if   num_bytes == 4:  # TODO: byte should only be 0 (only aligned)
+      value = value & 0xFFFFFFFF
+    elif num_bytes == 8:  # TODO: byte should only be 0 (only aligned)
+      self.data[ word+1 ] = ( value >> 32 ) & 0xFFFFFFFF
+      value = value & 0xFFFFFFFF
+    elif num_bytes == 2:  # TODO: byte should only be 0, 1, 2, not 3
+      mask  = ~(0xFFFF << (byte * 8)) & 0xFFFFFFFF
+      value = ( self.data[ word ] & mask ) | ( (value & 0xFFFF) << (byte * 8) )
+    elif num_bytes == 1:
+      mask  = ~(0xFF   << (byte * 8)) & 0xFFFFFFFF
+      value = ( self.data[ word ] & mask ) | ( (value & 0xFF  ) << (byte * 8) )
+    else:
+      raise Exception('Invalid num_bytes: %d!' % num_bytes)
+
+    if not self.suppress_debug and self.debug.enabled( "mem" ):
+      print ':: WR.MEM[%s] = %s' % ( pad_hex( start_addr ),
+                                     pad_hex( value ) ),
+    self.data[ word ] = value
+
+  #---------------------------------------------------------------------
+  # read_bytes, write_bytes
+  #---------------------------------------------------------------------
+  # The words are converted to and from strings in bulk, which assumes
+  # a little-endian host like the rest of the simulator.
+
+  def read_bytes( self, start_addr, num_bytes ):
+    offset = start_addr & 0b11
+    words  = self.data[ start_addr >> 2 : (start_addr + num_bytes + 3) >> 2 ]
+    data   = words.tostring()[ offset : offset + num_bytes ]
+    self.debug_read_bytes( start_addr, data )
+    return data
+
+  def write_bytes( self, start_addr, data ):
+    self.debug_write_bytes( start_addr, data )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, len( data ) )
+    offset  = start_addr & 0b11
+    word_lo = start_addr >> 2
+    word_hi = (start_addr + len( data ) + 3) >> 2
+    buf = bytearray( self.data[ word_lo : word_hi ].tostring() )
+    buf[ offset : offset + len( data ) ] = data
+    self.data[ word_lo : word_hi ] = array( _word_typecode, str( buf ) )
+
+  #---------------------------------------------------------------------
+  # nonzero_ranges
+  #---------------------------------------------------------------------
+
+  def nonzero_ranges( self ):
+    ranges = []
+    for addr in xrange( 0, self.size, _range_nbytes ):
+      nbytes = min( _range_nbytes, self.size - addr )
+      if any( self.data[ addr >> 2 : ( addr + nbytes ) >> 2 ] ):
+        ranges.append( ( addr, nbytes ) )
+    return ranges
+
 #-----------------------------------------------------------------------
 # _SparseMemory
 #-----------------------------------------------------------------------
 
-class _SparseMemory( object ):
+class _SparseMemory( _Memory ):
   _immutable_fields_ = [ "BlockMemory", "block_size", "addr_mask",
                          "block_mask" ]
 
@@ -267,6 +585,9 @@ class _SparseMemory( object ):
     self.block_dict = {}
     self.debug = Debug()
 
+    # set by the simulator to invalidate decoded instructions on writes
+    self.decode_cache = None
+
   def add_block( self, block_addr ):
     #print "adding block: %x" % block_addr
     self.block_dict[ block_addr ] = self.BlockMemory( size=self.block_size,
@@ -319,17 +640,568 @@ class _SparseMemory( object ):
     value = block_mem.read( start_addr & self.addr_mask, num_bytes )
     if self.debug.enabled( "mem" ):
       print '%s' % pad_hex( value ),
+    if self.debug.trace is not None:
+      self.debug.trace.mem_read( start_addr, num_bytes, value )
     return value
 
   def write( self, start_addr, num_bytes, value ):
     if self.debug.enabled( "mem" ):
       print ':: WR.MEM[%s] = %s' % ( pad_hex( start_addr ),
                                      pad_hex( value ) ),
+    if self.debug.trace is not None:
+      self.debug.trace.mem_write( start_addr, num_bytes, value )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, num_bytes )
     block_addr = self.block_mask & start_addr
     block_addr = hint( block_addr, promote=True )
     block_mem = self.get_block_mem( block_addr )
     block_mem.write( start_addr & self.addr_mask, num_bytes, value )
 
+  #---------------------------------------------------------------------
+  # read_bytes, write_bytes
+  #---------------------------------------------------------------------
+  # Bulk copies are split at block boundaries.
+
+  def read_bytes( self, start_addr, num_bytes ):
+    chunks = []
+    addr   = start_addr
+    while num_bytes > 0:
+      offset = addr & self.addr_mask
+      nbytes = min( self.block_size - offset, num_bytes )
+      block_mem = self.get_block_mem( self.block_mask & addr )
+      chunks.append( block_mem.read_bytes( offset, nbytes ) )
+      addr       += nbytes
+      num_bytes  -= nbytes
+    data = ''.join( chunks )
+    self.debug_read_bytes( start_addr, data )
+    return data
+
+  def write_bytes( self, start_addr, data ):
+    self.debug_write_bytes( start_addr, data )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, len( data ) )
+    i = 0
+    while i < len( data ):
+      offset = start_addr & self.addr_mask
+      nbytes = min( self.block_size - offset, len( data ) - i )
+      block_mem = self.get_block_mem( self.block_mask & start_addr )
+      block_mem.write_bytes( offset, data[ i : i + nbytes ] )
+      start_addr += nbytes
+      i          += nbytes
+
+  #---------------------------------------------------------------------
+  # nonzero_ranges
+  #---------------------------------------------------------------------
+
+  def nonzero_ranges( self ):
+    ranges = []
+    for block_addr in sorted( self.block_dict.keys() ):
+      block_mem = self.block_dict[ block_addr ]
+      for addr, nbytes in block_mem.nonzero_ranges():
+        ranges.append( ( block_addr + addr, nbytes ) )
+    return ranges
+
+#-----------------------------------------------------------------------
+# _PagedMemory
+#-----------------------------------------------------------------------
+# Sparse memory which finds pages using a two-level page table indexed
+# by the address bits, rather than hashing the block address into a
+# dict like _SparseMemory. The pages most recently used for data and
+# for instructions are cached, since consecutive accesses tend to hit
+# the same page and then skip the page table walk altogether.
+
+class _PagedMemory( _Memory ):
+  _immutable_fields_ = [ "BlockMemory", "page_bits", "page_size",
+                         "offset_mask", "addr_mask", "l2_bits", "l2_mask" ]
+
+  def __init__( self, BlockMemory, page_bits=12, addr_bits=32 ):
+    self.BlockMemory = BlockMemory
+    self.page_bits   = page_bits
+    self.page_size   = 1 << page_bits
+    self.offset_mask = self.page_size - 1
+    self.addr_mask   = ( 1 << addr_bits ) - 1
+
+    # the page number is split evenly between the two levels, the
+    # second level tables are allocated on first use
+
+    self.l2_bits    = ( addr_bits - page_bits ) / 2
+    self.l2_mask    = ( 1 << self.l2_bits ) - 1
+    self.page_table = [ None ] * ( 1 << ( addr_bits - page_bits - self.l2_bits ) )
+
+    # last-hit caches for data and instruction pages
+
+    self.data_page_num = 0
+    self.data_page     = None
+    self.inst_page_num = 0
+    self.inst_page     = None
+
+    # lazily mapped ( start_addr, data ) pairs, see map_lazy
 
+    self.lazy_maps = []
+
+    self.debug = Debug()
+
+    # set by the simulator to invalidate decoded instructions on writes
+    self.decode_cache = None
+
+  #---------------------------------------------------------------------
+  # get_page
+  #---------------------------------------------------------------------
+  # Walks the page table, allocating the page if it is not mapped yet.
+
+  def get_page( self, page_num ):
+    table = self.page_table[ page_num >> self.l2_bits ]
+    if table is None:
+      table = [ None ] * ( self.l2_mask + 1 )
+      self.page_table[ page_num >> self.l2_bits ] = table
+    page = table[ page_num & self.l2_mask ]
+    if page is None:
+      page = self.BlockMemory( size=self.page_size, suppress_debug=True )
+      table[ page_num & self.l2_mask ] = page
+      for start_addr, data in self.lazy_maps:
+        self.fill_page( page, page_num, start_addr, data )
+    return page
+
+  #---------------------------------------------------------------------
+  # map_lazy
+  #---------------------------------------------------------------------
+  # Maps data, which only needs to support len() and slicing, at
+  # start_addr without copying it. Pages are filled in from the data
+  # when they are first touched, so the loader can map ELF sections
+  # straight from an mmapped file. This is not RPython.
+
+  def map_lazy( self, start_addr, data ):
+    self.lazy_maps.append( ( start_addr, data ) )
+
+    # pages which already exist are filled in right away
+
+    first_page = start_addr >> self.page_bits
+    last_page  = ( start_addr + len( data ) - 1 ) >> self.page_bits
+    for page_num in xrange( first_page, last_page + 1 ):
+      table = self.page_table[ page_num >> self.l2_bits ]
+      if table is not None and table[ page_num & self.l2_mask ] is not None:
+        self.fill_page( table[ page_num & self.l2_mask ], page_num,
+                        start_addr, data )
+
+  def fill_page( self, page, page_num, start_addr, data ):
+    page_addr = page_num << self.page_bits
+    lo = max( page_addr, start_addr )
+    hi = min( page_addr + self.page_size, start_addr + len( data ) )
+    if lo < hi:
+      page.write_bytes( lo - page_addr,
+                        str( data[ lo - start_addr : hi - start_addr ] ) )
+
+  @specialize.argtype(1)
+  def page_num( self, addr ):
+    return intmask( ( addr & self.addr_mask ) >> self.page_bits )
+
+  #---------------------------------------------------------------------
+  # refill_data_page, refill_inst_page
+  #---------------------------------------------------------------------
+  # Called on a miss in the last-hit caches.
+
+  def refill_data_page( self, page_num ):
+    self.data_page     = self.get_page( page_num )
+    self.data_page_num = page_num
+    return self.data_page
+
+  def refill_inst_page( self, page_num ):
+    self.inst_page     = self.get_page( page_num )
+    self.inst_page_num = page_num
+    return self.inst_page
+
+  @elidable
+  def iread( self, start_addr, num_bytes ):
+    start_addr = hint( start_addr, promote=True )
+    num_bytes  = hint( num_bytes,  promote=True )
+    end_addr   = start_addr + num_bytes - 1
+
+    page_num = self.page_num( start_addr )
+    page     = self.inst_page
+    if page is None or page_num != self.inst_page_num:
+      page = self.refill_inst_page( page_num )
+    # instructions of mixed-width ISAs can cross page boundaries, in
+    # which case we form the word from two instruction reads
+    if page_num == self.page_num( end_addr ):
+      return page.iread( start_addr & self.offset_mask, num_bytes )
+    else:
+      num_bytes1 = self.page_size - (start_addr & self.offset_mask)
+      num_bytes2 = num_bytes - num_bytes1
+
+      value1 = page.iread( start_addr & self.offset_mask, num_bytes1 )
+      page2  = self.refill_inst_page( self.page_num( end_addr ) )
+      value2 = page2.iread( 0, num_bytes2 )
+      return value1 | ( value2 << (num_bytes1*8) )
+
+  def read( self, start_addr, num_bytes ):
+    if self.debug.enabled( "mem" ):
+      print ':: RD.MEM[%s] = ' % pad_hex( start_addr ),
+    page_num = intmask( ( start_addr & self.addr_mask ) >> self.page_bits )
+    page_num = hint( page_num, promote=True )
+    page     = self.data_page
+    if page is None or page_num != self.data_page_num:
+      page = self.refill_data_page( page_num )
+    value = page.read( start_addr & self.offset_mask, num_bytes )
+    if self.debug.enabled( "mem" ):
+      print '%s' % pad_hex( value ),
+    if self.debug.trace is not None:
+      self.debug.trace.mem_read( start_addr, num_bytes, value )
+    return value
+
+  def write( self, start_addr, num_bytes, value ):
+    if self.debug.enabled( "mem" ):
+      print ':: WR.MEM[%s] = %s' % ( pad_hex( start_addr ),
+                                     pad_hex( value ) ),
+    if self.debug.trace is not None:
+      self.debug.trace.mem_write( start_addr, num_bytes, value )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, num_bytes )
+    page_num = intmask( ( start_addr & self.addr_mask ) >> self.page_bits )
+    page_num = hint( page_num, promote=True )
+    page     = self.data_page
+    if page is None or page_num != self.data_page_num:
+      page = self.refill_data_page( page_num )
+    page.write( start_addr & self.offset_mask, num_bytes, value )
+
+  #---------------------------------------------------------------------
+  # read_bytes, write_bytes
+  #---------------------------------------------------------------------
+  # Bulk copies are split at page boundaries.
+
+  def read_bytes( self, start_addr, num_bytes ):
+    chunks = []
+    addr   = start_addr
+    while num_bytes > 0:
+      offset = addr & self.offset_mask
+      nbytes = min( self.page_size - offset, num_bytes )
+      page   = self.get_page( intmask( ( addr & self.addr_mask )
+                                 >> self.page_bits ) )
+      chunks.append( page.read_bytes( offset, nbytes ) )
+      addr       += nbytes
+      num_bytes  -= nbytes
+    data = ''.join( chunks )
+    self.debug_read_bytes( start_addr, data )
+    return data
+
+  def write_bytes( self, start_addr, data ):
+    self.debug_write_bytes( start_addr, data )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, len( data ) )
+    i = 0
+    while i < len( data ):
+      offset = start_addr & self.offset_mask
+      nbytes = min( self.page_size - offset, len( data ) - i )
+      page   = self.get_page( intmask( ( start_addr & self.addr_mask )
+                                       >> self.page_bits ) )
+      page.write_bytes( offset, data[ i : i + nbytes ] )
+      start_addr += nbytes
+      i          += nbytes
+
+  #---------------------------------------------------------------------
+  # nonzero_ranges
+  #---------------------------------------------------------------------
+  # Pages which are lazily mapped but not allocated yet are included if
+  # their data is non-zero, without allocating them.
+
+  def nonzero_ranges( self ):
+    page_nums = {}
+    for i in xrange( len( self.page_table ) ):
+      table = self.page_table[i]
+      if table is None:
+        continue
+      for j in xrange( len( table ) ):
+        if table[j] is not None:
+          page_nums[ ( i << self.l2_bits ) | j ] = True
+
+    for start_addr, data in self.lazy_maps:
+      first_page = start_addr >> self.page_bits
+      last_page  = ( start_addr + len( data ) - 1 ) >> self.page_bits
+      for page_num in xrange( first_page, last_page + 1 ):
+        if page_num in page_nums:
+          continue
+        page_addr = page_num << self.page_bits
+        lo = max( page_addr, start_addr )
+        hi = min( page_addr + self.page_size, start_addr + len( data ) )
+        if data[ lo - start_addr : hi - start_addr ].strip( '\0' ):
+          page_nums[ page_num ] = False
+
+    ranges = []
+    for page_num in sorted( page_nums.keys() ):
+      page_addr = page_num << self.page_bits
+      if page_nums[ page_num ]:
+        page = self.get_page( page_num )
+        for addr, nbytes in page.nonzero_ranges():
+          ranges.append( ( page_addr + addr, nbytes ) )
+      else:
+        ranges.append( ( page_addr, self.page_size ) )
+    return ranges
+
+#-----------------------------------------------------------------------
+# SharedMemory
+#-----------------------------------------------------------------------
+# Returns a _SharedMemory with the contents and the program break of
+# mem.
+
+def SharedMemory( mem, addr_bits=32, num_control_words=0 ):
+  shared = _SharedMemory( addr_bits, num_control_words )
+  mem.suppress_debug = True
+  for addr, nbytes in mem.nonzero_ranges():
+    shared.write_bytes( addr, mem.read_bytes( addr, nbytes ) )
+  mem.suppress_debug = False
+  shared.set_breakpoint( mem.get_breakpoint() )
+  return shared
+
+#-----------------------------------------------------------------------
+# _SharedMemory
+#-----------------------------------------------------------------------
+# Memory that is shared by simulator processes forked after it has been
+# created, which run the harts of a multi-hart simulation in parallel.
+# The memory is a file in /dev/shm (which is unlinked right away) mapped
+# into the address space of the processes, so only the pages that are
+# touched take up host memory. The memory of the program is followed by
+# an 8-byte word which holds the program break, so that all processes
+# see the same one, and num_control_words more words for the simulator
+# (see read_control and write_control).
+#
+# Loads and stores access the mapping directly, with the relaxed
+# ordering of the host. Atomic memory operations lock the aligned
+# 8-byte granule they access with a lock on the file, which excludes
+# the atomic accesses of the other processes. A store only takes the
+# lock if this process accessed the granule atomically before, e.g., to
+# release a lock acquired with an amoswap, other plain stores are not
+# atomic with respect to the atomic operations of other processes.
+# Since a process can't observe the stores of other processes, a store
+# conditional succeeds if the location still holds the value loaded by
+# the load reserved (like QEMU does).
+#
+# Writes by other processes don't invalidate the decode cache of this
+# process, so self-modifying code is only supported within a hart.
+#
+# mmap, struct and fcntl are not RPython, so translated simulators map
+# the file with rmmap, access it through raw pointers and lock the
+# granules with fcntl in C.
+
+_shared_formats = { 1 : struct.Struct( "<B" ), 2 : struct.Struct( "<H" ),
+                    4 : struct.Struct( "<I" ), 8 : struct.Struct( "<Q" ) }
+
+_granule_bits = 3
+
+if rmmap is not None:
+  _lock_eci = ExternalCompilationInfo(
+    post_include_bits = [ "RPY_EXTERN int pydgin_lock_range( int, long, "
+                          "long, int );" ],
+    separate_module_sources = [ """
+#include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+RPY_EXTERN int pydgin_lock_range( int fd, long start, long len, int lock )
+{
+  struct flock fl;
+  int result;
+
+  fl.l_type   = lock ? F_WRLCK : F_UNLCK;
+  fl.l_whence = SEEK_SET;
+  fl.l_start  = start;
+  fl.l_len    = len;
+  do {
+    result = fcntl( fd, F_SETLKW, &fl );
+  } while ( result == -1 && errno == EINTR );
+  return result;
+}
+""" ] )
+
+  _lock_range = rffi.llexternal( "pydgin_lock_range",
+                                 [ rffi.INT, rffi.LONG, rffi.LONG, rffi.INT ],
+                                 rffi.INT, compilation_info=_lock_eci,
+                                 _nowrapper=True )
+
+class _SharedMemory( _Memory ):
+
+  def __init__( self, addr_bits=32, num_control_words=0,
+                shm_dir="/dev/shm" ):
+    self.fd = create_unlinked_file( [ shm_dir, "/tmp" ] )
+
+    self.size      = 1 << addr_bits
+    self.addr_mask = self.size - 1
+    nbytes         = self.size + 8 * ( 1 + num_control_words )
+    os.ftruncate( self.fd, nbytes )
+    if we_are_translated():
+      self.data = rmmap.mmap( self.fd, nbytes, rmmap.MAP_SHARED,
+                              rmmap.PROT_READ | rmmap.PROT_WRITE )
+    else:
+      self.data = mmap.mmap( self.fd, nbytes, mmap.MAP_SHARED,
+                             mmap.PROT_READ | mmap.PROT_WRITE )
+
+    self.debug = Debug()
+    self.suppress_debug = False
+
+    # set by the simulator to invalidate decoded instructions on writes
+    self.decode_cache = None
+
+    # the granules this process accessed atomically, used as a set, and
+    # whether an atomic operation holds the lock of its granule
+
+    self.atomic_granules = {}
+    self.in_atomic       = False
+
+  #---------------------------------------------------------------------
+  # load, store
+  #---------------------------------------------------------------------
+  # Access num_bytes at offset into the mapping.
+
+  def load( self, offset, num_bytes ):
+    if not we_are_translated():
+      return r_uint( _shared_formats[ num_bytes ].unpack_from(
+                       self.data, offset )[0] )
+
+    ptr = self.data.getptr( offset )
+    if num_bytes == 1:
+      return r_uint( rffi.cast( lltype.Unsigned,
+                                rffi.cast( rffi.UCHARP, ptr )[0] ) )
+    elif num_bytes == 2:
+      return r_uint( rffi.cast( lltype.Unsigned,
+                                rffi.cast( rffi.USHORTP, ptr )[0] ) )
+    elif num_bytes == 4:
+      return r_uint( rffi.cast( lltype.Unsigned,
+                                rffi.cast( rffi.UINTP, ptr )[0] ) )
+    else:
+      return r_uint( rffi.cast( lltype.Unsigned,
+                                rffi.cast( rffi.ULONGLONGP, ptr )[0] ) )
+
+  def store( self, offset, num_bytes, value ):
+    if not we_are_translated():
+      _shared_formats[ num_bytes ].pack_into( self.data, offset, value )
+      return
+
+    ptr = self.data.getptr( offset )
+    if num_bytes == 1:
+      rffi.cast( rffi.UCHARP, ptr )[0] = rffi.cast( rffi.UCHAR, value )
+    elif num_bytes == 2:
+      rffi.cast( rffi.USHORTP, ptr )[0] = rffi.cast( rffi.USHORT, value )
+    elif num_bytes == 4:
+      rffi.cast( rffi.UINTP, ptr )[0] = rffi.cast( rffi.UINT, value )
+    else:
+      rffi.cast( rffi.ULONGLONGP, ptr )[0] = \
+        rffi.cast( rffi.ULONGLONG, value )
+
+  #---------------------------------------------------------------------
+  # read, iread, write
+  #---------------------------------------------------------------------
+
+  @specialize.argtype(1)
+  def read( self, start_addr, num_bytes ):
+    start_addr = r_uint( start_addr )
+    if self.debug.enabled( "mem" ):
+      print ':: RD.MEM[%s] = ' % pad_hex( start_addr ),
+
+    value = self.load( intmask( start_addr & self.addr_mask ), num_bytes )
+
+    if self.debug.enabled( "mem" ):
+      print '%s' % pad_hex( value ),
+    if self.debug.trace is not None:
+      self.debug.trace.mem_read( start_addr, num_bytes, intmask( value ) )
+
+    return value
+
+  def iread( self, start_addr, num_bytes ):
+    return self.load( intmask( start_addr & self.addr_mask ), num_bytes )
+
+  @specialize.argtype(1, 3)
+  def write( self, start_addr, num_bytes, value ):
+    start_addr = r_uint( start_addr )
+    value      = r_uint( value )
+    if self.debug.trace is not None:
+      self.debug.trace.mem_write( start_addr, num_bytes, value )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, num_bytes )
+
+    offset = intmask( start_addr & self.addr_mask )
+    if num_bytes < 8:
+      value = value & ( ( r_uint( 1 ) << ( 8 * num_bytes ) ) - 1 )
+
+    if not self.in_atomic and \
+       ( offset >> _granule_bits ) in self.atomic_granules:
+      self.lock( offset, True )
+      self.store( offset, num_bytes, value )
+      self.lock( offset, False )
+    else:
+      self.store( offset, num_bytes, value )
+
+    if self.debug.enabled( "mem" ):
+      print ':: WR.MEM[%s] = %s' % ( pad_hex( start_addr ),
+                                     pad_hex( value ) ),
+
+  #---------------------------------------------------------------------
+  # atomic_begin, atomic_end, reservation_held
+  #---------------------------------------------------------------------
+
+  def lock( self, offset, locked ):
+    granule_nbytes = 1 << _granule_bits
+    start          = offset & ~( granule_nbytes - 1 )
+    if not we_are_translated():
+      cmd = fcntl.LOCK_EX if locked else fcntl.LOCK_UN
+      fcntl.lockf( self.fd, cmd, granule_nbytes, start, os.SEEK_SET )
+    else:
+      _lock_range( rffi.cast( rffi.INT, self.fd ),
+                   rffi.cast( rffi.LONG, start ),
+                   rffi.cast( rffi.LONG, granule_nbytes ),
+                   rffi.cast( rffi.INT, 1 if locked else 0 ) )
+
+  def atomic_begin( self, addr ):
+    offset = intmask( addr & self.addr_mask )
+    self.atomic_granules[ offset >> _granule_bits ] = True
+    self.lock( offset, True )
+    self.in_atomic = True
+
+  def atomic_end( self, addr ):
+    self.in_atomic = False
+    self.lock( intmask( addr & self.addr_mask ), False )
+
+  def reservation_held( self, addr, num_bytes, value ):
+    return self.load( intmask( addr & self.addr_mask ), num_bytes ) \
+           == r_uint( value )
+
+  #---------------------------------------------------------------------
+  # get_breakpoint, set_breakpoint, read_control, write_control
+  #---------------------------------------------------------------------
+  # The words after the memory of the program.
+
+  def get_breakpoint( self ):
+    return self.load( self.size, 8 )
+
+  def set_breakpoint( self, breakpoint ):
+    self.store( self.size, 8, r_uint( breakpoint ) )
+
+  def read_control( self, idx ):
+    return self.load( self.size + 8 * ( 1 + idx ), 8 )
+
+  @specialize.argtype(2)
+  def write_control( self, idx, value ):
+    self.store( self.size + 8 * ( 1 + idx ), 8, r_uint( value ) )
+
+  #---------------------------------------------------------------------
+  # read_bytes, write_bytes
+  #---------------------------------------------------------------------
+
+  def read_bytes( self, start_addr, num_bytes ):
+    offset = intmask( start_addr & self.addr_mask )
+    if not we_are_translated():
+      data = self.data[ offset : offset + num_bytes ]
+    else:
+      data = self.data.getslice( offset, num_bytes )
+    self.debug_read_bytes( start_addr, data )
+    return data
 
+  def write_bytes( self, start_addr, data ):
+    self.debug_write_bytes( start_addr, data )
+    if self.decode_cache is not None:
+      self.decode_cache.invalidate( start_addr, len( data ) )
+    offset = intmask( start_addr & self.addr_mask )
+    if not we_are_translated():
+      self.data[ offset : offset + len( data ) ] = data
+      return
 
+    ptr = self.data.getptr( offset )
+    for i in xrange( len( data ) ):
+      ptr[i] = data[i]
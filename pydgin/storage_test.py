@@ -0,0 +1,140 @@
+#=======================================================================
+# storage_test.py
+#=======================================================================
+
+from pydgin.storage import _PagedMemory, _ArrayMemory, _word_typecode, \
+                           _range_nbytes
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+
+def paged_memory():
+  return _PagedMemory( _ArrayMemory, page_bits=12 )
+
+def allocated_pages( mem ):
+  page_nums = []
+  for i in xrange( len( mem.page_table ) ):
+    if mem.page_table[i] is not None:
+      for j in xrange( len( mem.page_table[i] ) ):
+        if mem.page_table[i][j] is not None:
+          page_nums.append( ( i << mem.l2_bits ) | j )
+  return page_nums
+
+#-----------------------------------------------------------------------
+# test_paged_access
+#-----------------------------------------------------------------------
+# Accesses go to the page of their address, bulk copies are split at
+# page boundaries, and untouched memory reads as zero.
+
+def test_paged_access():
+  mem = paged_memory()
+  mem.write( 0x1000,     4, 0xdeadbeef )
+  mem.write( 0xfffff008, 8, 0x0123456789abcdef )
+  mem.write_bytes( 0x2ffe, "abcdef" )
+
+  assert mem.read( 0x1000,     4 ) == 0xdeadbeef
+  assert mem.read( 0x1001,     1 ) == 0xbe
+  assert mem.read( 0xfffff008, 8 ) == 0x0123456789abcdef
+  assert mem.read( 0xfffff00c, 4 ) == 0x01234567
+  assert mem.read( 0x2ffc,     4 ) == 0x62610000
+  assert mem.read( 0x3000,     4 ) == 0x66656463
+  assert mem.read_bytes( 0x2ffd, 8 ) == "\0abcdef\0"
+  assert mem.read( 0x5000,     4 ) == 0
+
+  assert allocated_pages( mem ) == [ 0x1, 0x2, 0x3, 0x5, 0xfffff ]
+
+#-----------------------------------------------------------------------
+# test_lazy_maps
+#-----------------------------------------------------------------------
+# Lazily mapped data is copied into a page when the page is first
+# touched, or right away if the page already exists.
+
+def test_lazy_maps():
+  mem = paged_memory()
+  mem.write( 0x1ff0, 4, 0x11111111 )
+  mem.map_lazy( 0x1ffc, "0123456789" )
+  assert allocated_pages( mem ) == [ 0x1 ]
+
+  assert mem.read( 0x1ff0, 4 ) == 0x11111111
+  assert mem.read_bytes( 0x1ffc, 4 ) == "0123"
+  assert mem.read_bytes( 0x2000, 8 ) == "456789\0\0"
+  assert allocated_pages( mem ) == [ 0x1, 0x2 ]
+
+  # the program may overwrite the data after the page was filled
+
+  mem.write_bytes( 0x2000, "xy" )
+  assert mem.read_bytes( 0x1ffc, 10 ) == "0123xy6789"
+
+#-----------------------------------------------------------------------
+# test_nonzero_ranges
+#-----------------------------------------------------------------------
+# Allocated pages are reported at the granularity of the pages, lazily
+# mapped pages without allocating them, and zero pages not at all.
+
+def test_nonzero_ranges():
+  mem = paged_memory()
+  mem.write( 0x1000, 4, 0x1 )
+  mem.read( 0x4000, 4 )
+  mem.write( 0x5000, 4, 0x0 )
+  mem.map_lazy( 0x7ffe, "ab" + "\0" * 0x1000 + "c" )
+  mem.map_lazy( 0xa000, "\0" * 0x100 )
+
+  assert mem.nonzero_ranges() == [ ( 0x1000, 0x1000 ), ( 0x7000, 0x1000 ),
+                                   ( 0x9000, 0x1000 ) ]
+  assert allocated_pages( mem ) == [ 0x1, 0x4, 0x5 ]
+
+#-----------------------------------------------------------------------
+# test_array_access
+#-----------------------------------------------------------------------
+# Sub-word writes keep the rest of their word, and values are returned
+# as unsigned.
+
+def test_array_access():
+  mem = _ArrayMemory( size=0x100 )
+  mem.write( 0x10, 8, 0xfedcba9876543210 )
+  mem.write( 0x11, 1, 0xab )
+  mem.write( 0x16, 2, 0xcdef )
+
+  assert mem.read( 0x10, 4 ) == 0x7654ab10
+  assert mem.read( 0x14, 4 ) == 0xcdefba98
+  assert mem.read( 0x10, 8 ) == 0xcdefba987654ab10
+  assert mem.read( 0x12, 2 ) == 0x7654
+  assert mem.iread( 0x14, 4 ) == 0xcdefba98
+
+  mem.write( 0x20, 4, -1 )
+  assert mem.read( 0x20, 4 ) == 0xffffffff
+  assert mem.read( 0x24, 4 ) == 0
+
+#-----------------------------------------------------------------------
+# test_array_bytes
+#-----------------------------------------------------------------------
+# Unaligned bulk copies only change their own bytes and keep the words
+# in the array.
+
+def test_array_bytes():
+  mem = _ArrayMemory( size=0x100 )
+  mem.write( 0x40, 4, 0x44434241 )
+  mem.write( 0x48, 4, 0x4c4b4a49 )
+  mem.write_bytes( 0x43, "12345" )
+
+  assert mem.read_bytes( 0x40, 12 ) == "ABC12345IJKL"
+  assert mem.read( 0x44, 4 ) == 0x35343332
+  assert mem.read_bytes( 0x45, 0 ) == ""
+  assert mem.data.typecode == _word_typecode
+  assert len( mem.data ) == 0x100 >> 2
+
+#-----------------------------------------------------------------------
+# test_array_nonzero_ranges
+#-----------------------------------------------------------------------
+# The ranges are reported in _range_nbytes granularity, the last one is
+# cut off at the end of the memory.
+
+def test_array_nonzero_ranges():
+  mem = _ArrayMemory( size=0x3800 )
+  assert mem.nonzero_ranges() == []
+
+  mem.write( 0x1ffc, 4, 0x1 )
+  mem.write( 0x3700, 1, 0x1 )
+  assert mem.nonzero_ranges() == [ ( 0x1000, _range_nbytes ),
+                                   ( 0x3000, 0x800 ) ]
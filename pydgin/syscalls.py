@@ -48,14 +48,9 @@
 
 import sys
 import os
-from pydgin.utils import r_uint, intmask
-
-try:
-  from rpython.rtyper.lltypesystem import lltype
-  from rpython.rtyper.lltypesystem import rffi
-  use_rpython = True
-except ImportError:
-  use_rpython = False
+from pydgin.utils  import r_uint, intmask, specialize
+from pydgin.vfs    import vfs
+from pydgin.replay import syscall_log, LOG_RECORD, LOG_REPLAY
 
 #-----------------------------------------------------------------------
 # os state and helpers
@@ -97,8 +92,178 @@ flag_table = [
 # reliable. Note that python Set object is not rpython either.
 file_descriptors = { 0: 0, 1: 1, 2: 2 }
 
+# the absolute filename and open flags of the files opened by the
+# program, which are needed to reopen them when restoring a checkpoint
+file_info = {}
+
+def absolute_path( filename ):
+  if filename.startswith( "/" ):
+    return filename
+  return os.getcwd() + "/" + filename
+
+#-------------------------------------------------------------------------
+# close_files
+#-------------------------------------------------------------------------
+# Closes the host files the program left open, so that the next
+# simulation in the same process (see batch.py) starts with only 0, 1
+# and 2 open.
+
+def close_files():
+  for fd in file_descriptors.keys():
+    if fd > 2:
+      try:
+        os.close( fd )
+      except OSError:
+        pass
+      del file_descriptors[fd]
+      del file_info[fd]
+
 # some common error values
 BAD_FD_ERRNO = 9
+EXDEV_ERRNO  = 18
+
+#-------------------------------------------------------------------------
+# OutputBuffer
+#-------------------------------------------------------------------------
+# Optionally buffers the writes of the simulated program to stdout and
+# stderr on the host, so that programs that print a character at a time
+# don't make a host syscall per character. The flush policy is one of:
+#
+# - BUFFER_NONE: writes go straight to the host (the default)
+# - BUFFER_LINE: flush on a newline or when the buffer reaches size bytes
+# - BUFFER_FULL: flush when the buffer reaches size bytes
+# - BUFFER_EXIT: only flush when the program exits
+#
+# In all policies, the buffers are flushed before the program reads from
+# stdin so that prompts are shown, and a buffered stream is flushed
+# before the other one is written so that stdout and stderr stay in
+# order.
+
+BUFFER_NONE = 0
+BUFFER_LINE = 1
+BUFFER_FULL = 2
+BUFFER_EXIT = 3
+
+buffer_policies = {
+  "none" : BUFFER_NONE,
+  "line" : BUFFER_LINE,
+  "full" : BUFFER_FULL,
+  "exit" : BUFFER_EXIT,
+}
+
+class OutputBuffer( object ):
+
+  def __init__( self ):
+    self.policy = BUFFER_NONE
+    self.size   = 4096
+
+    # the pending chunks and their total size, indexed by fd (1 or 2)
+
+    self.chunks = [ [], [], [] ]
+    self.nbytes = [ 0, 0, 0 ]
+
+  def set_policy( self, policy, size ):
+    self.flush_all()
+    self.policy = policy
+    self.size   = size
+
+  def is_buffered( self, fd ):
+    return self.policy != BUFFER_NONE and ( fd == 1 or fd == 2 )
+
+  #-----------------------------------------------------------------------
+  # write
+  #-----------------------------------------------------------------------
+  # Buffers data for fd, which must be 1 or 2, and returns the number of
+  # bytes written.
+
+  def write( self, fd, data ):
+    other_fd = 3 - fd
+    if self.nbytes[ other_fd ] > 0:
+      self.flush( other_fd )
+
+    self.chunks[ fd ].append( data )
+    self.nbytes[ fd ] += len( data )
+
+    if self.policy == BUFFER_LINE and '\n' in data:
+      self.flush( fd )
+    elif self.policy != BUFFER_EXIT and self.nbytes[ fd ] >= self.size:
+      self.flush( fd )
+
+    return len( data )
+
+  #-----------------------------------------------------------------------
+  # flush, flush_all
+  #-----------------------------------------------------------------------
+
+  def flush( self, fd ):
+    data = ''.join( self.chunks[ fd ] )
+    self.chunks[ fd ] = []
+    self.nbytes[ fd ] = 0
+    while len( data ) > 0:
+      nbytes = os.write( fd, data )
+      data   = data[ nbytes: ]
+
+  def flush_all( self ):
+    for fd in [ 1, 2 ]:
+      if self.nbytes[ fd ] > 0:
+        try:
+          self.flush( fd )
+        except OSError as e:
+          print "Could not flush the output of fd %d (errno=%d)" \
+                % ( fd, e.errno )
+
+output_buffer = OutputBuffer()
+
+#-------------------------------------------------------------------------
+# make_syscall_table
+#-------------------------------------------------------------------------
+# Builds a dense list of syscall handlers indexed by the syscall number
+# from the syscall number mapping of an ISA, so that dispatching a
+# syscall is a bounds check and a list lookup instead of a dict lookup.
+# Unimplemented syscall numbers map to None.
+
+def make_syscall_table( syscall_funcs ):
+  table = [ None ] * ( max( syscall_funcs.keys() ) + 1 )
+  for syscall_number, syscall_handler in syscall_funcs.items():
+    table[ syscall_number ] = syscall_handler
+  return table
+
+#-------------------------------------------------------------------------
+# get_syscall_handler
+#-------------------------------------------------------------------------
+# Returns the handler of syscall_number from a table built by
+# make_syscall_table, or None if the syscall is not implemented.
+
+def get_syscall_handler( table, syscall_number ):
+  if syscall_number < 0 or syscall_number >= len( table ):
+    return None
+  return table[ syscall_number ]
+
+#-------------------------------------------------------------------------
+# call_syscall
+#-------------------------------------------------------------------------
+# Calls the handler of a syscall and returns its return value and errno.
+# When recording, the syscall and its results are added to the syscall
+# log, and when replaying, the results come from the log instead (see
+# replay.py). Replaying only calls the handlers which have no effect
+# outside the simulation, and writes to stdout and stderr.
+
+def call_syscall( s, syscall_handler, syscall_number, arg0, arg1, arg2 ):
+  if syscall_log.mode == LOG_REPLAY:
+    retval, errno = syscall_log.replay_syscall( s, syscall_number,
+                                                arg0, arg1, arg2 )
+    if syscall_handler is syscall_exit or syscall_handler is syscall_brk or \
+       ( syscall_handler is syscall_write and ( arg0 == 1 or arg0 == 2 ) ):
+      syscall_handler( s, arg0, arg1, arg2 )
+    elif s.debug.enabled( "syscalls" ):
+      print "syscall_replay( num=%d )" % syscall_number,
+    return retval, errno
+
+  retval, errno = syscall_handler( s, arg0, arg1, arg2 )
+  if syscall_log.mode == LOG_RECORD:
+    syscall_log.record_syscall( s, syscall_number, arg0, arg1, arg2,
+                                retval, errno )
+  return retval, errno
 
 #-------------------------------------------------------------------------
 # Stat
@@ -148,7 +313,9 @@ class Stat( object ):
       self.buffer[ offset + i ] = chr( 0xff & val )
       val = val >> 8
 
-  # converts and copies the python stat object to the simulated memory
+  # converts and copies the python stat object (or the VirtualStat of a
+  # virtual file) to the simulated memory
+  @specialize.argtype(1)
   def copy_stat_to_mem( self, py_stat, mem, addr ):
 
     # we set the buffer fields one by one. Only copying the fields that
@@ -169,10 +336,10 @@ class Stat( object ):
 
     # now we can copy the buffer
 
-    # TODO: this could be more efficient
     assert addr >= 0
-    for i in xrange( Stat.SIZE ):
-      mem.write( addr + i, 1, ord( self.buffer[i] ) )
+    data = ''.join( self.buffer )
+    syscall_log.add_mem_write( addr, data )
+    mem.write_bytes( addr, data )
 
 #-------------------------------------------------------------------------
 # get_str
@@ -181,28 +348,13 @@ class Stat( object ):
 # is not provided, reads until a null character.
 
 def get_str( s, ptr, nchars=0 ):
-  # more efficient string building for large strings
-  if use_rpython and nchars > 1000:
-    char_arr = lltype.malloc( rffi.CArray( lltype.Char ),
-                              nchars, flavor="raw" )
-
-    for i in xrange( nchars ):
-      char_arr[i] = chr( s.mem.read( ptr + i, 1 ) )
-
-    # convert to string, free the char array and return the string
-    str = rffi.charpsize2str( char_arr, nchars )
-    lltype.free( char_arr, flavor="raw" )
-    return str
+  if nchars > 0:
+    return s.mem.read_bytes( ptr, nchars )
 
-  # the following is the naive and slow implementation
   str = ""
-  if nchars > 0:
-    for i in xrange( nchars ):
-      str += chr( s.mem.read( ptr + i, 1 ) )
-  else:
-    while s.mem.read( ptr, 1 ) != 0:
-      str += chr( s.mem.read( ptr, 1 ) )
-      ptr += 1
+  while s.mem.read( ptr, 1 ) != 0:
+    str += chr( s.mem.read( ptr, 1 ) )
+    ptr += 1
   return str
 
 #-------------------------------------------------------------------------
@@ -212,18 +364,17 @@ def get_str( s, ptr, nchars=0 ):
 # added to the end
 
 def put_str( s, ptr, str ):
-  for c in str:
-    s.mem.write( ptr, 1, ord( c ) )
-    ptr += 1
+  syscall_log.add_mem_write( ptr, str )
+  s.mem.write_bytes( ptr, str )
 
 #-------------------------------------------------------------------------
 # is_fd_open
 #-------------------------------------------------------------------------
-# checks if the fd is in the open file descriptors, returns True on
-# failure
+# checks if the fd is in the open file descriptors or is an open virtual
+# file, returns False on failure
 
 def is_fd_open( s, fd ):
-  if fd not in file_descriptors:
+  if fd not in file_descriptors and not vfs.is_open( fd ):
     if s.debug.enabled( "syscalls" ):
       print ( "Could not find fd=%d in open file_descriptors, " % fd ) + \
             "returning errno=9"
@@ -244,6 +395,8 @@ def syscall_exit( s, arg0, arg1, arg2 ):
   s.status = r_uint( exit_code )
   s.running = False
 
+  output_buffer.flush_all()
+
   #      ret_val    errno
   return exit_code, 0
 
@@ -263,8 +416,16 @@ def syscall_read( s, arg0, arg1, arg2 ):
   if not is_fd_open( s, fd ):
     return -1, BAD_FD_ERRNO
 
+  # show any buffered prompt before waiting for input
+
+  if fd == 0:
+    output_buffer.flush_all()
+
   try:
-    str = os.read( fd, nbytes )
+    if vfs.is_open( fd ):
+      str = vfs.read( fd, nbytes )
+    else:
+      str = os.read( fd, nbytes )
     nbytes_read = len( str )
 
     put_str( s, data_ptr, str )
@@ -299,7 +460,12 @@ def syscall_write( s, arg0, arg1, arg2 ):
   data = get_str( s, data_ptr, nbytes )
 
   try:
-    nbytes_written = os.write( fd, data )
+    if output_buffer.is_buffered( fd ):
+      nbytes_written = output_buffer.write( fd, data )
+    elif vfs.is_open( fd ):
+      nbytes_written = vfs.write( fd, data )
+    else:
+      nbytes_written = os.write( fd, data )
     errno = 0
 
   except OSError as e:
@@ -339,6 +505,16 @@ def syscall_open( s, arg0, arg1, arg2 ):
 
   filename = get_str( s, filename_ptr )
 
+  # files in the virtual filesystem are not opened on the host
+
+  if vfs.owns_path( filename ):
+    try:
+      return vfs.open( filename, open_flags ), 0
+    except OSError as e:
+      if s.debug.enabled( "syscalls" ):
+        print "OSError in syscall_open. errno=%d" % e.errno
+      return -1, e.errno
+
   # open vs. os.open():  http://stackoverflow.com/a/15039662
 
   try:
@@ -358,6 +534,7 @@ def syscall_open( s, arg0, arg1, arg2 ):
 
   if fd > 0:
     file_descriptors[fd] = fd
+    file_info[fd] = ( absolute_path( filename ), open_flags )
 
   return fd, errno
 
@@ -378,6 +555,10 @@ def syscall_close( s, arg0, arg1, arg2 ):
   if fd <= 2:
     return 0, 0
 
+  if vfs.is_open( fd ):
+    vfs.close( fd )
+    return 0, 0
+
   try:
     os.close( fd )
     errno = 0
@@ -389,6 +570,7 @@ def syscall_close( s, arg0, arg1, arg2 ):
   # remove fd only if the previous op succeeded
   if errno == 0:
     del file_descriptors[fd]
+    del file_info[fd]
 
   return 0 if errno == 0 else -1, errno
 
@@ -408,6 +590,12 @@ def syscall_link( s, arg0, arg1, arg2 ):
   src       = get_str( s, src_ptr )
   link_name = get_str( s, link_ptr )
 
+  # links between virtual and host files are not possible, and links
+  # within the virtual filesystem are not supported
+
+  if vfs.owns_path( src ) or vfs.owns_path( link_name ):
+    return -1, EXDEV_ERRNO
+
   try:
     os.link( src, link_name )
     errno = 0
@@ -434,7 +622,10 @@ def syscall_unlink( s, arg0, arg1, arg2 ):
 
 
   try:
-    os.unlink( path )
+    if vfs.owns_path( path ):
+      vfs.unlink( path )
+    else:
+      os.unlink( path )
     errno = 0
 
   except OSError as e:
@@ -464,7 +655,10 @@ def syscall_lseek( s, arg0, arg1, arg2 ):
     # NOTE: rpython gives some weird errors in rtyping stage if we don't
     # explicitly cast the return value of os.lseek to int
 
-    new_pos = int( os.lseek( fd, pos, how ) )
+    if vfs.is_open( fd ):
+      new_pos = vfs.lseek( fd, pos, how )
+    else:
+      new_pos = int( os.lseek( fd, pos, how ) )
     errno = 0
 
   except OSError as e:
@@ -491,14 +685,14 @@ def syscall_fstat( s, arg0, arg1, arg2 ):
     return -1, BAD_FD_ERRNO
 
   try:
-    # we get a python stat object
-    py_stat = os.fstat( fd )
-
     # we construct a new simulated Stat object
     stat = Stat()
 
-    # we convert this and copy it to the memory
-    stat.copy_stat_to_mem( py_stat, s.mem, buf_ptr )
+    # we get a python stat object, convert it and copy it to the memory
+    if vfs.is_open( fd ):
+      stat.copy_stat_to_mem( vfs.fstat( fd ), s.mem, buf_ptr )
+    else:
+      stat.copy_stat_to_mem( os.fstat( fd ), s.mem, buf_ptr )
 
     errno = 0
 
@@ -524,14 +718,14 @@ def syscall_stat( s, arg0, arg1, arg2 ):
   path = get_str( s, path_ptr )
 
   try:
-    # we get a python stat object
-    py_stat = os.stat( path )
-
     # we construct a new simulated Stat object
     stat = Stat()
 
-    # we convert this and copy it to the memory
-    stat.copy_stat_to_mem( py_stat, s.mem, buf_ptr )
+    # we get a python stat object, convert it and copy it to the memory
+    if vfs.owns_path( path ):
+      stat.copy_stat_to_mem( vfs.stat( path ), s.mem, buf_ptr )
+    else:
+      stat.copy_stat_to_mem( os.stat( path ), s.mem, buf_ptr )
 
     errno = 0
 
@@ -553,10 +747,12 @@ def syscall_brk( s, arg0, arg1, arg2 ):
   if s.debug.enabled( "syscalls" ):
     print "syscall_brk( addr=%x )" % new_brk,
 
+  # the break is kept by the memory, so that all harts see the same one
+
   if new_brk != 0:
-    s.breakpoint = r_uint( new_brk )
+    s.mem.set_breakpoint( r_uint( new_brk ) )
 
-  return intmask( s.breakpoint ), 0
+  return intmask( s.mem.get_breakpoint() ), 0
 
 #-----------------------------------------------------------------------
 # numcores
@@ -564,8 +760,7 @@ def syscall_brk( s, arg0, arg1, arg2 ):
 def syscall_numcores( s, arg0, arg1, arg2 ):
   if s.debug.enabled( "syscalls" ):
     print "syscall_numcores()",
-  # always return 1 until multicore is implemented!
-  return 1, 0
+  return s.num_harts, 0
 
 #-----------------------------------------------------------------------
 # uname
@@ -592,7 +787,6 @@ def syscall_uname( s, arg0, arg1, arg2 ):
   for field in struct:
     assert len(field) < field_nchars
 
-    # TODO: provide char/string block write interface to memory?
     padding = '\0' * (field_nchars - len(field))
     put_str( s, mem_addr, field + padding )
     mem_addr += field_nchars
@@ -0,0 +1,393 @@
+#=======================================================================
+# trace.py
+#=======================================================================
+# Writes a compact binary trace of the executed instructions, register
+# writes and memory accesses, as a faster alternative to the text
+# printed by the insts, rf and mem debug flags. Traces are meant to be
+# fed into timing models, and can be dumped as text with
+# scripts/dump-trace.py.
+#
+# The file starts with TRACE_MAGIC, followed by fixed-size records of
+# three little-endian 64-bit words:
+#
+#   word 0: kind (bits 0-7) | nbytes (bits 8-15) | index (bits 16-31)
+#   word 1: pc (TRACE_INST) or address (TRACE_MEM_*), 0 otherwise
+#   word 2: instruction bits, or the value written or read
+#
+# index is the register number of register writes. The records of an
+# instruction follow its TRACE_INST record.
+#
+# Compressed traces start with TRACE_MAGIC_COMPRESSED instead, followed
+# by blocks of records which are compressed independently with zlib.
+# Each block starts with two 64-bit words, the compressed and the
+# uncompressed size of the block.
+#
+# Traces can be streamed to a consumer process (e.g., a cache or timing
+# model) instead of written to disk, either through a named pipe or by
+# giving "|<command>" as the destination, which runs the command with
+# the trace on its standard input. The consumer can read the records
+# with read_trace( "-" ).
+
+import os
+import sys
+import zlib
+import struct
+from array import array
+
+from pydgin.utils import r_ulonglong, intmask, specialize
+try:
+  from rpython.rlib.objectmodel import we_are_translated
+  from rpython.rlib import rzlib
+except ImportError:
+  def we_are_translated():
+    return False
+  rzlib = None
+
+TRACE_MAGIC            = "PYDGIN-TRACE-01\n"
+TRACE_MAGIC_COMPRESSED = "PYDGIN-TRACE-Z1\n"
+
+TRACE_INST        = 1
+TRACE_REG_WRITE   = 2
+TRACE_FPREG_WRITE = 3
+TRACE_MEM_READ    = 4
+TRACE_MEM_WRITE   = 5
+
+TRACE_RECORD_WORDS  = 3
+TRACE_RECORD_NBYTES = 8 * TRACE_RECORD_WORDS
+
+# array has no typecode for 64-bit words on hosts with a 32-bit long
+
+_array_words = array( 'L' ).itemsize == 8
+
+#-----------------------------------------------------------------------
+# encode_words
+#-----------------------------------------------------------------------
+# Converts a list of 64-bit words to a little-endian string. Untranslated
+# simulators use an array if possible, which converts the words in bulk
+# (and assumes a little-endian host like the rest of the simulator),
+# while array is not RPython.
+
+def encode_words( words ):
+  if not we_are_translated() and _array_words:
+    return array( 'L', words ).tostring()
+
+  chars = [ '\0' ] * ( 8 * len( words ) )
+  for i in xrange( len( words ) ):
+    word = words[i]
+    for j in xrange( 8 ):
+      chars[ 8*i + j ] = chr( intmask( (word >> 8*j) & 0xFF ) )
+  return ''.join( chars )
+
+#-----------------------------------------------------------------------
+# compress_block
+#-----------------------------------------------------------------------
+# zlib is not RPython, so translated simulators use rzlib instead.
+
+def compress_block( data ):
+  if not we_are_translated() or rzlib is None:
+    return zlib.compress( data )
+
+  stream = rzlib.deflateInit()
+  try:
+    return rzlib.compress( stream, data, rzlib.Z_FINISH )
+  finally:
+    rzlib.deflateEnd( stream )
+
+#-----------------------------------------------------------------------
+# open_output
+#-----------------------------------------------------------------------
+# Opens the destination of a trace and returns its file descriptor and
+# the pid of the consumer process (or 0). Opening a named pipe blocks
+# until the consumer opens it for reading.
+
+def open_output( dest ):
+  if not dest.startswith( "|" ):
+    fd = os.open( dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644 )
+    return fd, 0
+
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    os.close( write_fd )
+    os.dup2( read_fd, 0 )
+    os.close( read_fd )
+    try:
+      os.execv( "/bin/sh", [ "/bin/sh", "-c", dest[ 1: ] ] )
+    finally:
+      os._exit( 127 )
+
+  os.close( read_fd )
+  return write_fd, pid
+
+#-----------------------------------------------------------------------
+# split_access
+#-----------------------------------------------------------------------
+# Splits an access of nbytes at addr into naturally aligned accesses of
+# up to 8 bytes, and returns their ( offset, nbytes ) pairs.
+
+def split_access( addr, nbytes ):
+  pieces = []
+  offset = 0
+  while offset < nbytes:
+    size = 8
+    while size > 1 and ( intmask( addr + offset ) & ( size - 1 ) != 0 or
+                         offset + size > nbytes ):
+      size >>= 1
+    pieces.append( ( offset, size ) )
+    offset += size
+  return pieces
+
+# Returns the little-endian value of nbytes of data at offset.
+
+def bytes_value( data, offset, nbytes ):
+  value = r_ulonglong( 0 )
+  for i in xrange( nbytes ):
+    value |= r_ulonglong( ord( data[ offset + i ] ) ) << ( 8 * i )
+  return value
+
+#-----------------------------------------------------------------------
+# Tracer
+#-----------------------------------------------------------------------
+# The interface of the objects that are notified of the executed
+# instructions, register writes and memory accesses through Debug.trace
+# (see debug.py). Besides the trace writer, the per-region statistics
+# (see stats.py) use it to observe memory accesses. mem_read_bytes and
+# mem_write_bytes are the bulk accesses of the loader and the syscalls
+# (see read_bytes and write_bytes in storage.py).
+
+class Tracer( object ):
+
+  def inst( self, pc, bits, nbytes=4 ):
+    pass
+
+  def reg_write( self, idx, value ):
+    pass
+
+  def fpreg_write( self, idx, value ):
+    pass
+
+  def mem_read( self, addr, nbytes, value ):
+    pass
+
+  def mem_write( self, addr, nbytes, value ):
+    pass
+
+  def mem_read_bytes( self, addr, data ):
+    pass
+
+  def mem_write_bytes( self, addr, data ):
+    pass
+
+  def close( self ):
+    pass
+
+#-----------------------------------------------------------------------
+# TracerPair
+#-----------------------------------------------------------------------
+# Forwards everything to two tracers.
+
+class TracerPair( Tracer ):
+
+  def __init__( self, first, second ):
+    self.first  = first
+    self.second = second
+
+  def inst( self, pc, bits, nbytes=4 ):
+    self.first .inst( pc, bits, nbytes )
+    self.second.inst( pc, bits, nbytes )
+
+  def reg_write( self, idx, value ):
+    self.first .reg_write( idx, value )
+    self.second.reg_write( idx, value )
+
+  def fpreg_write( self, idx, value ):
+    self.first .fpreg_write( idx, value )
+    self.second.fpreg_write( idx, value )
+
+  def mem_read( self, addr, nbytes, value ):
+    self.first .mem_read( addr, nbytes, value )
+    self.second.mem_read( addr, nbytes, value )
+
+  def mem_write( self, addr, nbytes, value ):
+    self.first .mem_write( addr, nbytes, value )
+    self.second.mem_write( addr, nbytes, value )
+
+  def mem_read_bytes( self, addr, data ):
+    self.first .mem_read_bytes( addr, data )
+    self.second.mem_read_bytes( addr, data )
+
+  def mem_write_bytes( self, addr, data ):
+    self.first .mem_write_bytes( addr, data )
+    self.second.mem_write_bytes( addr, data )
+
+  def close( self ):
+    self.first .close()
+    self.second.close()
+
+#-----------------------------------------------------------------------
+# TraceWriter
+#-----------------------------------------------------------------------
+# Records are buffered and written out once buffer_nrecords records have
+# accumulated, which is also the size of the compressed blocks. If the
+# consumer of a streamed trace exits early, the rest of the trace is
+# dropped and the simulation continues.
+
+WORD_MASK = r_ulonglong( 0xFFFFFFFFFFFFFFFF )
+
+class TraceWriter( Tracer ):
+
+  def __init__( self, dest, compress=False, buffer_nrecords=8192 ):
+    self.dest         = dest
+    self.compress     = compress
+    self.buffer_words = buffer_nrecords * TRACE_RECORD_WORDS
+    self.words        = []
+    self.num_records  = 0
+    self.num_bytes    = 0
+
+    self.fd, self.pid = open_output( dest )
+    if compress:
+      self.write_data( TRACE_MAGIC_COMPRESSED )
+    else:
+      self.write_data( TRACE_MAGIC )
+
+  # the values are signed or unsigned depending on the ISA and caller
+
+  @specialize.argtype(2, 3, 4, 5)
+  def record( self, kind, nbytes, index, addr, value ):
+    header = kind | ( intmask( nbytes ) << 8 ) | ( intmask( index ) << 16 )
+    self.words.append( r_ulonglong( header ) )
+    self.words.append( r_ulonglong( addr  ) & WORD_MASK )
+    self.words.append( r_ulonglong( value ) & WORD_MASK )
+    self.num_records += 1
+    if len( self.words ) >= self.buffer_words:
+      self.flush()
+
+  #---------------------------------------------------------------------
+  # inst, reg_write, fpreg_write, mem_read, mem_write
+  #---------------------------------------------------------------------
+  # Bulk accesses are written as the aligned accesses of up to 8 bytes
+  # that cover them.
+
+  def inst( self, pc, bits, nbytes=4 ):
+    self.record( TRACE_INST, nbytes, 0, pc, bits )
+
+  def reg_write( self, idx, value ):
+    self.record( TRACE_REG_WRITE, 0, idx, 0, value )
+
+  def fpreg_write( self, idx, value ):
+    self.record( TRACE_FPREG_WRITE, 0, idx, 0, value )
+
+  def mem_read( self, addr, nbytes, value ):
+    self.record( TRACE_MEM_READ, nbytes, 0, addr, value )
+
+  def mem_write( self, addr, nbytes, value ):
+    self.record( TRACE_MEM_WRITE, nbytes, 0, addr, value )
+
+  def mem_read_bytes( self, addr, data ):
+    for offset, nbytes in split_access( addr, len( data ) ):
+      self.record( TRACE_MEM_READ, nbytes, 0, addr + offset,
+                   bytes_value( data, offset, nbytes ) )
+
+  def mem_write_bytes( self, addr, data ):
+    for offset, nbytes in split_access( addr, len( data ) ):
+      self.record( TRACE_MEM_WRITE, nbytes, 0, addr + offset,
+                   bytes_value( data, offset, nbytes ) )
+
+  #---------------------------------------------------------------------
+  # flush, close
+  #---------------------------------------------------------------------
+
+  def write_data( self, data ):
+    if self.fd < 0:
+      return
+    try:
+      while len( data ) > 0:
+        nbytes = os.write( self.fd, data )
+        data   = data[ nbytes: ]
+        self.num_bytes += nbytes
+    except OSError as e:
+      print "WARNING: could not write the trace to %s (errno=%d), " \
+            "the rest of the trace is dropped" % ( self.dest, e.errno )
+      os.close( self.fd )
+      self.fd = -1
+
+  def flush( self ):
+    if len( self.words ) == 0:
+      return
+    data = encode_words( self.words )
+    self.words = []
+    if self.compress:
+      block = compress_block( data )
+      self.write_data( encode_words( [ r_ulonglong( len( block ) ),
+                                       r_ulonglong( len( data  ) ) ] ) )
+      self.write_data( block )
+    else:
+      self.write_data( data )
+
+  # waits for the consumer of a streamed trace to finish
+
+  def close( self ):
+    self.flush()
+    if self.fd >= 0:
+      os.close( self.fd )
+      self.fd = -1
+    if self.pid != 0:
+      os.waitpid( self.pid, 0 )
+    print "Wrote %d trace records (%d bytes) to %s" \
+          % ( self.num_records, self.num_bytes, self.dest )
+
+#-----------------------------------------------------------------------
+# read_trace
+#-----------------------------------------------------------------------
+# Yields the ( kind, nbytes, index, addr, value ) tuples of the records
+# of a trace file, or of the trace on standard input if filename is "-".
+# Compressed traces are detected from the magic string. This is used by
+# tools and consumers and is not RPython.
+
+_record_struct = struct.Struct( "<QQQ" )
+_header_struct = struct.Struct( "<QQ" )
+
+def read_chunks( f, compressed, chunk_nrecords ):
+  while True:
+    if not compressed:
+      data = f.read( chunk_nrecords * TRACE_RECORD_NBYTES )
+    else:
+      header = f.read( _header_struct.size )
+      if len( header ) == 0:
+        return
+      if len( header ) != _header_struct.size:
+        raise ValueError( "Truncated trace file" )
+      block_nbytes, data_nbytes = _header_struct.unpack( header )
+      block = f.read( block_nbytes )
+      if len( block ) != block_nbytes:
+        raise ValueError( "Truncated trace file" )
+      data = zlib.decompress( block )
+      if len( data ) != data_nbytes:
+        raise ValueError( "Corrupted trace file" )
+
+    if len( data ) % TRACE_RECORD_NBYTES != 0:
+      raise ValueError( "Truncated trace file" )
+    if len( data ) == 0:
+      return
+    yield data
+
+def read_trace( filename, chunk_nrecords=65536 ):
+  if filename == "-":
+    f = sys.stdin
+  else:
+    f = open( filename, "rb" )
+
+  try:
+    magic = f.read( len( TRACE_MAGIC ) )
+    if magic != TRACE_MAGIC and magic != TRACE_MAGIC_COMPRESSED:
+      raise ValueError( "%s is not a trace file" % filename )
+
+    compressed = magic == TRACE_MAGIC_COMPRESSED
+    for data in read_chunks( f, compressed, chunk_nrecords ):
+      for offset in xrange( 0, len( data ), TRACE_RECORD_NBYTES ):
+        word0, addr, value = _record_struct.unpack_from( data, offset )
+        yield ( word0 & 0xFF, (word0 >> 8) & 0xFF, (word0 >> 16) & 0xFFFF,
+                addr, value )
+  finally:
+    if f is not sys.stdin:
+      f.close()
@@ -0,0 +1,138 @@
+#=======================================================================
+# trace_test.py
+#=======================================================================
+
+import pytest
+
+from pydgin.debug   import Debug
+from pydgin.storage import Memory
+from pydgin.trace   import TraceWriter, read_trace, TRACE_MAGIC, \
+                           TRACE_MAGIC_COMPRESSED, TRACE_INST, \
+                           TRACE_REG_WRITE, TRACE_FPREG_WRITE, \
+                           TRACE_MEM_READ, TRACE_MEM_WRITE
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+# Writes the records of a few instructions to writer and returns them
+# as read_trace returns them.
+
+def write_records( writer, num_insts ):
+  records = []
+  for i in range( num_insts ):
+    pc = 0x10000 + 4 * i
+    writer.inst( pc, 0x00a58593 + i )
+    records.append( ( TRACE_INST, 4, 0, pc, 0x00a58593 + i ) )
+
+    writer.reg_write( i % 32, -i )
+    records.append( ( TRACE_REG_WRITE, 0, i % 32, 0,
+                      -i & 0xFFFFFFFFFFFFFFFF ) )
+
+    if i % 3 == 0:
+      writer.mem_read( 0x20000 + 8 * i, 8, 0x123456789abcdef0 )
+      records.append( ( TRACE_MEM_READ, 8, 0, 0x20000 + 8 * i,
+                        0x123456789abcdef0 ) )
+    if i % 5 == 0:
+      writer.mem_write( 0x20000 + i, 1, 0xff )
+      records.append( ( TRACE_MEM_WRITE, 1, 0, 0x20000 + i, 0xff ) )
+    if i % 7 == 0:
+      writer.fpreg_write( 31, 0x7ff8000000000000 )
+      records.append( ( TRACE_FPREG_WRITE, 0, 31, 0, 0x7ff8000000000000 ) )
+
+  writer.inst( 0x8000, 0xabcd, 2 )
+  records.append( ( TRACE_INST, 2, 0, 0x8000, 0xabcd ) )
+  return records
+
+#-----------------------------------------------------------------------
+# test_round_trip
+#-----------------------------------------------------------------------
+# The small buffer makes the writer flush (and compress) many blocks.
+
+@pytest.mark.parametrize( "compress", [ False, True ] )
+def test_round_trip( tmpdir, compress ):
+  filename = str( tmpdir.join( "test.trace" ) )
+  writer   = TraceWriter( filename, compress, buffer_nrecords=64 )
+  records  = write_records( writer, 1000 )
+  writer.close()
+
+  assert writer.num_records == len( records )
+  with open( filename, "rb" ) as f:
+    magic = f.read( len( TRACE_MAGIC ) )
+  if compress:
+    assert magic == TRACE_MAGIC_COMPRESSED
+  else:
+    assert magic == TRACE_MAGIC
+
+  assert list( read_trace( filename, chunk_nrecords=100 ) ) == records
+
+#-----------------------------------------------------------------------
+# test_bulk_accesses
+#-----------------------------------------------------------------------
+# The bulk accesses of the syscalls are traced as the aligned accesses
+# that cover them.
+
+def test_bulk_accesses( tmpdir ):
+  filename = str( tmpdir.join( "test.trace" ) )
+  writer   = TraceWriter( filename )
+  mem      = Memory( size=2**16 )
+  mem.debug = Debug()
+  mem.debug.add_trace( writer )
+
+  mem.write_bytes( 0x1003, "abcdefghijklm" )
+  assert mem.read_bytes( 0x1006, 2 ) == "de"
+  writer.close()
+
+  assert list( read_trace( filename ) ) == [
+    ( TRACE_MEM_WRITE, 1, 0, 0x1003, 0x61 ),
+    ( TRACE_MEM_WRITE, 4, 0, 0x1004, 0x65646362 ),
+    ( TRACE_MEM_WRITE, 8, 0, 0x1008, 0x6d6c6b6a69686766 ),
+    ( TRACE_MEM_READ,  2, 0, 0x1006, 0x6564 ),
+  ]
+
+#-----------------------------------------------------------------------
+# test_stream
+#-----------------------------------------------------------------------
+
+@pytest.mark.parametrize( "compress", [ False, True ] )
+def test_stream( tmpdir, compress ):
+  filename = str( tmpdir.join( "streamed.trace" ) )
+  writer   = TraceWriter( "|cat > " + filename, compress )
+  records  = write_records( writer, 100 )
+  writer.close()
+
+  assert list( read_trace( filename ) ) == records
+
+#-----------------------------------------------------------------------
+# test_empty
+#-----------------------------------------------------------------------
+
+@pytest.mark.parametrize( "compress", [ False, True ] )
+def test_empty( tmpdir, compress ):
+  filename = str( tmpdir.join( "empty.trace" ) )
+  TraceWriter( filename, compress ).close()
+  assert list( read_trace( filename ) ) == []
+
+#-----------------------------------------------------------------------
+# test_truncated
+#-----------------------------------------------------------------------
+
+@pytest.mark.parametrize( "compress", [ False, True ] )
+def test_truncated( tmpdir, compress ):
+  filename = str( tmpdir.join( "test.trace" ) )
+  writer   = TraceWriter( filename, compress )
+  write_records( writer, 10 )
+  writer.close()
+
+  with open( filename, "rb" ) as f:
+    data = f.read()
+  with open( filename, "wb" ) as f:
+    f.write( data[ :-5 ] )
+
+  with pytest.raises( ValueError ):
+    list( read_trace( filename ) )
+
+def test_not_a_trace( tmpdir ):
+  filename = tmpdir.join( "other.txt" )
+  filename.write( "this is not a trace file\n" )
+  with pytest.raises( ValueError ):
+    list( read_trace( str( filename ) ) )
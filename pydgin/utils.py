@@ -5,11 +5,12 @@
 
 try:
   from rpython.rlib.rarithmetic import r_uint, intmask, r_ulonglong
-  from rpython.rlib.objectmodel import specialize
+  from rpython.rlib.objectmodel import specialize, we_are_translated
 except ImportError:
   r_uint = lambda x : x
   r_ulonglong = lambda x : x
   intmask = lambda x : x
+  we_are_translated = lambda : False
   class Specialize:
     def argtype( self, fun, *args ):
       return lambda fun : fun
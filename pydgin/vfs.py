@@ -0,0 +1,367 @@
+#=======================================================================
+# vfs.py
+#=======================================================================
+# A virtual filesystem that serves the file I/O of the simulated program
+# from memory instead of the host filesystem. The input files of a
+# program are packed into an image with scripts/mkvfs.py and loaded with
+# the --vfs option. When many simulations run against the same inputs,
+# this avoids opening and reading the same host files over and over.
+#
+# Images are read-only and are shared by all simulations in a process
+# (and by forked workers). Each simulation sees the files of the image
+# through its own inodes, which initially refer to the (immutable) data
+# of the image, so writes by the program replace the data of its inodes
+# only, i.e., files are copied on write. Files created by the program
+# under paths that are not in the image go to the host as usual.
+#
+# The methods that access files mirror their os.* counterparts and
+# raise OSError on failure, so that the syscalls can handle virtual and
+# host files the same way.
+
+import os
+import errno
+
+from pydgin.misc      import FatalError
+from pydgin.serialize import BinaryReader, BinaryWriter
+
+VFS_MAGIC = "PYDGIN-VFS-1\n"
+
+# virtual files get file descriptors starting from here so that they
+# don't clash with the file descriptors of host files
+
+VIRTUAL_FD_BASE = 1024
+
+#-----------------------------------------------------------------------
+# normalize_path
+#-----------------------------------------------------------------------
+# Removes ./ components and repeated slashes so that the paths used by
+# the program match the paths in the image.
+
+def normalize_path( path ):
+  parts = [ part for part in path.split( "/" ) if part != "" and part != "." ]
+  path_str = "/".join( parts )
+  if path.startswith( "/" ):
+    return "/" + path_str
+  return path_str
+
+#-----------------------------------------------------------------------
+# load_image, save_image
+#-----------------------------------------------------------------------
+# An image is the VFS magic string followed by the number of files, and
+# the path and data of each file (see serialize.py for the encoding).
+# Loaded images are cached by filename, so loading an image again only
+# costs a dict lookup.
+
+images = {}
+
+def load_image( filename ):
+  if filename in images:
+    return images[ filename ]
+
+  reader = BinaryReader( filename, VFS_MAGIC, "virtual filesystem" )
+  files  = {}
+  num_files = reader.read_int()
+  for i in xrange( num_files ):
+    path = reader.read_str()
+    files[ normalize_path( path ) ] = reader.read_str()
+
+  images[ filename ] = files
+  return files
+
+def save_image( filename, files ):
+  writer = BinaryWriter( VFS_MAGIC )
+  writer.write_int( len( files ) )
+  for path, data in files.items():
+    writer.write_str( normalize_path( path ) )
+    writer.write_str( data )
+  writer.save( filename )
+
+#-----------------------------------------------------------------------
+# Inode
+#-----------------------------------------------------------------------
+# Programs usually write their output files sequentially in small
+# pieces, so writes at the end of the file are appended to a list of
+# chunks, which is only joined into data when the file is read. Writes
+# anywhere else replace data.
+
+class Inode( object ):
+
+  def __init__( self, data, modified ):
+    self.data     = data
+    self.modified = modified
+    self.chunks   = []
+    self.nbytes   = len( data )
+
+  def get_data( self ):
+    if len( self.chunks ) > 0:
+      self.chunks.insert( 0, self.data )
+      self.data   = ''.join( self.chunks )
+      self.chunks = []
+    return self.data
+
+  def size( self ):
+    return self.nbytes
+
+  def truncate( self ):
+    self.data     = ""
+    self.chunks   = []
+    self.nbytes   = 0
+    self.modified = True
+
+  # writing past the end leaves a hole of zeros
+
+  def write( self, offset, data ):
+    if offset >= self.nbytes:
+      if offset > self.nbytes:
+        self.chunks.append( '\0' * ( offset - self.nbytes ) )
+      self.chunks.append( data )
+      self.nbytes = offset + len( data )
+    else:
+      old_data = self.get_data()
+      end      = offset + len( data )
+      assert offset >= 0 and end >= offset
+      self.data   = old_data[ : offset ] + data + old_data[ end : ]
+      self.nbytes = len( self.data )
+    self.modified = True
+
+#-----------------------------------------------------------------------
+# VirtualFile
+#-----------------------------------------------------------------------
+# A virtual file opened by the program.
+
+class VirtualFile( object ):
+
+  def __init__( self, path, inode, flags ):
+    self.path   = path
+    self.inode  = inode
+    self.flags  = flags
+    self.offset = 0
+
+  def readable( self ):
+    return self.flags & ( os.O_WRONLY | os.O_RDWR ) != os.O_WRONLY
+
+  def writable( self ):
+    return self.flags & ( os.O_WRONLY | os.O_RDWR ) != 0
+
+#-----------------------------------------------------------------------
+# VirtualStat
+#-----------------------------------------------------------------------
+# Has the fields of the Python stat object that are used by Stat in
+# syscalls.py.
+
+class VirtualStat( object ):
+
+  def __init__( self, inode ):
+    self.st_mode  = 0100444 if not inode.modified else 0100644
+    self.st_ino   = 0
+    self.st_dev   = 0
+    self.st_nlink = 1
+    self.st_uid   = 0
+    self.st_gid   = 0
+    self.st_size  = inode.size()
+    self.st_atime = 0.0
+    self.st_mtime = 0.0
+    self.st_ctime = 0.0
+
+#-----------------------------------------------------------------------
+# VirtualFS
+#-----------------------------------------------------------------------
+
+class VirtualFS( object ):
+
+  def __init__( self ):
+    self.mount( {} )
+
+  #---------------------------------------------------------------------
+  # mount
+  #---------------------------------------------------------------------
+  # Starts serving the files of image (a dict of paths to data) and
+  # drops the files and state of the previous simulation.
+
+  def mount( self, image ):
+    self.image = image
+
+    # the inodes of the files which have been opened, created or deleted
+    # by the program, keyed by path. None marks a deleted file.
+
+    self.inodes = {}
+
+    self.open_files = {}
+
+  #---------------------------------------------------------------------
+  # owns_path
+  #---------------------------------------------------------------------
+  # Returns true if path is handled by the virtual filesystem rather
+  # than the host.
+
+  def owns_path( self, path ):
+    path = normalize_path( path )
+    return path in self.inodes or path in self.image
+
+  def lookup( self, path ):
+    path = normalize_path( path )
+    if path in self.inodes:
+      return self.inodes[ path ]
+    if path in self.image:
+      inode = Inode( self.image[ path ], False )
+      self.inodes[ path ] = inode
+      return inode
+    return None
+
+  def is_open( self, fd ):
+    return fd in self.open_files
+
+  def get_file( self, fd ):
+    if fd not in self.open_files:
+      raise OSError( errno.EBADF, "Bad file descriptor" )
+    return self.open_files[ fd ]
+
+  #---------------------------------------------------------------------
+  # open, close
+  #---------------------------------------------------------------------
+  # flags are the host open flags.
+
+  def open( self, path, flags ):
+    path  = normalize_path( path )
+    inode = self.lookup( path )
+
+    if inode is None:
+      if not flags & os.O_CREAT:
+        raise OSError( errno.ENOENT, "No such file or directory" )
+      inode = Inode( "", True )
+      self.inodes[ path ] = inode
+    elif flags & os.O_CREAT and flags & os.O_EXCL:
+      raise OSError( errno.EEXIST, "File exists" )
+
+    vfile = VirtualFile( path, inode, flags )
+    if flags & os.O_TRUNC and vfile.writable():
+      inode.truncate()
+
+    fd = VIRTUAL_FD_BASE
+    while fd in self.open_files:
+      fd += 1
+    self.open_files[ fd ] = vfile
+    return fd
+
+  def close( self, fd ):
+    self.get_file( fd )
+    del self.open_files[ fd ]
+
+  #---------------------------------------------------------------------
+  # read, write, lseek
+  #---------------------------------------------------------------------
+
+  def read( self, fd, nbytes ):
+    vfile = self.get_file( fd )
+    if not vfile.readable():
+      raise OSError( errno.EBADF, "Bad file descriptor" )
+    if nbytes < 0:
+      raise OSError( errno.EINVAL, "Invalid argument" )
+
+    data  = vfile.inode.get_data()
+    start = min( vfile.offset, len( data ) )
+    end   = min( start + nbytes, len( data ) )
+    assert start >= 0 and end >= start
+    vfile.offset = end
+    return data[ start : end ]
+
+  def write( self, fd, data ):
+    vfile = self.get_file( fd )
+    if not vfile.writable():
+      raise OSError( errno.EBADF, "Bad file descriptor" )
+
+    inode = vfile.inode
+    if vfile.flags & os.O_APPEND:
+      vfile.offset = inode.size()
+
+    inode.write( vfile.offset, data )
+    vfile.offset += len( data )
+    return len( data )
+
+  def lseek( self, fd, pos, how ):
+    vfile = self.get_file( fd )
+    if   how == os.SEEK_SET: new_pos = pos
+    elif how == os.SEEK_CUR: new_pos = vfile.offset + pos
+    elif how == os.SEEK_END: new_pos = vfile.inode.size() + pos
+    else:                    new_pos = -1
+
+    if new_pos < 0:
+      raise OSError( errno.EINVAL, "Invalid argument" )
+    vfile.offset = new_pos
+    return new_pos
+
+  #---------------------------------------------------------------------
+  # fstat, stat, unlink
+  #---------------------------------------------------------------------
+
+  def fstat( self, fd ):
+    return VirtualStat( self.get_file( fd ).inode )
+
+  def stat( self, path ):
+    inode = self.lookup( path )
+    if inode is None:
+      raise OSError( errno.ENOENT, "No such file or directory" )
+    return VirtualStat( inode )
+
+  def unlink( self, path ):
+    if self.lookup( path ) is None:
+      raise OSError( errno.ENOENT, "No such file or directory" )
+    self.inodes[ normalize_path( path ) ] = None
+
+  #---------------------------------------------------------------------
+  # save_checkpoint, restore_checkpoint
+  #---------------------------------------------------------------------
+  # Only the changes to the image are saved, the same image needs to be
+  # mounted when restoring. Open files whose path has been deleted are
+  # not saved.
+
+  def save_checkpoint( self, ckpt ):
+    changed = [ path for path, inode in self.inodes.items()
+                if inode is None or inode.modified ]
+    ckpt.write_int( len( changed ) )
+    for path in changed:
+      inode = self.inodes[ path ]
+      ckpt.write_str( path )
+      ckpt.write_int( 1 if inode is None else 0 )
+      ckpt.write_str( "" if inode is None else inode.get_data() )
+
+    fds = [ fd for fd, vfile in self.open_files.items()
+            if self.inodes.get( vfile.path, None ) is vfile.inode ]
+    ckpt.write_int( len( fds ) )
+    for fd in fds:
+      vfile = self.open_files[ fd ]
+      ckpt.write_int( fd )
+      ckpt.write_str( vfile.path )
+      ckpt.write_int( vfile.flags )
+      ckpt.write_int( vfile.offset )
+
+  def restore_checkpoint( self, ckpt ):
+    self.mount( self.image )
+
+    num_changed = ckpt.read_int()
+    for i in xrange( num_changed ):
+      path    = ckpt.read_str()
+      deleted = ckpt.read_int()
+      data    = ckpt.read_str()
+      if deleted:
+        self.inodes[ path ] = None
+      else:
+        self.inodes[ path ] = Inode( data, True )
+
+    num_files = ckpt.read_int()
+    for i in xrange( num_files ):
+      fd    = ckpt.read_int()
+      path  = ckpt.read_str()
+      flags = ckpt.read_int()
+      inode = self.lookup( path )
+      if inode is None:
+        raise FatalError( "File %s of the checkpoint is not in the mounted "
+                          "virtual filesystem" % path )
+      vfile = VirtualFile( path, inode, flags )
+      vfile.offset = ckpt.read_int()
+      self.open_files[ fd ] = vfile
+
+# the virtual filesystem used by the syscalls, which is empty unless an
+# image is mounted
+
+vfs = VirtualFS()
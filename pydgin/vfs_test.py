@@ -0,0 +1,182 @@
+#=======================================================================
+# vfs_test.py
+#=======================================================================
+
+import os
+import errno
+import pytest
+import subprocess
+import sys
+
+from pydgin.vfs import VirtualFS, load_image, save_image, images
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+
+def mount( files ):
+  vfs = VirtualFS()
+  vfs.mount( files )
+  return vfs
+
+def read_all( vfs, path ):
+  fd   = vfs.open( path, os.O_RDONLY )
+  data = vfs.read( fd, 1 << 20 )
+  vfs.close( fd )
+  return data
+
+#-----------------------------------------------------------------------
+# test_copy_on_write
+#-----------------------------------------------------------------------
+# Writes by one simulation must not change the image or the files seen
+# by the next simulation.
+
+def test_copy_on_write():
+  image = { "in.txt" : "hello world\n" }
+  vfs   = mount( image )
+
+  fd = vfs.open( "./in.txt", os.O_RDWR )
+  assert vfs.read( fd, 5 ) == "hello"
+  assert vfs.write( fd, " there" ) == 6
+  vfs.close( fd )
+
+  assert read_all( vfs, "in.txt" ) == "hello there\n"
+  assert vfs.stat( "in.txt" ).st_size == 12
+  assert image[ "in.txt" ] == "hello world\n"
+
+  vfs.mount( image )
+  assert read_all( vfs, "in.txt" ) == "hello world\n"
+
+#-----------------------------------------------------------------------
+# test_sequential_writes
+#-----------------------------------------------------------------------
+
+def test_sequential_writes():
+  vfs = mount( {} )
+  fd  = vfs.open( "out.txt", os.O_WRONLY | os.O_CREAT )
+  for i in range( 1000 ):
+    vfs.write( fd, "%d\n" % i )
+  assert vfs.fstat( fd ).st_size == len( "".join( "%d\n" % i
+                                                  for i in range( 1000 ) ) )
+  vfs.close( fd )
+
+  assert read_all( vfs, "out.txt" ) == \
+         "".join( "%d\n" % i for i in range( 1000 ) )
+
+#-----------------------------------------------------------------------
+# test_lseek_hole
+#-----------------------------------------------------------------------
+
+def test_lseek_hole():
+  vfs = mount( { "data" : "abc" } )
+  fd  = vfs.open( "data", os.O_RDWR )
+
+  assert vfs.lseek( fd, 2, os.SEEK_END ) == 5
+  vfs.write( fd, "xy" )
+  assert vfs.fstat( fd ).st_size == 7
+
+  assert vfs.lseek( fd, 1, os.SEEK_SET ) == 1
+  vfs.write( fd, "B" )
+  assert vfs.lseek( fd, -1, os.SEEK_CUR ) == 1
+  assert vfs.read( fd, 100 ) == "Bc\0\0xy"
+
+  with pytest.raises( OSError ) as excinfo:
+    vfs.lseek( fd, -8, os.SEEK_END )
+  assert excinfo.value.errno == errno.EINVAL
+  vfs.close( fd )
+
+  assert read_all( vfs, "data" ) == "aBc\0\0xy"
+
+#-----------------------------------------------------------------------
+# test_append_and_truncate
+#-----------------------------------------------------------------------
+
+def test_append_and_truncate():
+  vfs = mount( { "log" : "one\n" } )
+
+  fd = vfs.open( "log", os.O_WRONLY | os.O_APPEND )
+  vfs.write( fd, "two\n" )
+  vfs.close( fd )
+  assert read_all( vfs, "log" ) == "one\ntwo\n"
+
+  fd = vfs.open( "log", os.O_WRONLY | os.O_TRUNC )
+  vfs.write( fd, "three\n" )
+  vfs.close( fd )
+  assert read_all( vfs, "log" ) == "three\n"
+
+#-----------------------------------------------------------------------
+# test_unlink
+#-----------------------------------------------------------------------
+
+def test_unlink():
+  vfs = mount( { "tmp/a" : "a" } )
+  assert vfs.owns_path( "tmp//a" )
+
+  vfs.unlink( "tmp/a" )
+  with pytest.raises( OSError ) as excinfo:
+    vfs.open( "tmp/a", os.O_RDONLY )
+  assert excinfo.value.errno == errno.ENOENT
+  with pytest.raises( OSError ):
+    vfs.unlink( "tmp/a" )
+
+  # the deleted path stays virtual, so it can be created again
+
+  assert vfs.owns_path( "tmp/a" )
+  fd = vfs.open( "tmp/a", os.O_WRONLY | os.O_CREAT )
+  vfs.write( fd, "new" )
+  vfs.close( fd )
+  assert read_all( vfs, "tmp/a" ) == "new"
+
+  with pytest.raises( OSError ) as excinfo:
+    vfs.open( "tmp/a", os.O_WRONLY | os.O_CREAT | os.O_EXCL )
+  assert excinfo.value.errno == errno.EEXIST
+
+#-----------------------------------------------------------------------
+# test_bad_fd
+#-----------------------------------------------------------------------
+
+def test_bad_fd():
+  vfs = mount( { "ro" : "data" } )
+  fd  = vfs.open( "ro", os.O_RDONLY )
+  with pytest.raises( OSError ) as excinfo:
+    vfs.write( fd, "x" )
+  assert excinfo.value.errno == errno.EBADF
+  vfs.close( fd )
+  with pytest.raises( OSError ) as excinfo:
+    vfs.read( fd, 1 )
+  assert excinfo.value.errno == errno.EBADF
+
+#-----------------------------------------------------------------------
+# test_image_round_trip
+#-----------------------------------------------------------------------
+
+def test_image_round_trip( tmpdir ):
+  files = { "in.txt" : "text\n", "./dir//bin.dat" : "\0\1\2\xff" }
+  image = str( tmpdir.join( "test.vfs" ) )
+  save_image( image, files )
+
+  loaded = load_image( image )
+  assert loaded == { "in.txt" : "text\n", "dir/bin.dat" : "\0\1\2\xff" }
+  assert load_image( image ) is loaded
+  del images[ image ]
+
+#-----------------------------------------------------------------------
+# test_mkvfs
+#-----------------------------------------------------------------------
+
+def test_mkvfs( tmpdir ):
+  tmpdir.mkdir( "inputs" ).join( "a.txt" ).write( "a" )
+  tmpdir.join( "inputs" ).mkdir( "sub" ).join( "b.txt" ).write( "b" )
+  image  = str( tmpdir.join( "inputs.vfs" ) )
+  script = os.path.join( os.path.dirname( __file__ ),
+                         "../scripts/mkvfs.py" )
+
+  subprocess.check_call( [ sys.executable, script, "-C", str( tmpdir ),
+                           image, "inputs" ] )
+
+  loaded = load_image( image )
+  assert loaded == { "inputs/a.txt" : "a", "inputs/sub/b.txt" : "b" }
+  del images[ image ]
+
+  vfs = mount( loaded )
+  assert read_all( vfs, "./inputs/sub/b.txt" ) == "b"
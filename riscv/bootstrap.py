@@ -10,6 +10,10 @@ page_size   = 8192
 memory_size = 0xc0000000 + 1
 stack_base  = memory_size-1
 
+# with multiple harts, each hart gets a stack of this size below the
+# stack of the previous hart
+hart_stack_nbytes = 0x800000
+
 #-----------------------------------------------------------------------
 # syscall_init
 #-----------------------------------------------------------------------
@@ -107,14 +111,13 @@ def syscall_init( mem, breakpoint, argv, envp, debug ):
   # utility functions
 
   def str_to_mem( mem, val, addr ):
-    for i, char in enumerate(val+'\0'):
-      mem.write( addr + i, 1, ord( char ) )
+    mem.write_bytes( addr, val + '\0' )
     return addr + len(val) + 1
 
   def int_to_mem( mem, val, addr ):
     # TODO properly handle endianess
-    for i in range( 8 ):
-      mem.write( addr+i, 1, (val >> 8*i) & 0xFF )
+    mem.write_bytes( addr, ''.join( [ chr( (val >> 8*i) & 0xFF )
+                                      for i in range( 8 ) ] ) )
     return addr + 8
 
   # write end marker to memory
@@ -164,7 +167,7 @@ def syscall_init( mem, breakpoint, argv, envp, debug ):
   state = State( mem, debug, reset_addr=0x10000 )
 
   # TODO: where should this go?
-  state.breakpoint = r_uint( breakpoint )
+  mem.set_breakpoint( r_uint( breakpoint ) )
 
   #print '---'
   #print 'argc = %d (%x)' % ( argc,         stack_off[-1] )
@@ -201,3 +204,25 @@ def test_init( mem, debug ):
 
   return state
 
+
+#-----------------------------------------------------------------------
+# hart_init
+#-----------------------------------------------------------------------
+# initialize the state of hart hartid, which shares the memory of the
+# hart 0 state and starts with its pc and registers, except for the
+# stack pointer
+def hart_init( state, hartid, num_harts ):
+
+  hart = State( state.mem, state.debug, reset_addr=state.pc )
+
+  for i in range( state.rf.num_regs ):
+    hart.rf.regs[i] = state.rf.regs[i]
+  hart.rf[ reg_map['sp'] ] = state.rf[ reg_map['sp'] ] \
+                             - hartid * hart_stack_nbytes
+
+  hart.testbin   = state.testbin
+  hart.exe_name  = state.exe_name
+  hart.hartid    = hartid
+  hart.num_harts = num_harts
+
+  return hart
@@ -15,6 +15,9 @@ PRV_M = 3
 csr_map = {
             "fcsr"      :  0x003,
 
+            # setting stats to a non-zero value enables stats
+            "stats"     :  0x0c0,
+
             "mcpuid"    :  0xf00,
             "mimpid"    :  0xf01,
             "mhartid"   :  0xf10,
@@ -37,6 +40,8 @@ class Csr( object ):
   def get_csr( self, csr_id ):
     if   csr_id == csr_map[ "fcsr" ]:
       return self.state.fcsr
+    elif csr_id == csr_map[ "stats" ]:
+      return self.state.stats_en
     elif csr_id == csr_map[ "mcpuid" ]:
       return self.get_mcpuid()
     elif csr_id == csr_map[ "mstatus" ]:
@@ -55,6 +60,8 @@ class Csr( object ):
     if   csr_id == csr_map[ "fcsr" ]:
       # only the low 8 bits of fcsr should be non-zero
       self.state.fcsr = trim( val, 8 )
+    elif csr_id == csr_map[ "stats" ]:
+      self.state.stats_en = val
     elif csr_id == csr_map[ "mepc" ]:
       self.state.mepc = val
     elif csr_id == csr_map[ "mtohost" ]:
@@ -115,7 +122,7 @@ class Csr( object ):
   # Hart ID: Integer ID of the hardware thread running the code.
 
   def get_mhartid( self ):
-    return r_uint( 0 )
+    return r_uint( self.state.hartid )
 
   #-----------------------------------------------------------------------
   # get_mstatus
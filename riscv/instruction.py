@@ -5,10 +5,18 @@
 from pydgin.utils import r_ulonglong
 from utils import signed, sext_32, sext, trim_64
 
+#-------------------------------------------------------------------------
+# Instruction
+#-------------------------------------------------------------------------
+# All register fields and immediates are extracted once when the
+# instruction is decoded. Decoded instructions are kept in the decode
+# cache, so the instruction semantics only read plain attributes when
+# the instruction is executed again.
+
 class Instruction( object ):
-  def __init__( self, bits, str ):
-    self.bits = bits
-    self.str  = str
+  __slots__ = [ 'bits', 'str', 'rd', 'rs1', 'rs2', 'rs3', 'rm', 'csr',
+                'zimm', 'i_imm', 's_imm', 'sb_imm', 'u_imm', 'uj_imm' ]
+  _immutable_fields_ = __slots__
 
 #  int64_t i_imm() { return int64_t(b) >> 20; }
 #  int64_t s_imm() { return x(7, 5) + (xs(25, 7) << 5); }
@@ -22,6 +30,30 @@ class Instruction( object ):
 #  uint64_t rm()  { return x(12, 3)
 #  uint64_t csr() { return x(20, 12)
 
+  def __init__( self, bits, str ):
+    self.bits = bits
+    self.str  = str
+
+    self.rd   = self.x( 7, 5 )
+    self.rs1  = self.x( 15, 5 )
+    self.rs2  = self.x( 20, 5 )
+    self.rs3  = self.x( 27, 5 )
+    self.rm   = self.x( 12, 3 )
+    self.csr  = self.x( 20, 12 )
+    self.zimm = self.x( 15, 5 )
+
+    self.i_imm  = self.xs( 20, 12 )
+    self.s_imm  = self.x( 7, 5 ) + ( self.xs( 25, 7 ) << 5 )
+    self.sb_imm = ( self.x( 8, 4 )  << 1  ) + \
+                  ( self.x( 25, 6 ) << 5  ) + \
+                  ( self.x( 7, 1 )  << 11 ) + \
+                  ( self.imm_sign() << 12 )
+    self.u_imm  = sext_32( bits ) >> 12 << 12
+    self.uj_imm = ( self.x( 21, 10 ) << 1  ) + \
+                  ( self.x( 20, 1 )  << 11 ) + \
+                  ( self.x( 12, 8 )  << 12 ) + \
+                  ( self.imm_sign()  << 20 )
+
   def x( self, lo, len ):
     mask = r_ulonglong( 0xffffffffffffffff ) >> (64-len)
     return (self.bits >> lo) & mask
@@ -31,57 +63,3 @@ class Instruction( object ):
 
   def imm_sign( self ):
     return self.xs( 31, 1 )
-
-  @property
-  def i_imm(self):
-    return self.xs( 20, 12 )
-
-  @property
-  def s_imm(self):
-    return self.x(7, 5) + (self.xs(25, 7) << 5)
-
-  @property
-  def sb_imm(self):
-    return (self.x(8, 4) << 1) + \
-           (self.x(25,6) << 5) + \
-           (self.x(7,1) << 11) + \
-           (self.imm_sign() << 12)
-
-  @property
-  def u_imm(self):
-    return sext_32( self.bits ) >> 12 << 12
-
-  @property
-  def uj_imm(self):
-    return (self.x(21, 10) << 1) + \
-           (self.x(20, 1) << 11) + \
-           (self.x(12, 8) << 12) + \
-           (self.imm_sign() << 20)
-
-  @property
-  def rd(self):
-    return self.x(7, 5)
-
-  @property
-  def rs1(self):
-    return self.x(15, 5)
-
-  @property
-  def rs2(self):
-    return self.x(20, 5)
-
-  @property
-  def rs3(self):
-    return self.x(27, 5)
-
-  @property
-  def rm(self):
-    return self.x(12, 3)
-
-  @property
-  def csr(self):
-    return self.x(20, 12)
-
-  @property
-  def zimm(self):
-    return self.x(15, 5)
@@ -33,83 +33,107 @@ encodings = [
 
 def execute_lr_w( s, inst ):
   addr = s.rf[inst.rs1]
-  s.load_reservation = addr
-  s.rf[inst.rd] = s.mem.read( addr, 4 )
+  s.load_reservation  = addr
+  s.reservation_valid = True
+  s.reservation_value = s.mem.read( addr, 4 )
+  s.rf[inst.rd] = s.reservation_value
   s.pc += 4
 
 def execute_sc_w( s, inst ):
   addr = s.rf[inst.rs1]
-  if addr == s.load_reservation:
+  s.mem.atomic_begin( addr )
+  if s.reservation_valid and addr == s.load_reservation and \
+     s.mem.reservation_held( addr, 4, s.reservation_value ):
     s.mem.write( addr, 4, trim_32(s.rf[inst.rs2]) )
     s.rf[inst.rd] = 0
   else:
     s.rf[inst.rd] = 1
+  s.mem.atomic_end( addr )
+  s.reservation_valid = False
   s.pc += 4
 
 def execute_amoswap_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   s.mem.write( addr, 4, trim(s.rf[inst.rs2], 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amoadd_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   s.mem.write( addr, 4, trim(value + s.rf[inst.rs2], 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amoxor_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   s.mem.write( addr, 4, trim(value ^ s.rf[inst.rs2], 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amoor_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   s.mem.write( addr, 4, trim(value | s.rf[inst.rs2], 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amoand_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   s.mem.write( addr, 4, trim(value & s.rf[inst.rs2], 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amomin_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   new   = min( signed(value, 32), signed(s.rf[inst.rs2], 32) )
   s.mem.write( addr, 4, trim(new, 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amomax_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   new   = max( signed(value, 32), signed(s.rf[inst.rs2], 32) )
   s.mem.write( addr, 4, trim(new, 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amominu_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   new   = min( value, s.rf[inst.rs2] )
   s.mem.write( addr, 4, trim(new, 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
 def execute_amomaxu_w( s, inst ):
   addr  = s.rf[inst.rs1]
+  s.mem.atomic_begin( addr )
   value = s.mem.read( addr, 4 )
   new   = max( value, s.rf[inst.rs2] )
   s.mem.write( addr, 4, trim(new, 32))
   s.rf[inst.rd] = sext_32( value )
+  s.mem.atomic_end( addr )
   s.pc += 4
 
@@ -256,6 +256,8 @@ def execute_fence( s, inst ):
 
 def execute_fence_i( s, inst ):
   # TODO: MMU flush icache
+  if s.mem.decode_cache is not None:
+    s.mem.decode_cache.flush()
   s.pc += 4
 
 def execute_scall( s, inst ):
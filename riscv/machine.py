@@ -3,6 +3,7 @@
 #=========================================================================
 
 from pydgin.storage import RegisterFile
+from pydgin.trace   import Tracer
 from pydgin.utils import specialize, r_ulonglong
 from utils import trim_64
 from isa import ENABLE_FP
@@ -36,8 +37,11 @@ class State( object ):
       self.fcsr     = r_ulonglong( 0 )    # Bits( 32 )
     self.mem      = memory
 
+    # the reservation of lr and sc, see ReservationMonitor
     if self.extension_enabled( "a" ):
-      self.load_reservation = 0 # Bits( 64 )
+      self.load_reservation  = 0 # Bits( 64 )
+      self.reservation_valid = False
+      self.reservation_value = 0
 
     self    .debug = debug
     self.rf .debug = debug
@@ -70,6 +74,10 @@ class State( object ):
     self.num_insts       = 0
     self.stat_num_insts  = 0
 
+    # the id of this hart and the number of harts sharing the memory
+    self.hartid          = 0
+    self.num_harts       = 1
+
     # we need a dedicated running flag bacase status could be 0 on a
     # syscall_exit
     self.running       = True
@@ -80,15 +88,129 @@ class State( object ):
     # executable name
     self.exe_name = ""
 
-    # syscall stuff... TODO: should this be here?
-    self.breakpoint = 0
-
   def fetch_pc( self ):
     return self.pc
 
   def extension_enabled( self, ext ):
     return ext in self.extensions
 
+  #-----------------------------------------------------------------------
+  # save_checkpoint, restore_checkpoint
+  #-----------------------------------------------------------------------
+  # Write and read the architectural state to and from a checkpoint, see
+  # pydgin/checkpoint.py.
+
+  def save_checkpoint( self, ckpt ):
+    ckpt.write_int( self.pc )
+    for i in range( self.rf.num_regs ):
+      ckpt.write_int( self.rf.regs[i] )
+    if self.extension_enabled( "f" ):
+      for i in range( self.fp.num_regs ):
+        ckpt.write_int( self.fp.regs[i] )
+      ckpt.write_int( self.fcsr )
+    if self.extension_enabled( "a" ):
+      ckpt.write_int( self.load_reservation )
+      ckpt.write_int( 1 if self.reservation_valid else 0 )
+
+    ckpt.write_int( self.prv )
+    ckpt.write_int( self.mepc )
+    ckpt.write_int( self.mbadaddr )
+    ckpt.write_int( self.mtimecmp )
+    ckpt.write_int( self.mscratch )
+    ckpt.write_int( self.mcause )
+    ckpt.write_int( self.minstret )
+    ckpt.write_int( self.mie )
+    ckpt.write_int( self.mip )
+    ckpt.write_int( self.sepc )
+    ckpt.write_int( self.sbadaddr )
+    ckpt.write_int( self.sscratch )
+    ckpt.write_int( self.stvec )
+    ckpt.write_int( self.sptbr )
+    ckpt.write_int( self.scause )
+    ckpt.write_int( self.sutime_delta )
+    ckpt.write_int( self.suinstret_delta )
+    ckpt.write_int( self.tohost )
+    ckpt.write_int( self.fromhost )
+
+    ckpt.write_int( self.status )
+    ckpt.write_int( self.stats_en )
+    ckpt.write_int( self.num_insts )
+    ckpt.write_int( self.stat_num_insts )
+    ckpt.write_int( self.mem.get_breakpoint() )
+
+  def restore_checkpoint( self, ckpt ):
+    self.pc = ckpt.read_uint()
+    for i in range( self.rf.num_regs ):
+      self.rf.regs[i] = ckpt.read_uint()
+    if self.extension_enabled( "f" ):
+      for i in range( self.fp.num_regs ):
+        self.fp.regs[i] = ckpt.read_uint()
+      self.fcsr = r_ulonglong( ckpt.read_uint() )
+    if self.extension_enabled( "a" ):
+      self.load_reservation  = ckpt.read_uint()
+      self.reservation_valid = ckpt.read_int() != 0
+
+    self.prv             = ckpt.read_int()
+    self.mepc            = ckpt.read_uint()
+    self.mbadaddr        = ckpt.read_int()
+    self.mtimecmp        = ckpt.read_int()
+    self.mscratch        = ckpt.read_int()
+    self.mcause          = ckpt.read_int()
+    self.minstret        = ckpt.read_int()
+    self.mie             = ckpt.read_int()
+    self.mip             = ckpt.read_int()
+    self.sepc            = ckpt.read_uint()
+    self.sbadaddr        = ckpt.read_int()
+    self.sscratch        = ckpt.read_int()
+    self.stvec           = ckpt.read_int()
+    self.sptbr           = ckpt.read_int()
+    self.scause          = ckpt.read_int()
+    self.sutime_delta    = ckpt.read_int()
+    self.suinstret_delta = ckpt.read_int()
+    self.tohost          = ckpt.read_int()
+    self.fromhost        = ckpt.read_int()
+
+    self.status         = ckpt.read_uint()
+    self.stats_en       = ckpt.read_uint()
+    self.num_insts      = ckpt.read_int()
+    self.stat_num_insts = ckpt.read_int()
+    self.mem.set_breakpoint( ckpt.read_uint() )
+
+
+#-----------------------------------------------------------------------
+# ReservationMonitor
+#-----------------------------------------------------------------------
+# With multiple harts, a store to the reservation set of a hart (the
+# aligned granule containing the address of its last lr) invalidates
+# the reservation, so that its sc fails if another hart wrote to the
+# location in between. The monitor observes the stores through
+# Debug.trace, including the bulk writes of syscalls like read. Stores
+# of a hart to its own reservation set invalidate it as well, which the
+# ISA allows. With a single hart, only sc invalidates the reservation.
+
+RESERVATION_GRANULE_BITS = 3
+
+class ReservationMonitor( Tracer ):
+
+  def __init__( self, harts ):
+    self.harts = harts
+
+  def mem_write( self, addr, nbytes, value ):
+    self.invalidate( r_ulonglong( addr ), nbytes )
+
+  def mem_write_bytes( self, addr, data ):
+    if len( data ) > 0:
+      self.invalidate( r_ulonglong( addr ), len( data ) )
+
+  def invalidate( self, addr, nbytes ):
+    first = addr >> RESERVATION_GRANULE_BITS
+    last  = ( addr + nbytes - 1 ) >> RESERVATION_GRANULE_BITS
+    for hart in self.harts:
+      if hart.reservation_valid:
+        granule = r_ulonglong( hart.load_reservation ) \
+                  >> RESERVATION_GRANULE_BITS
+        if first <= granule and granule <= last:
+          hart.reservation_valid = False
 
 #-----------------------------------------------------------------------
 # RiscVRegisterFile
@@ -147,6 +269,8 @@ class RiscVFPRegisterFile( object ):
   def __setitem__( self, idx, value ):
     value = trim_64(value)
     self.regs[idx] = value
+    if self.debug.trace is not None:
+      self.debug.trace.fpreg_write( idx, value )
     if self.debug.enabled( "rf" ):
       print ':: WR.RF[%s] = %s' % (
                         pad( "%d" % idx, 2 ),
@@ -0,0 +1,69 @@
+#=======================================================================
+# machine_test.py
+#=======================================================================
+
+import os
+import sys
+
+sys.path.append( os.path.join( os.path.dirname( __file__ ), ".." ) )
+
+from pydgin.debug    import Debug
+from pydgin.storage  import Memory
+from pydgin.syscalls import syscall_open, syscall_read, put_str, \
+                            close_files
+from pydgin.vfs      import vfs
+from machine         import ReservationMonitor
+
+#-----------------------------------------------------------------------
+# helpers
+#-----------------------------------------------------------------------
+
+class Hart( object ):
+
+  def __init__( self, mem, load_reservation ):
+    self.mem               = mem
+    self.debug             = mem.debug
+    self.load_reservation  = load_reservation
+    self.reservation_valid = True
+
+def make_harts( reservations ):
+  mem       = Memory( size=2**16 )
+  mem.debug = Debug()
+  harts     = [ Hart( mem, addr ) for addr in reservations ]
+  mem.debug.add_trace( ReservationMonitor( harts ) )
+  return harts
+
+#-----------------------------------------------------------------------
+# test_store
+#-----------------------------------------------------------------------
+# Stores invalidate the reservations of their granules only.
+
+def test_store():
+  harts = make_harts( [ 0x1000, 0x1008 ] )
+  harts[0].mem.write( 0x100c, 4, 0x12345678 )
+  assert     harts[0].reservation_valid
+  assert not harts[1].reservation_valid
+
+#-----------------------------------------------------------------------
+# test_syscall_write
+#-----------------------------------------------------------------------
+# A read syscall into the reservation set of a hart invalidates the
+# reservation, so that its sc fails.
+
+def test_syscall_write( request ):
+  vfs.mount( { "in.txt" : "0123456789" } )
+  request.addfinalizer( close_files )
+
+  harts = make_harts( [ 0x1000, 0x1010, 0x1017 ] )
+  s     = harts[0]
+  put_str( s, 0x2000, "in.txt\0" )
+  assert harts[0].reservation_valid
+
+  fd, errno = syscall_open( s, 0x2000, 0, 0 )
+  assert errno == 0
+  num_read, errno = syscall_read( s, fd, 0x100e, 10 )
+  assert ( num_read, errno ) == ( 10, 0 )
+
+  assert     harts[0].reservation_valid
+  assert not harts[1].reservation_valid
+  assert not harts[2].reservation_valid
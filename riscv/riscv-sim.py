@@ -11,7 +11,8 @@ sys.path.append('..')
 from pydgin.sim     import Sim, init_sim
 from pydgin.storage import Memory
 from pydgin.misc    import load_program
-from bootstrap      import test_init, syscall_init, memory_size
+from bootstrap      import test_init, syscall_init, hart_init, memory_size
+from machine        import ReservationMonitor
 from instruction    import Instruction
 from isa            import decode
 
@@ -23,6 +24,11 @@ class RiscVSim( Sim ):
   def __init__( self ):
     Sim.__init__( self, 'RISC-V', 'riscv', jit_enabled=True )
 
+    # branch and jump instructions, for the per-region stats
+
+    self.branch_insts = [ 'jal', 'jalr', 'beq', 'bne', 'blt', 'bge',
+                          'bltu', 'bgeu' ]
+
   #-----------------------------------------------------------------------
   # decode
   #-----------------------------------------------------------------------
@@ -63,6 +69,22 @@ class RiscVSim( Sim ):
     self.state.testbin  = testbin
     self.state.exe_name = exe_name
 
+  #---------------------------------------------------------------------
+  # init_harts
+  #---------------------------------------------------------------------
+  # The harts share the memory, and a store by any hart invalidates the
+  # lr reservations of the harts on the stored location.
+
+  def init_harts( self, num_harts ):
+    self.state.num_harts = num_harts
+    harts = [ self.state ]
+    for hartid in range( 1, num_harts ):
+      harts.append( hart_init( self.state, hartid, num_harts ) )
+
+    if self.state.extension_enabled( "a" ):
+      self.debug.add_trace( ReservationMonitor( harts ) )
+    return harts
+
   #---------------------------------------------------------------------
   # run
   #---------------------------------------------------------------------
@@ -101,6 +101,8 @@ syscall_funcs = {
   SYS_ioctl          : cmn_sysc.syscall_ioctl,
 }
 
+syscall_table = cmn_sysc.make_syscall_table( syscall_funcs )
+
 # override stat fields.
 # XXX: we need a better way to do this
 #                             sz off
@@ -132,22 +134,24 @@ cmn_sysc.Stat.SIZE = 128
 #-------------------------------------------------------------------------
 
 def do_syscall( s ):
-  syscall_number = s.rf[17]
-  arg0 = intmask( s.rf[10] )
-  arg1 = intmask( s.rf[11] )
-  arg2 = intmask( s.rf[12] )
-  # TODO: riscv supports 6 syscall args, disabling higher args for the time
-  # being
-  #arg3 = s.rf[13]
-  #arg4 = s.rf[14]
-  #arg5 = s.rf[15]
+  syscall_number  = intmask( s.rf[17] )
+  syscall_handler = cmn_sysc.get_syscall_handler( syscall_table,
+                                                  syscall_number )
 
-  if syscall_number not in syscall_funcs:
+  if syscall_handler is None:
     print "WARNING: syscall not implemented: %d" % syscall_number
   else:
-    syscall_handler = syscall_funcs[ syscall_number ]
+    arg0 = intmask( s.rf[10] )
+    arg1 = intmask( s.rf[11] )
+    arg2 = intmask( s.rf[12] )
+    # TODO: riscv supports 6 syscall args, disabling higher args for the
+    # time being
+    #arg3 = s.rf[13]
+    #arg4 = s.rf[14]
+    #arg5 = s.rf[15]
 
-    retval, errno = syscall_handler( s, arg0, arg1, arg2 )
+    retval, errno = cmn_sysc.call_syscall( s, syscall_handler, syscall_number,
+                                           arg0, arg1, arg2 )
 
     if s.debug.enabled( "syscalls" ):
       print " retval=%x errno=%x" % ( retval, errno )
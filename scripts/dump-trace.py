@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#=========================================================================
+# dump-trace.py
+#=========================================================================
+# Prints the binary traces written with --trace as text, one record per
+# line, or a summary of the record counts with --stats. The trace is read
+# from standard input if <trace> is "-", e.g., to consume a trace while
+# it is streamed with --trace "|./dump-trace.py -".
+
+usage = """Usage:
+  ./dump-trace.py [flags] <trace or ->
+  Flags: -h,--help  this help message
+         --stats    only print the number of records of each kind
+"""
+
+import sys
+import os
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), ".." ) )
+from pydgin.trace import read_trace, TRACE_INST, TRACE_REG_WRITE, \
+                         TRACE_FPREG_WRITE, TRACE_MEM_READ, TRACE_MEM_WRITE
+
+kind_names = {
+  TRACE_INST        : "insts",
+  TRACE_REG_WRITE   : "reg writes",
+  TRACE_FPREG_WRITE : "fpreg writes",
+  TRACE_MEM_READ    : "mem reads",
+  TRACE_MEM_WRITE   : "mem writes",
+}
+
+#-------------------------------------------------------------------------
+# format_record
+#-------------------------------------------------------------------------
+
+def format_record( kind, nbytes, index, addr, value ):
+  if kind == TRACE_INST:
+    return "{:08x} {:0{}x}".format( addr, value, 2 * nbytes )
+  elif kind == TRACE_REG_WRITE:
+    return "  WR.RF[{}] = {:08x}".format( index, value )
+  elif kind == TRACE_FPREG_WRITE:
+    return "  WR.FP[{}] = {:016x}".format( index, value )
+  elif kind == TRACE_MEM_READ:
+    return "  RD.MEM[{:08x}] = {:0{}x}".format( addr, value, 2 * nbytes )
+  elif kind == TRACE_MEM_WRITE:
+    return "  WR.MEM[{:08x}] = {:0{}x}".format( addr, value, 2 * nbytes )
+  return "  unknown record kind {}".format( kind )
+
+#-------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------
+
+def main():
+  args  = sys.argv[1:]
+  stats = False
+  paths = []
+
+  for arg in args:
+    if arg == "-h" or arg == "--help":
+      print usage
+      return 1
+    elif arg == "--stats":
+      stats = True
+    else:
+      paths.append( arg )
+
+  if len( paths ) != 1:
+    print usage
+    return 1
+
+  counts = {}
+  try:
+    for record in read_trace( paths[0] ):
+      if stats:
+        counts[ record[0] ] = counts.get( record[0], 0 ) + 1
+      else:
+        print format_record( *record )
+  except ValueError as e:
+    print e
+    return 1
+
+  if stats:
+    for kind in sorted( counts.keys() ):
+      print "{:>12} {}".format( counts[ kind ],
+                                kind_names.get( kind, "kind {}".format( kind ) ) )
+  return 0
+
+if __name__ == "__main__":
+  sys.exit( main() )
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#=========================================================================
+# mkvfs.py
+#=========================================================================
+# Packs input files into a virtual filesystem image, which the simulators
+# load with --vfs <image> to serve the files from memory. Directories are
+# added recursively. The files are stored under the paths given on the
+# command line (relative to the directory given with -C), which should be
+# the paths the simulated program opens them with.
+
+usage = """Usage:
+  ./mkvfs.py [flags] <image> <files or directories>
+  Flags: -h,--help  this help message
+         -C <dir>   store the paths relative to <dir>
+"""
+
+import os
+import sys
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), ".." ) )
+from pydgin.vfs import save_image, normalize_path
+
+#-------------------------------------------------------------------------
+# add_path
+#-------------------------------------------------------------------------
+
+def add_path( files, root_dir, path ):
+  host_path = os.path.join( root_dir, path )
+  if os.path.isdir( host_path ):
+    for name in sorted( os.listdir( host_path ) ):
+      add_path( files, root_dir, os.path.join( path, name ) )
+  else:
+    with open( host_path, "rb" ) as f:
+      files[ normalize_path( path ) ] = f.read()
+
+#-------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------
+
+def main():
+  args     = sys.argv[1:]
+  root_dir = "."
+  paths    = []
+
+  i = 0
+  while i < len( args ):
+    arg = args[i]
+    if arg == "-h" or arg == "--help":
+      print usage
+      return 1
+    elif arg == "-C" and i + 1 < len( args ):
+      i += 1
+      root_dir = args[i]
+    else:
+      paths.append( arg )
+    i += 1
+
+  if len( paths ) < 2:
+    print usage
+    return 1
+
+  image = paths[0]
+  files = {}
+  for path in paths[1:]:
+    add_path( files, root_dir, path )
+
+  save_image( image, files )
+  print "Wrote {} files ({} bytes) to {}".format(
+          len( files ), sum( len( data ) for data in files.values() ), image )
+  return 0
+
+if __name__ == "__main__":
+  sys.exit( main() )
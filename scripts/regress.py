@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#=========================================================================
+# regress.py
+#=========================================================================
+# Runs the asm_test.py and ubmark_test.py regressions of each architecture
+# on a pool of worker processes. Unlike running the tests with py.test,
+# which starts a new python process per test, every worker imports the
+# simulator once and runs the tests in-process, so interpreter startup
+# and module loading are only paid once per worker.
+#
+# The tests and the simulator options are taken from the test files
+# themselves, so they need to be importable (i.e., pytest needs to be
+# installed and the test binaries need to be built). Translated
+# simulators are not run, use py.test for those.
+
+usage = """Usage:
+  ./regress.py [flags] [archs]
+  Flags: -h,--help      this help message
+         -jN            run on N worker processes per architecture (omit N
+                        for # of processors)
+         --suite <name> only run the asm or ubmark suite
+         -v,--verbose   print the output of failing tests
+  Archs: one or more of the following (all by default):
+         {}
+"""
+
+import imp
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+all_archs  = [ "parc", "arm", "riscv" ]
+all_suites = [ "asm", "ubmark" ]
+
+root_dir = os.path.abspath(
+             os.path.join( os.path.dirname( __file__ ), ".." ) )
+
+sys.path.insert( 0, root_dir )
+from pydgin.debug import Debug
+from pydgin.sim   import Sim
+
+# the test modules loaded by the parent, which are inherited by the
+# workers when they are forked
+
+test_modules = {}
+
+# the simulator module loaded by each worker
+
+sim_module = None
+
+#-------------------------------------------------------------------------
+# load_test_module
+#-------------------------------------------------------------------------
+# The test files use paths relative to their arch directory, which is
+# where py.test is run from.
+
+def load_test_module( arch, suite ):
+  os.chdir( os.path.join( root_dir, arch ) )
+  module_name = "{}_{}_test".format( arch, suite )
+  return imp.load_source( module_name, "{}_test.py".format( suite ) )
+
+#-------------------------------------------------------------------------
+# get_jobs
+#-------------------------------------------------------------------------
+# Returns the list of ( name, sim_argv, expected ) tuples of a suite.
+# expected holds the register values checked by arm asm tests.
+
+def get_jobs( arch, suite, module ):
+
+  # the simulator command lines start with python, which we drop
+
+  def sim_argv( sim_cmd, *args ):
+    return sim_cmd.split()[1:] + [ arg for arg in args if arg != "" ]
+
+  jobs = []
+  if suite == "asm" and arch == "arm":
+    for test_file, expected in module.file_tests:
+      elf_file = "asm_tests/build/{}".format( test_file )
+      jobs.append( ( test_file, sim_argv( module.python_dbg, elf_file ),
+                     expected ) )
+
+  elif suite == "asm":
+    for test in module.tests:
+      test_bin = "{}/{}".format( module.build_dir, test )
+      jobs.append( ( test, sim_argv( module.python_dbg, test_bin ), None ) )
+
+  else:
+    for sim_cmd in [ module.python, module.python_dbg ]:
+      for ubmark, iterations in module.configs:
+        name = os.path.basename( ubmark )
+        if iterations != "":
+          name += " " + iterations
+        if sim_cmd == module.python_dbg:
+          name += " (debug)"
+        jobs.append( ( name, sim_argv( sim_cmd, ubmark, iterations ),
+                       None ) )
+
+  return jobs
+
+#-------------------------------------------------------------------------
+# init_worker
+#-------------------------------------------------------------------------
+# The ISA modules of the architectures have the same names (isa,
+# bootstrap etc.), so a worker only ever loads a single architecture.
+
+def init_worker( arch ):
+  global sim_module
+
+  os.chdir( os.path.join( root_dir, arch ) )
+  sys.path.insert( 0, os.getcwd() )
+  sim_module = imp.load_source( "{}_sim".format( arch ),
+                                "{}-sim.py".format( arch ) )
+
+  # init_sim only enables debugs when the simulator is run directly
+
+  Debug.global_enabled = True
+
+#-------------------------------------------------------------------------
+# simulate
+#-------------------------------------------------------------------------
+# Runs a fresh simulator on argv and returns its output and the number of
+# simulated instructions. The syscalls write to file descriptor 1
+# directly, so we capture the output by redirecting the descriptor rather
+# than sys.stdout.
+
+def simulate( argv ):
+
+  sim_classes = [ obj for obj in vars( sim_module ).values()
+                  if isinstance( obj, type ) and issubclass( obj, Sim )
+                  and obj is not Sim ]
+  sim = sim_classes[0]()
+
+  out_file  = tempfile.TemporaryFile()
+  stdout_fd = os.dup( 1 )
+  sys.stdout.flush()
+  os.dup2( out_file.fileno(), 1 )
+
+  try:
+    sim.get_entry_point()( argv )
+  except Exception:
+    print traceback.format_exc()
+  finally:
+    sys.stdout.flush()
+    os.dup2( stdout_fd, 1 )
+    os.close( stdout_fd )
+
+  out_file.seek( 0 )
+  output = out_file.read()
+  out_file.close()
+
+  num_insts = sim.state.num_insts if hasattr( sim, "state" ) else 0
+  return output, num_insts
+
+#-------------------------------------------------------------------------
+# check_output
+#-------------------------------------------------------------------------
+# Performs the same checks as the test files and returns an error
+# message, or an empty string if the test passed.
+
+def check_output( arch, suite, output, expected ):
+
+  if "Traceback (most recent call last)" in output:
+    return "exception in simulator"
+
+  if suite == "asm" and arch == "arm":
+    rf = test_modules[ arch, suite ].get_regs_from_output( output )
+    for key in expected:
+      if key not in rf:
+        return "register {} not found in output".format( key )
+      if rf[ key ] != expected[ key ]:
+        return "register {}: {:x} != {:x}".format( key, rf[ key ],
+                                                   expected[ key ] )
+    return ""
+
+  if "Reached the max_insts" in output:
+    return "reached max_insts"
+  if suite == "asm" and "FAILED" in output:
+    return "FAILED in output"
+  if suite == "ubmark" and "failed" in output:
+    return "failed in output"
+  if "passed" not in output:
+    return "passed not in output"
+  return ""
+
+#-------------------------------------------------------------------------
+# run_job
+#-------------------------------------------------------------------------
+
+def run_job( job ):
+  arch, suite, name, argv, expected = job
+
+  start_time = time.time()
+  output, num_insts = simulate( argv )
+  elapsed = time.time() - start_time
+
+  error = check_output( arch, suite, output, expected )
+
+  # only send back the output of failing tests, the debug output of
+  # passing tests can be large
+
+  return ( arch, suite, name, error, elapsed, num_insts,
+           output if error != "" else "" )
+
+#-------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------
+
+def main():
+  args = sys.argv[1:]
+
+  num_processes = 1
+  suites        = all_suites
+  verbose       = False
+  archs         = []
+
+  i = 0
+  while i < len( args ):
+    arg = args[i]
+    if arg == "-h" or arg == "--help":
+      print usage.format( ", ".join( all_archs ) )
+      return 1
+    elif arg.startswith( "-j" ):
+      if arg == "-j":
+        num_processes = multiprocessing.cpu_count()
+      else:
+        num_processes = int( arg[2:] )
+    elif arg == "--suite" and i + 1 < len( args ):
+      i += 1
+      suites = [ args[i] ]
+    elif arg == "-v" or arg == "--verbose":
+      verbose = True
+    elif arg in all_archs:
+      archs.append( arg )
+    else:
+      print "Unknown argument:", arg
+      print usage.format( ", ".join( all_archs ) )
+      return 1
+    i += 1
+
+  if len( archs ) == 0:
+    archs = all_archs
+
+  # load the test files and collect the jobs
+
+  jobs = {}
+  for arch in archs:
+    jobs[ arch ] = []
+    for suite in suites:
+      try:
+        module = load_test_module( arch, suite )
+      except Exception as e:
+        print "Skipping {} {} tests: {}".format( arch, suite, e )
+        continue
+      test_modules[ arch, suite ] = module
+      for name, argv, expected in get_jobs( arch, suite, module ):
+        jobs[ arch ].append( ( arch, suite, name, argv, expected ) )
+
+  # run the jobs of each architecture on its own pool
+
+  num_tests   = 0
+  failed      = []
+  total_time  = 0.0
+  total_insts = 0
+  start_time  = time.time()
+
+  for arch in archs:
+    if len( jobs[ arch ] ) == 0:
+      continue
+
+    pool = multiprocessing.Pool( num_processes, init_worker, ( arch, ) )
+    for result in pool.imap_unordered( run_job, jobs[ arch ] ):
+      _, suite, name, error, elapsed, num_insts, output = result
+
+      num_tests   += 1
+      total_time  += elapsed
+      total_insts += num_insts
+
+      print "{:4s} {:5s} {:6s} {:32s} {:7.2f}s {:10d} insts {:8.1f} KIPS {}" \
+            .format( "PASS" if error == "" else "FAIL", arch, suite, name,
+                     elapsed, num_insts,
+                     num_insts / elapsed / 1000 if elapsed > 0 else 0.0,
+                     error )
+      if error != "":
+        failed.append( "{} {} {}".format( arch, suite, name ) )
+        if verbose:
+          print output
+      sys.stdout.flush()
+
+    pool.close()
+    pool.join()
+
+  wall_time = time.time() - start_time
+
+  print
+  print "{} tests, {} passed, {} failed in {:.2f}s".format(
+          num_tests, num_tests - len( failed ), len( failed ), wall_time )
+  print "{} instructions simulated in {:.2f}s of simulation time " \
+        "({:.1f} KIPS per worker, {:.1f} KIPS overall)".format(
+          total_insts, total_time,
+          total_insts / total_time / 1000 if total_time > 0 else 0.0,
+          total_insts / wall_time  / 1000 if wall_time  > 0 else 0.0 )
+  for test in failed:
+    print "FAILED:", test
+
+  return 1 if len( failed ) > 0 else 0
+
+if __name__ == "__main__":
+  sys.exit( main() )
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#=========================================================================
+# submit-job.py
+#=========================================================================
+# Submits a simulation to a job server started with --server (see
+# pydgin/server.py) and prints the output of the simulation as if the
+# simulator had been run locally, or the whole response with --json.
+# The job runs in the current directory, and the exit code is that of
+# the simulator.
+
+usage = """Usage:
+  ./submit-job.py [flags] <socket> <args> <sim_exe> <sim_args>
+  Flags: -h,--help  this help message
+         --json     print the response of the server as JSON
+"""
+
+import sys
+import os
+import json
+import socket
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__ ), ".." ) )
+from pydgin.server import submit
+
+#-------------------------------------------------------------------------
+# main
+#-------------------------------------------------------------------------
+
+def main():
+  args     = sys.argv[1:]
+  raw_json = False
+
+  while len( args ) > 0 and args[0].startswith( "-" ):
+    if args[0] == "-h" or args[0] == "--help":
+      print usage
+      return 1
+    elif args[0] == "--json":
+      raw_json = True
+    else:
+      print usage
+      return 1
+    args = args[1:]
+
+  if len( args ) < 2:
+    print usage
+    return 1
+
+  try:
+    response = submit( args[0], args[1:], os.getcwd() )
+  except ( socket.error, ValueError ) as e:
+    print "Could not submit the job to {}: {}".format( args[0], e )
+    return 1
+
+  if raw_json:
+    print json.dumps( response, indent=2, sort_keys=True )
+  else:
+    sys.stdout.write( response.get( "stdout", "" ).encode( "utf-8" ) )
+    sys.stderr.write( response.get( "stderr", "" ).encode( "utf-8" ) )
+
+  if "error" in response:
+    if not raw_json:
+      print "Error in the job server: {}".format( response[ "error" ] )
+    return 1
+  return response[ "return_code" ]
+
+if __name__ == "__main__":
+  sys.exit( main() )